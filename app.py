@@ -1,29 +1,46 @@
 # main.py
 import logging
-from flask import Flask, request, jsonify
-from tinkoff.invest import Client, OrderDirection, OrderType
-from tinkoff.invest.constants import INVEST_GRPC_API
-from order_monitor import monitor_order_completion
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from tinkoff.invest import OrderDirection, OrderType
+from order_monitor import OrderTracker, FAILED_STATUSES
 from tinkoff_api import initialize_account, TOKEN
+from broker_client import open_client, guard
 from notifier import notify_error
 from validator import validate_webhook_data
-from instrument_manager import get_instrument_data
+from instrument_manager import (
+    get_instrument_data,
+    get_tick_scale,
+    get_instrument_meta,
+    get_cache_stats,
+)
+from risk_manager import risk_engine
+from tick_math import NANO, round_price, quotation_to_nano, nano_to_float
+from sizing import SizingEngine
+from trading_calendar import TradingScheduler
+from execution import OrderManager, TinkoffGateway, load_execution_config, select_algo
 from stop_order_manager import place_stop_loss, handle_stop_close
+from state_backend import state, LockTimeoutError, LeaderLease
+from trade_history import history, journal_trade
+from position_manager import PositionManager
+from status_board import board, StatusLogHandler
+from profiling import profiler
+import fault_injection
+from signal_ingestion import process_batch, start_ingestion, stop_ingestion
+import hashlib
+import json
+import signal
+import sys
 import uuid
 import threading
 import time
 import os
 from utils import (
-    get_quantity,
-    log_trade_to_csv,
     check_position_exists,
     check_direction,
     can_open_position,
-    load_positions_from_json,
     save_positions_to_json,
     POSITIONS_FILE,
 )
-from decimal import Decimal, ROUND_DOWN
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,13 +49,276 @@ logging.basicConfig(
     handlers=[
         logging.FileHandler("app.log", encoding="utf-8"),
         logging.StreamHandler(),
+        StatusLogHandler(board),
     ],
+    # Модули пишут в лог уже при импорте, что без force отключает эти обработчики
+    force=True,
 )
 
 app = Flask(__name__)
 account_id = None
 lock = threading.Lock()
 MAX_TICKERS = 5
+# Окно, в котором повтор того же сигнала считается дублем, секунды
+SIGNAL_DEDUPE_TTL = 10
+# Токен для /admin/*; если не задан, эндпоинты открыты
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Сколько shutdown ждёт сигналов, исполняемых в момент остановки, секунды
+SHUTDOWN_WAIT = 30
+active_signals = 0
+active_signals_changed = threading.Condition()
+shutting_down = False
+execution_config = load_execution_config()
+execution_manager = None
+order_tracker = OrderTracker(lambda: account_id, TOKEN)
+position_manager = PositionManager(
+    TOKEN, lambda: account_id, open_client, order_tracker
+)
+ingestion_adapters = []
+# Сопровождение позиций и источники сигналов работают в одном воркере: иначе
+# тейки и стопы отправлялись бы по разу из каждого процесса, а воркеры
+# спорили бы за порт TCP, каталог и FIFO
+leader = LeaderLease(
+    state,
+    "leader",
+    on_acquired=lambda: start_leader_tasks(),
+    on_lost=lambda: stop_leader_tasks(),
+)
+sizing_engine = SizingEngine(TOKEN, lambda: account_id, open_client)
+scheduler = TradingScheduler(
+    TOKEN,
+    open_client,
+    on_warmup=lambda: warm_up(),
+    on_open=lambda signal_args: execute_queued_signal(signal_args),
+)
+
+
+def get_execution_manager():
+    global execution_manager
+    if execution_manager is None:
+        execution_manager = OrderManager(
+            TinkoffGateway(TOKEN, account_id), execution_config
+        )
+    return execution_manager
+
+
+def record_open_position(positions, ticker, position):
+    with lock:
+        positions[ticker] = position
+        state.put_position(ticker, position)
+    board.update_position(ticker, position, event="position_opened")
+    risk_engine.on_open(ticker, position)
+    history.record_position_open(ticker, position)
+    position_manager.track(ticker, position, get_tick_scale(position["figi"]))
+    logging.info(
+        f"""
+        Opened position: ticker={ticker},
+        quantity={position["quantity"]},
+        direction={position["direction"]},
+        signal_price={position["signal_price"]},
+        stop_order_id={position["stop_order_id"]},
+        exitComment={position["exitComment"]}
+    """.strip()
+    )
+
+
+def flatten_unprotected(client, ticker, positions):
+    """
+    Закрывает позицию, для которой не удалось поставить стоп-лосс: позиция без
+    защиты не остаётся открытой. Вызывается под блокировкой тикера.
+
+    Returns:
+        tuple: (result, status) для ответа веб-хука.
+    """
+    try:
+        close_order_id = order_tracker.flatten(client, ticker, "StopLossFailed")
+    except Exception as e:
+        logging.error(f"Failed to close unprotected position {ticker}: {str(e)}")
+        notify_error(
+            ticker,
+            "N/A",
+            "StopOrderError",
+            f"Stop-loss not placed and position {ticker} not closed: {str(e)}. "
+            "Check Tinkoff terminal.",
+        )
+        return {
+            "error": f"Не удалось установить стоп-лосс и закрыть позицию {ticker}"
+        }, 500
+    if close_order_id is None:
+        positions.pop(ticker, None)
+    notify_error(
+        ticker,
+        "N/A",
+        "StopOrderError",
+        f"Stop-loss not placed for {ticker}, position closed by order {close_order_id}",
+    )
+    return {
+        "error": f"Не удалось установить стоп-лосс для {ticker}, позиция закрывается",
+        "exit_order_id": close_order_id,
+    }, 400
+
+
+def release_algo_reservation(ticker, parent_id):
+    """
+    Снимает резерв позиции и лимитов риска, сделанный при постановке алгоритма.
+    Вызывается под блокировкой тикера.
+    """
+    position = state.get_positions().get(ticker)
+    if position is not None and position.get("pending_parent_id") == parent_id:
+        state.delete_position(ticker)
+    risk_engine.on_close(ticker)
+
+
+def settle_stale_reservation(client, ticker, positions):
+    """
+    Заменяет резерв алгоритма, чья родительская заявка уже не работает (например,
+    её завершение упало), позицией по портфелю брокера. Вызывается под
+    блокировкой тикера.
+
+    Returns:
+        dict: Позиция по фактически удерживаемым лотам или None, если их нет.
+    """
+    reserved = positions[ticker]
+    lot = reserved.get("lot") or 1
+    held = None
+    for item in client.operations.get_portfolio(account_id=account_id).positions:
+        if item.figi == reserved["figi"]:
+            held = item
+            break
+    shares = quotation_to_nano(held.quantity) // NANO if held is not None else 0
+    sign = 1 if reserved["direction"] == "buy" else -1
+    lots = sign * shares // lot
+    release_algo_reservation(ticker, reserved["pending_parent_id"])
+    if lots <= 0:
+        positions.pop(ticker, None)
+        logging.error(f"Stale algo reservation for {ticker} released, nothing held")
+        return None
+    avg_price_nano = quotation_to_nano(held.average_position_price)
+    position = dict(
+        reserved,
+        quantity=lots,
+        filled_lots=lots,
+        avg_price_nano=avg_price_nano,
+        avg_price=nano_to_float(avg_price_nano),
+        open_datetime=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    position.pop("pending_parent_id")
+    record_open_position(positions, ticker, position)
+    notify_error(
+        ticker,
+        "N/A",
+        "ExecutionError",
+        f"Algo order for {ticker} was not completed, position of {lots} lots "
+        "restored from the portfolio without a stop-loss",
+    )
+    return position
+
+
+def complete_algo_open(
+    parent,
+    figi,
+    exit_comment,
+    signal_price,
+    stop_loss_price,
+    stop_loss_price_nano,
+    lot,
+    sector,
+    currency,
+):
+    """
+    Завершает открытие позиции, исполненной алгоритмом: ставит стоп-лосс на
+    фактически исполненное количество и записывает позицию.
+    """
+    ticker = parent.ticker
+    report = parent.report()
+    board.remove_order(
+        parent.id,
+        event="order_filled" if parent.filled_lots else "order_failed",
+        report=report,
+    )
+    if not parent.filled_lots:
+        with state.lock(f"ticker:{ticker}"):
+            release_algo_reservation(ticker, parent.id)
+        logging.error(f"Algo order for {ticker} not filled: {report}")
+        notify_error(
+            ticker, "N/A", "ExecutionError", f"Algo order not filled: {report}"
+        )
+        return
+
+    stop_order_id = None
+    if stop_loss_price is not None:
+        with open_client(TOKEN) as client:
+            stop_order_id = place_stop_loss(
+                client,
+                account_id,
+                parent.instrument_id,
+                parent.filled_lots,
+                stop_loss_price,
+                parent.direction,
+                stop_price_nano=stop_loss_price_nano,
+            )
+        if stop_order_id is None:
+            logging.error(f"Failed to place stop-loss for ticker: {ticker}")
+    protected = stop_loss_price is None or stop_order_id is not None
+
+    for child in parent.children:
+        history.record_order(
+            {
+                "exchange_order_id": child["order_id"],
+                "client_order_id": parent.id,
+                "ticker": ticker,
+                "figi": figi,
+                "instrument_uid": parent.instrument_id,
+                "direction": parent.direction,
+                "quantity": child["quantity"],
+                "order_type": "limit" if child["limit_nano"] is not None else "market",
+                "signal_price": signal_price,
+                "exitComment": exit_comment,
+            }
+        )
+        if child["lots_executed"]:
+            history.record_fill(
+                {
+                    "exchange_order_id": child["order_id"],
+                    "ticker": ticker,
+                    "figi": figi,
+                    "lots": child["lots_executed"],
+                    "price": child["price_nano"] / 1_000_000_000,
+                }
+            )
+
+    # Резерв позиции заменяется фактической позицией
+    with state.lock(f"ticker:{ticker}"):
+        positions = state.get_positions()
+        record_open_position(
+            positions,
+            ticker,
+            {
+                "figi": figi,
+                "instrument_uid": parent.instrument_id,
+                "open_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "quantity": parent.filled_lots,
+                "lots_requested": parent.quantity,
+                "filled_lots": parent.filled_lots,
+                "avg_price_nano": parent.average_price_nano,
+                "avg_price": report["average_price"],
+                "client_order_id": parent.id,
+                "exchange_order_id": parent.children[0]["order_id"],
+                "direction": parent.direction,
+                "signal_price": signal_price,
+                "stop_loss_price": stop_loss_price if protected else None,
+                "stop_order_id": stop_order_id,
+                "exitComment": exit_comment,
+                "lot": lot,
+                "sector": sector,
+                "currency": currency,
+                "execution_algo": parent.algo,
+                "shortfall_bps": report["shortfall_bps"],
+            },
+        )
+        if not protected:
+            with open_client(TOKEN) as client:
+                flatten_unprotected(client, ticker, positions)
 
 
 def place_order(
@@ -83,20 +363,15 @@ def place_order(
             "error": f"Не удалось получить min_price_increment для FIGI {figi}"
         }, 400
 
-    # Округление цен
+    # Округление цен в целых тиках
+    tick = get_tick_scale(figi)
+    signal_price_nano = None
+    stop_loss_price_nano = None
     try:
         if signal_price is not None:
-            signal_price = Decimal(str(signal_price))
-            signal_price = (signal_price / min_price_increment).quantize(
-                Decimal("1"), rounding=ROUND_DOWN
-            ) * min_price_increment
-            signal_price = float(signal_price)
+            signal_price, signal_price_nano = round_price(signal_price, tick)
         if stop_loss_price is not None:
-            stop_loss_price = Decimal(str(stop_loss_price))
-            stop_loss_price = (stop_loss_price / min_price_increment).quantize(
-                Decimal("1"), rounding=ROUND_DOWN
-            ) * min_price_increment
-            stop_loss_price = float(stop_loss_price)
+            stop_loss_price, stop_loss_price_nano = round_price(stop_loss_price, tick)
     except ValueError as e:
         logging.error(f"Invalid price format: {str(e)}")
         return {"error": f"Неверный формат цены: {str(e)}"}, 400
@@ -116,8 +391,39 @@ def place_order(
                 f"Attempt to close non-existent position for ticker: {ticker}"
             )
             return {"error": "Попытка закрыть несуществующую позицию"}, 400
-        quantity = positions[ticker]["quantity"]
+        parent_id = positions[ticker].get("pending_parent_id")
+        if parent_id is not None and (
+            execution_manager is not None and parent_id in execution_manager.parents
+        ):
+            # Позицию ещё набирает алгоритм: останавливаем его, исполненное
+            # запишется позицией, которую закроет повтор сигнала
+            execution_manager.cancel(parent_id)
+            logging.error(f"Close for {ticker} while algo order {parent_id} works")
+            return {
+                "error": "Позиция ещё открывается: исполнение остановлено, повторите закрытие"
+            }, 409
+        if parent_id is not None:
+            # Алгоритм завершился, но позиция не записана
+            if settle_stale_reservation(client, ticker, positions) is None:
+                return {
+                    "error": "Заявка на открытие не исполнена, закрывать нечего"
+                }, 400
+        if order_tracker.open_order_for(ticker) is not None:
+            # Заявка на открытие ещё исполняется: снимаем её и закрываем исполненное
+            position = order_tracker.settle_open(client, ticker)
+            if position is None:
+                positions.pop(ticker, None)
+                logging.error(f"Open order for {ticker} not executed, nothing to close")
+                return {
+                    "error": "Заявка на открытие не исполнена, закрывать нечего"
+                }, 400
+            positions[ticker] = position
+        # Частичный тейк мог уже отправить заявку на часть позиции
+        quantity = positions[ticker]["quantity"] - order_tracker.closing_lots(ticker)
         logging.info(f"Closing position: ticker={ticker}, quantity={quantity}")
+        if quantity <= 0 and exit_comment not in ["LongStop", "ShortStop"]:
+            logging.error(f"Position {ticker} is already being closed")
+            return {"error": "Позиция уже закрывается"}, 400
 
         if exit_comment in ["LongStop", "ShortStop"]:
             is_executed, trade_data = handle_stop_close(
@@ -125,12 +431,19 @@ def place_order(
             )
             if is_executed:
                 try:
-                    log_trade_to_csv(trade_data)
+                    journal_trade(trade_data)
                 except Exception as e:
                     logging.error(f"Failed to write to trades.csv: {str(e)}")
                 with lock:
                     del positions[ticker]
-                    save_positions_to_json(positions)
+                    state.delete_position(ticker)
+                board.remove_position(
+                    ticker,
+                    exit_comment=exit_comment,
+                    profit_net=trade_data.get("profit_net"),
+                )
+                risk_engine.on_close(ticker, trade_data.get("profit_net"))
+                position_manager.untrack(ticker)
                 logging.info(
                     f"Closed position by stop: ticker={ticker}, exitComment={exit_comment}"
                 )
@@ -140,17 +453,42 @@ def place_order(
                     "error": "Stop-order not executed, alert sent. Check Tinkoff terminal."
                 }, 400
     else:
+        if execution_manager is not None and execution_manager.has_active(ticker):
+            logging.error(f"Position is being opened by algo for ticker: {ticker}")
+            return {"error": "Позиция уже открывается"}, 400
         if check_position_exists(ticker, positions):
             logging.error(f"Position already open for ticker: {ticker}")
             return {"error": "Позиция уже открыта"}, 400
-        quantity = get_quantity(expected_sum, signal_price, lot)
+        quantity, sizing_mode = sizing_engine.size(
+            ticker,
+            figi,
+            expected_sum,
+            signal_price_nano,
+            stop_loss_price_nano,
+            lot,
+        )
         logging.info(
-            f"Calculated quantity: {quantity} for expected_sum={expected_sum}, signal_price={signal_price}, lot={lot}"
+            f"Calculated quantity: {quantity} ({sizing_mode}) for expected_sum={expected_sum}, signal_price={signal_price}, lot={lot}"
         )
         if quantity == 0:
             logging.error("Quantity is 0")
             return {"error": "Количество лотов равно 0"}, 400
 
+        sector, currency = get_instrument_meta(figi)
+        quantity, risk_limit = risk_engine.check_order(
+            ticker,
+            direction,
+            quantity,
+            lot,
+            signal_price,
+            stop_loss_price,
+            sector,
+            currency,
+        )
+        if quantity == 0:
+            logging.error(f"Order rejected by risk limit {risk_limit} for {ticker}")
+            return {"error": f"Ордер отклонён риск-лимитом: {risk_limit}"}, 400
+
     if not isinstance(quantity, int):
         logging.error(f"Invalid quantity type: expected int, got {type(quantity)}")
         return {
@@ -170,6 +508,72 @@ def place_order(
             "error": f"Неверный тип account_id: ожидается строка, получено {type(account_id)}"
         }, 400
 
+    is_opening = exit_comment in [None, "OpenLong", "OpenShort"]
+    algo = select_algo(ticker, expected_sum, execution_config) if is_opening else None
+    if algo is not None and algo != "market":
+        parent = get_execution_manager().submit(
+            ticker,
+            instrument_uid,
+            direction,
+            quantity,
+            signal_price,
+            algo,
+            on_done=lambda parent: complete_algo_open(
+                parent,
+                figi,
+                exit_comment,
+                signal_price,
+                stop_loss_price,
+                stop_loss_price_nano,
+                lot,
+                sector,
+                currency,
+            ),
+        )
+        # Резерв слота тикера и лимитов риска на запрошенное количество до
+        # завершения исполнения; complete_algo_open заменит его позицией
+        reserved = {
+            "figi": figi,
+            "instrument_uid": instrument_uid,
+            "open_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quantity": 0,
+            "lots_requested": quantity,
+            "filled_lots": 0,
+            "client_order_id": parent.id,
+            "exchange_order_id": None,
+            "direction": direction,
+            "signal_price": signal_price,
+            "stop_loss_price": None,
+            "stop_order_id": None,
+            "exitComment": exit_comment,
+            "lot": lot,
+            "sector": sector,
+            "currency": currency,
+            "execution_algo": algo,
+            "pending_parent_id": parent.id,
+        }
+        with lock:
+            positions[ticker] = reserved
+            state.put_position(ticker, reserved)
+        risk_engine.on_open(
+            ticker,
+            dict(reserved, quantity=quantity, stop_loss_price=stop_loss_price),
+        )
+        if parent.status == "working":
+            board.update_order(
+                parent.id,
+                {
+                    "kind": "algo",
+                    "ticker": ticker,
+                    "algo": algo,
+                    "direction": direction,
+                    "quantity": quantity,
+                    "signal_price": signal_price,
+                },
+                event="order_submitted",
+            )
+        return {"parent_order_id": parent.id, "algo": algo}, 202
+
     logging.info(
         f"Preparing to place order: instrument_uid={instrument_uid} ({type(instrument_uid)}), "
         f"quantity={quantity} ({type(quantity)}), "
@@ -188,67 +592,123 @@ def place_order(
             order_id=client_order_id,
         )
         logging.info(f"Order placed successfully: order_id={response.order_id}")
+        history.record_order(
+            {
+                "exchange_order_id": response.order_id,
+                "client_order_id": client_order_id,
+                "ticker": ticker,
+                "figi": figi,
+                "instrument_uid": instrument_uid,
+                "direction": direction,
+                "quantity": quantity,
+                "order_type": "market",
+                "signal_price": signal_price,
+                "exitComment": exit_comment,
+            }
+        )
 
     except Exception as e:
         logging.error(f"Error placing order: {str(e)}")
         return {"error": f"Ошибка при размещении ордера: {str(e)}"}, 400
 
-    is_opening = exit_comment in [None, "OpenLong", "OpenShort"]
     if is_opening:
+        lots_executed = response.lots_executed
+        if not lots_executed and response.execution_report_status in FAILED_STATUSES:
+            logging.error(
+                f"Open order {response.order_id} for {ticker} ended with status "
+                f"{response.execution_report_status}"
+            )
+            return {"error": f"Заявка на открытие не исполнена для {ticker}"}, 400
+        # Средняя цена исполнения; без неё — цена сигнала
+        avg_price_nano = (
+            quotation_to_nano(response.executed_order_price) or signal_price_nano
+            if lots_executed
+            else None
+        )
+        if lots_executed:
+            history.record_fill(
+                {
+                    "exchange_order_id": response.order_id,
+                    "ticker": ticker,
+                    "figi": figi,
+                    "lots": lots_executed,
+                    "price": nano_to_float(avg_price_nano),
+                }
+            )
+
+        # Стоп ставится на исполненные лоты; остальные трекер добавит в стоп
+        # по мере исполнения заявки
         stop_order_id = None
-        if stop_loss_price is not None:
+        if stop_loss_price is not None and lots_executed:
             stop_order_id = place_stop_loss(
-                client, account_id, instrument_uid, quantity, stop_loss_price, direction
+                client,
+                account_id,
+                instrument_uid,
+                lots_executed,
+                stop_loss_price,
+                direction,
+                stop_price_nano=stop_loss_price_nano,
             )
             if stop_order_id is None:
                 logging.error(f"Failed to place stop-loss for ticker: {ticker}")
-                return {"error": f"Не удалось установить стоп-лосс для {ticker}"}, 400
+        protected = (
+            stop_loss_price is None or not lots_executed or stop_order_id is not None
+        )
 
-        with lock:
-            positions[ticker] = {
+        record_open_position(
+            positions,
+            ticker,
+            {
                 "figi": figi,
                 "instrument_uid": instrument_uid,
                 "open_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "quantity": quantity,
+                "quantity": lots_executed,
+                "lots_requested": quantity,
+                "filled_lots": lots_executed,
+                "avg_price_nano": avg_price_nano,
+                "avg_price": (
+                    nano_to_float(avg_price_nano)
+                    if avg_price_nano is not None
+                    else None
+                ),
                 "client_order_id": client_order_id,
                 "exchange_order_id": response.order_id,
                 "direction": direction,
                 "signal_price": signal_price,
-                "stop_loss_price": stop_loss_price,
+                "stop_loss_price": stop_loss_price if protected else None,
                 "stop_order_id": stop_order_id,
                 "exitComment": exit_comment,
-            }
-            save_positions_to_json(positions)
-        logging.info(
-            f"""
-            Opened position: ticker={ticker},
-            quantity={quantity},
-            direction={direction},
-            signal_price={signal_price},
-            stop_order_id={stop_order_id},
-            exitComment={exit_comment}
-        """.strip()
+                "lot": lot,
+                "sector": sector,
+                "currency": currency,
+            },
         )
+        if lots_executed < quantity:
+            order_tracker.track_open(
+                ticker,
+                response.order_id,
+                quantity,
+                lot,
+                lots_executed,
+                avg_price_nano * lots_executed * lot if lots_executed else 0,
+            )
+        if not protected:
+            return flatten_unprotected(client, ticker, positions)
     else:
         open_order_id = positions[ticker]["exchange_order_id"]
         logging.info(
-            f"Starting monitor for closing order: ticker={ticker}, open_order_id={open_order_id}"
+            f"Tracking closing order: ticker={ticker}, open_order_id={open_order_id}"
+        )
+        order_tracker.track_close(
+            ticker,
+            open_order_id,
+            response.order_id,
+            exit_comment,
+            client_order_id,
+            signal_price,
+            lots_requested=quantity,
+            lot=positions[ticker].get("lot", lot),
         )
-        threading.Thread(
-            target=monitor_order_completion,
-            args=(
-                account_id,
-                ticker,
-                open_order_id,
-                response.order_id,
-                positions,
-                log_trade_to_csv,
-                exit_comment,
-                client_order_id,
-                lock,
-                signal_price,
-            ),
-        ).start()
 
     return {
         "client_order_id": client_order_id,
@@ -258,8 +718,39 @@ def place_order(
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    data = request.json
+    result, status = process_signal(request.json, request.get_data())
+    return jsonify(result), status
+
+
+@app.route("/webhook/batch", methods=["POST"])
+def webhook_batch():
+    signals = request.get_json(silent=True)
+    if not isinstance(signals, list):
+        return jsonify({"error": "Ожидается массив сигналов"}), 400
+    results = process_batch(signals, process_signal)
+    return (
+        jsonify([{"status": status, "result": result} for result, status in results]),
+        200,
+    )
+
+
+def process_signal(data, raw=None):
+    """
+    Общий конвейер сигнала для всех источников: разбор, проверка,
+    дедупликация, торговый календарь и исполнение.
+
+    Args:
+        data: Сигнал в формате тела веб-хука.
+        raw: Исходные байты сигнала для ключа дедупликации; по умолчанию
+            берётся каноничный JSON.
+
+    Returns:
+        tuple: (result, status) — ответ и HTTP-код.
+    """
     logging.info(f"Received webhook data: {data}")
+    if not isinstance(data, dict):
+        logging.error(f"Invalid signal payload: {data}")
+        return {"error": "Сигнал должен быть JSON-объектом"}, 400
 
     ticker = data.get("ticker")
     figi = data.get("figi")
@@ -300,7 +791,7 @@ def webhook():
     )
     if not is_valid:
         logging.error(f"Validation failed: {result}")
-        return jsonify({"error": result}), 400
+        return {"error": result}, 400
 
     expected_sum, exit_comment, signal_price, stop_loss_price = result
 
@@ -313,10 +804,83 @@ def webhook():
         stop_loss_price={stop_loss_price}
         """.strip()
     )
+    if raw is None:
+        raw = json.dumps(data, sort_keys=True).encode("utf-8")
+    signal_key = hashlib.sha1(raw).hexdigest()
+    if not state.mark_signal(signal_key, SIGNAL_DEDUPE_TTL):
+        logging.info(f"Duplicate signal ignored: ticker={ticker}, key={signal_key}")
+        return {"message": "Duplicate signal ignored"}, 200
+
+    signal_args = {
+        "ticker": ticker,
+        "figi": figi,
+        "direction": direction,
+        "expected_sum": expected_sum,
+        "exit_comment": exit_comment,
+        "signal_price": signal_price,
+        "stop_loss_price": stop_loss_price,
+    }
+    try:
+        result, status = route_signal(signal_args)
+    except Exception:
+        state.forget_signal(signal_key)
+        raise
+    if status >= 300:
+        # Отклонённый сигнал не считается полученным: повтор будет исполнен
+        state.forget_signal(signal_key)
+    return result, status
+
+
+def route_signal(signal_args):
+    """
+    Исполняет сигнал сразу или ставит его в очередь до открытия сессии.
+
+    Returns:
+        tuple: (result, status) — ответ и HTTP-код.
+    """
+    ticker = signal_args["ticker"]
+    if not scheduler.is_open(ticker):
+        next_open = scheduler.next_open(ticker)
+        if scheduler.defer(ticker, signal_args):
+            return {"message": "Signal queued until session open"}, 202
+        logging.error(f"Signal outside trading session for {ticker}")
+        return (
+            {
+                "error": f"Вне торговой сессии для {ticker}",
+                "next_open": (
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(next_open))
+                    if next_open
+                    else None
+                ),
+            },
+            400,
+        )
+
+    return execute_signal(**signal_args)
+
+
+def execute_signal(
+    ticker,
+    figi,
+    direction,
+    expected_sum,
+    exit_comment,
+    signal_price,
+    stop_loss_price,
+):
+    """
+    Исполняет проверенный сигнал под блокировкой тикера.
+
+    Returns:
+        tuple: (result, status) для ответа веб-хука.
+    """
+    if not begin_signal():
+        logging.error(f"Signal for {ticker} rejected: shutting down")
+        return {"error": "Сервер останавливается, повторите сигнал"}, 503
     try:
-        with Client(TOKEN, target=INVEST_GRPC_API) as client:
+        with state.lock(f"ticker:{ticker}"), open_client(TOKEN) as client:
             logging.info("Initialized Tinkoff client")
-            positions = load_positions_from_json()
+            positions = state.get_positions()
             logging.info(f"Loaded positions: {positions}")
             result, status = place_order(
                 client,
@@ -330,11 +894,326 @@ def webhook():
                 positions,
             )
             logging.info(f"place_order result: {result}, status: {status}")
-            return jsonify(result), status
+            return result, status
+    except LockTimeoutError as e:
+        logging.error(f"Ticker {ticker} is busy: {str(e)}")
+        return {"error": f"Тикер {ticker} занят другим запросом"}, 409
     except Exception as e:
         logging.error(f"Error in webhook processing: {str(e)}")
         notify_error(ticker or "Unknown", "N/A", "WebhookError", str(e))
-        return jsonify({"error": f"Ошибка при обработке ордера: {str(e)}"}), 500
+        return {"error": f"Ошибка при обработке ордера: {str(e)}"}, 500
+    finally:
+        end_signal()
+
+
+def begin_signal():
+    """
+    Учитывает сигнал, начавший исполнение.
+
+    Returns:
+        bool: False, если процесс останавливается и новые сигналы не принимаются.
+    """
+    global active_signals
+    with active_signals_changed:
+        if shutting_down:
+            return False
+        active_signals += 1
+        return True
+
+
+def end_signal():
+    global active_signals
+    with active_signals_changed:
+        active_signals -= 1
+        active_signals_changed.notify_all()
+
+
+def wait_for_signals(timeout=SHUTDOWN_WAIT):
+    """
+    Перестаёт принимать сигналы и ждёт завершения исполняемых.
+
+    Returns:
+        bool: True, если все сигналы завершились за timeout секунд.
+    """
+    global shutting_down
+    with active_signals_changed:
+        shutting_down = True
+        return active_signals_changed.wait_for(lambda: active_signals == 0, timeout)
+
+
+def execute_queued_signal(signal_args):
+    result, status = execute_signal(**signal_args)
+    logging.info(
+        f"Queued signal for {signal_args['ticker']} executed: {result}, status: {status}"
+    )
+
+
+def warm_up():
+    """
+    Прогрев перед открытием сессии: кэш инструментов, свечи для ATR и снимок
+    портфеля. Каналы не прогреваются: сигнал открывает собственный.
+    """
+    watchlist = dict(scheduler.config.get("watchlist", {}))
+    for ticker, position in state.get_positions().items():
+        watchlist.setdefault(ticker, position["figi"])
+    with open_client(TOKEN) as client:
+        for ticker, figi in watchlist.items():
+            get_instrument_data(client, figi, ticker)
+            sizing_engine.watch(figi, ticker)
+        sizing_engine.refresh(client)
+    logging.info(f"Warmed up {len(watchlist)} instruments before session open")
+
+
+@app.route("/metrics/broker", methods=["GET"])
+def broker_metrics():
+    return jsonify(guard.get_metrics()), 200
+
+
+@app.before_request
+def check_admin_token():
+    if ADMIN_TOKEN and request.path.startswith("/admin/"):
+        if request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+            return jsonify({"error": "Неверный токен администратора"}), 401
+
+
+# Потоковые ответы длятся, пока подключён клиент: их профиль держал бы
+# cProfile занятым для всех остальных запросов
+STREAMING_PATHS = ("/admin/events",)
+
+
+@app.before_request
+def begin_request_profile():
+    if request.path in STREAMING_PATHS:
+        return
+    g.profile, g.request_started = profiler.begin_request()
+
+
+@app.teardown_request
+def end_request_profile(exc=None):
+    if "request_started" in g:
+        profiler.end_request(
+            g.profile, g.request_started, f"{request.method} {request.path}"
+        )
+
+
+# Эндпоинты /admin/* читают только снимки board и не берут lock
+@app.route("/admin/positions", methods=["GET"])
+def admin_positions():
+    return jsonify(board.positions()), 200
+
+
+@app.route("/admin/orders", methods=["GET"])
+def admin_orders():
+    return jsonify(board.orders()), 200
+
+
+@app.route("/admin/instruments", methods=["GET"])
+def admin_instruments():
+    return jsonify(get_cache_stats()), 200
+
+
+@app.route("/admin/queues", methods=["GET"])
+def admin_queues():
+    return jsonify(board.queues()), 200
+
+
+@app.route("/admin/errors", methods=["GET"])
+def admin_errors():
+    return jsonify(list(board.errors())), 200
+
+
+@app.route("/admin/status", methods=["GET"])
+def admin_status():
+    positions = board.positions()
+    orders = board.orders()
+    return (
+        jsonify(
+            {
+                "account_id": account_id,
+                "uptime": time.time() - board.started_at,
+                "positions": len(positions),
+                "orders": len(orders),
+                "instruments": get_cache_stats(),
+                "queues": board.queues(),
+                "sizing": sizing_engine.snapshot(),
+                "sessions": scheduler.snapshot(),
+                "errors": len(board.errors()),
+                "last_error": board.errors()[-1] if board.errors() else None,
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/admin/profiling", methods=["GET", "POST"])
+def admin_profiling():
+    if request.method == "GET":
+        return jsonify(profiler.status()), 200
+    data = request.get_json(silent=True) or {}
+    try:
+        status = profiler.configure(
+            sampler=data.get("sampler"),
+            requests=data.get("requests"),
+            slow_request_ms=data.get("slow_request_ms"),
+            memory=data.get("memory"),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Неверные параметры профилирования: {str(e)}"}), 400
+    return jsonify(status), 200
+
+
+@app.route("/admin/profiling/stacks", methods=["GET"])
+def admin_profiling_stacks():
+    return Response(profiler.sampler.folded(), mimetype="text/plain")
+
+
+@app.route("/admin/profiling/memory", methods=["GET"])
+def admin_profiling_memory():
+    return jsonify(profiler.memory_snapshot()), 200
+
+
+@app.route("/admin/chaos", methods=["GET", "POST"])
+def admin_chaos():
+    injector = fault_injection.injector
+    if injector is None:
+        return jsonify({"error": "Процесс запущен без CHAOS_SCENARIO"}), 404
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            injector.load(data.get("scenario", "none"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    report = injector.report()
+    report["scenarios"] = sorted(fault_injection.SCENARIOS)
+    report["violations"] = fault_injection.check_invariants(
+        board.positions(), board.orders()
+    )
+    # Сверка с брокером — единственный запрос /admin/*, который ходит в API
+    if request.args.get("reconcile"):
+        with open_client(TOKEN) as client:
+            report["broker_mismatches"] = fault_injection.reconcile_with_broker(
+                client, account_id, board.positions()
+            )
+    return jsonify(report), 200
+
+
+@app.route("/admin/events", methods=["GET"])
+def admin_events():
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or 0)
+    except ValueError:
+        last_id = 0
+    return Response(
+        stream_with_context(board.stream(last_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def shutdown(signum=None, frame=None):
+    """
+    Дожидается исполняемых сигналов, останавливает фоновые потоки, дописывает
+    журнал и закрывает каналы.
+
+    Незавершённые заявки остаются в хранилище и подхватываются
+    при следующем запуске.
+    """
+    logging.info(f"Shutting down (signal={signum})")
+    # Заявки исполняемых сигналов должны успеть записаться в позиции и журнал
+    if not wait_for_signals():
+        logging.error(
+            f"{active_signals} signals still executing after {SHUTDOWN_WAIT}s, "
+            "shutting down anyway"
+        )
+    board.close()
+    # Источники сигналов и сопровождение позиций ведущего процесса
+    leader.stop()
+    # Журнал дописывается до закрытия каналов, остаток — после остановки потоков
+    if not history.flush():
+        logging.error("History journal was not flushed before closing channels")
+    order_tracker.stop()
+    sizing_engine.stop()
+    scheduler.stop()
+    if execution_manager is not None:
+        execution_manager.stop()
+        execution_manager.gateway.close()
+    if not history.stop():
+        logging.error("History journal was not fully written before shutdown")
+    logging.info("Shutdown complete")
+    if signum is not None:
+        sys.exit(0)
+
+
+def toggle_sampler(signum=None, frame=None):
+    """
+    SIGUSR1 включает сэмплирующий профайлер, повторный сигнал выключает его
+    и записывает стеки в profiles/.
+    """
+    profiler.configure(sampler=not profiler.sampler.running)
+
+
+def dump_memory(signum=None, frame=None):
+    """
+    SIGUSR2 включает tracemalloc, повторный сигнал записывает снимок в profiles/.
+    """
+    if not profiler.status()["tracemalloc"]:
+        profiler.configure(memory=True)
+        return
+    snapshot = profiler.memory_snapshot()
+    logging.info(
+        f"tracemalloc snapshot: {snapshot['snapshot']}, top: {snapshot['top'][:5]}"
+    )
+
+
+def backfill_position_lots(positions):
+    """
+    Дописывает размер лота, сектор и валюту в позиции, открытые до того, как
+    они стали сохраняться.
+    """
+    missing = {
+        ticker: position
+        for ticker, position in positions.items()
+        if not position.get("lot")
+        or position.get("sector", "unknown") == "unknown"
+        or position.get("currency", "unknown") == "unknown"
+    }
+    if not missing:
+        return
+    with open_client(TOKEN) as client:
+        for ticker, position in missing.items():
+            _, lot, _ = get_instrument_data(client, position["figi"], ticker)
+            if lot is None:
+                logging.error(f"Failed to get lot size for position {ticker}")
+                continue
+            position["lot"] = position.get("lot") or lot
+            position["sector"], position["currency"] = get_instrument_meta(
+                position["figi"]
+            )
+            state.put_position(ticker, position)
+            logging.info(
+                f"Backfilled lot {position['lot']}, sector {position['sector']} and "
+                f"currency {position['currency']} for position {ticker}"
+            )
+
+
+def start_leader_tasks():
+    """
+    Запускает задачи, которые работают только в одном процессе из воркеров.
+    """
+    ingestion_adapters.extend(start_ingestion(process_signal))
+    if position_manager.enabled:
+        position_manager.start(
+            state.get_positions(),
+            lambda figi: (state.get_instrument(figi) or {}).get(
+                "min_price_increment_nano"
+            ),
+        )
+
+
+def stop_leader_tasks():
+    stop_ingestion(ingestion_adapters)
+    ingestion_adapters.clear()
+    position_manager.stop()
 
 
 def main():
@@ -351,8 +1230,50 @@ def main():
     if not os.path.exists(POSITIONS_FILE):
         logging.info(f"Creating empty positions file at {POSITIONS_FILE}")
         save_positions_to_json({})
+    for ticker, position in state.get_positions().items():
+        # Алгоритмы исполнения не переживают перезапуск
+        if position.get("pending_parent_id"):
+            state.delete_position(ticker)
+            logging.error(f"Dropped reservation of interrupted algo order for {ticker}")
+            notify_error(
+                ticker,
+                "N/A",
+                "ExecutionError",
+                f"Algo order {position['pending_parent_id']} interrupted by restart. "
+                "Check Tinkoff terminal.",
+            )
+    backfill_position_lots(state.get_positions())
+    # Дневной PnL берётся из истории, чтобы лимит убытка пережил перезапуск
+    history.flush()
+    risk_engine.rebuild(
+        state.get_positions(),
+        daily_pnl=history.realized_pnl(time.strftime("%Y-%m-%d")),
+    )
+    board.load_positions(state.get_positions())
+    board.register_gauge("history_writer", history.pending)
+    board.register_gauge("position_manager", position_manager.pending)
+    board.register_gauge("orders_in_flight", lambda: len(board.orders()))
+    board.register_gauge("queued_signals", scheduler.queued)
+    order_tracker.start()
+    sizing_engine.start()
+    scheduler.start()
+    signal.signal(signal.SIGTERM, shutdown)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, toggle_sampler)
+        signal.signal(signal.SIGUSR2, dump_memory)
+    leader.start()
     return True
 
 
-if not main():
-    exit(1)
+def create_app():
+    """
+    Инициализирует аккаунт и фоновые потоки и возвращает приложение Flask
+    для WSGI-сервера. Импорт модуля ничего не запускает.
+    """
+    if not main():
+        raise SystemExit(1)
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=5000)
@@ -0,0 +1,262 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+import grpc
+from tinkoff.invest import Client
+from tinkoff.invest.constants import INVEST_GRPC_API
+from tinkoff.invest.exceptions import RequestError
+from fault_injection import wrap_services
+
+# Лимиты запросов в минуту по сервисам (по умолчанию, уточняются из метаданных ответа)
+SERVICE_LIMITS = {
+    "orders": 100,
+    "stop_orders": 50,
+    "operations": 200,
+    "instruments": 200,
+    "market_data": 300,
+    "users": 100,
+}
+# Сколько запросов оставлять в запасе, прежде чем ставить вызовы в очередь
+QUOTA_RESERVE = 2
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
+
+# Автомат отключения: после стольких ошибок подряд сервис закрывается на COOLDOWN секунд
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+
+RETRYABLE_CODES = (
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+)
+# Повторяемые изменяющие вызовы: повтор с тем же order_id не создаёт новую заявку
+IDEMPOTENT_WRITES = (
+    "post_order",
+    "post_stop_order",
+    "cancel_order",
+    "cancel_stop_order",
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class _Quota:
+    """
+    Квота сервиса: окно в минуту плюс остаток и время сброса от брокера.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.remaining = None
+        self.reset_at = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now - self.window_start >= 60:
+                    self.window_start, self.used = now, 0
+                if self.reset_at is not None and now >= self.reset_at:
+                    self.remaining, self.reset_at = None, None
+                if self.remaining is not None and self.remaining <= QUOTA_RESERVE:
+                    if self.reset_at is None:
+                        self.reset_at = self.window_start + 60
+                    wait = self.reset_at - now
+                elif self.used >= self.limit - QUOTA_RESERVE:
+                    wait = self.window_start + 60 - now
+                else:
+                    self.used += 1
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    return
+                self.condition.wait(max(wait, 0.01))
+
+    def update(self, remaining, reset):
+        with self.condition:
+            # Остаток без времени сброса не учитываем: неизвестно, когда ждать
+            if reset is not None:
+                self.reset_at = time.monotonic() + reset
+                if remaining is not None:
+                    self.remaining = remaining
+            self.condition.notify_all()
+
+
+class _Breaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self, service):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                raise CircuitOpenError(f"Circuit open for service {service}")
+            # Полуоткрытое состояние: пропускаем пробный вызов
+            self.opened_at = None
+            self.failures = BREAKER_THRESHOLD - 1
+
+    def record(self, service, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= BREAKER_THRESHOLD and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                logging.error(f"Circuit opened for service {service}")
+
+
+class BrokerGuard:
+    """
+    Общие для процесса квоты, автоматы отключения и метрики вызовов брокера.
+    """
+
+    def __init__(self):
+        self.quotas = {name: _Quota(limit) for name, limit in SERVICE_LIMITS.items()}
+        self.breakers = {name: _Breaker() for name in SERVICE_LIMITS}
+        self.metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _observe(self, rpc, latency, error=None, retried=False):
+        with self._metrics_lock:
+            entry = self.metrics.setdefault(
+                rpc,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                },
+            )
+            entry["calls"] += 1
+            entry["latency_sum"] += latency
+            entry["latency_max"] = max(entry["latency_max"], latency)
+            if error is not None:
+                entry["errors"] += 1
+                codes = entry.setdefault("error_codes", {})
+                codes[error] = codes.get(error, 0) + 1
+            if retried:
+                entry["retries"] += 1
+
+    def get_metrics(self):
+        """
+        Возвращает счётчики вызовов, ошибок и задержек по RPC.
+        """
+        with self._metrics_lock:
+            result = {}
+            for rpc, entry in self.metrics.items():
+                result[rpc] = dict(entry)
+                result[rpc]["latency_avg"] = entry["latency_sum"] / entry["calls"]
+                if "error_codes" in entry:
+                    result[rpc]["error_codes"] = dict(entry["error_codes"])
+            return result
+
+    def call(self, service, method, func, args, kwargs):
+        rpc = f"{service}.{method}"
+        quota = self.quotas[service]
+        breaker = self.breakers[service]
+        retryable = (
+            method.startswith("get_")
+            or (method in IDEMPOTENT_WRITES and kwargs.get("order_id") is not None)
+            or method.startswith("cancel_")
+        )
+        attempt = 0
+        while True:
+            breaker.check(service)
+            quota.acquire()
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                code = getattr(e, "code", None)
+                metadata = getattr(e, "metadata", None)
+                if metadata is not None:
+                    quota.update(
+                        getattr(metadata, "ratelimit_remaining", None),
+                        getattr(metadata, "ratelimit_reset", None),
+                    )
+                transient = isinstance(e, RequestError) and code in RETRYABLE_CODES
+                self._observe(
+                    rpc,
+                    time.monotonic() - started,
+                    error=getattr(code, "name", type(e).__name__),
+                    retried=transient and retryable and attempt + 1 < MAX_ATTEMPTS,
+                )
+                # Ошибки запроса (неверные параметры и т.п.) не говорят о недоступности
+                breaker.record(service, success=not transient)
+                attempt += 1
+                if not (transient and retryable) or attempt >= MAX_ATTEMPTS:
+                    raise
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+                logging.error(
+                    f"{rpc} failed ({getattr(code, 'name', e)}), retry {attempt} in {delay:.2f}s"
+                )
+                time.sleep(delay)
+                continue
+            self._observe(rpc, time.monotonic() - started)
+            breaker.record(service, success=True)
+            return result
+
+
+# Общий для процесса экземпляр
+guard = BrokerGuard()
+
+
+class _ServiceProxy:
+    def __init__(self, name, service):
+        self._name = name
+        self._service = service
+
+    def __getattr__(self, method):
+        attr = getattr(self._service, method)
+        if not callable(attr):
+            return attr
+
+        def wrapped(*args, **kwargs):
+            return guard.call(self._name, method, attr, args, kwargs)
+
+        return wrapped
+
+
+class ResilientClient:
+    """
+    Обёртка над сервисами Tinkoff: квоты, повторы с backoff, автомат отключения
+    и метрики. Сервисы вне SERVICE_LIMITS (стримы и т.п.) отдаются как есть.
+    """
+
+    def __init__(self, services):
+        self._services = services
+        self._proxies = {}
+
+    def __getattr__(self, name):
+        if name in SERVICE_LIMITS:
+            if name not in self._proxies:
+                self._proxies[name] = _ServiceProxy(name, getattr(self._services, name))
+            return self._proxies[name]
+        return getattr(self._services, name)
+
+
+@contextmanager
+def open_client(token):
+    """
+    Открывает канал к Tinkoff API и возвращает ResilientClient.
+
+    Args:
+        token: Токен доступа к API.
+    """
+    with Client(token, target=INVEST_GRPC_API) as services:
+        yield ResilientClient(wrap_services(services))
@@ -0,0 +1,121 @@
+"""
+Прогон сценариев сбоев против запущенного приложения (песочница).
+
+Приложение запускается с CHAOS_SCENARIO=none, затем:
+    python chaos_suite.py --url http://127.0.0.1:5000 --ticker SBER --figi BBG004730N88 --price 311
+
+Для каждого сценария скрипт открывает и закрывает позицию через /webhook и
+ждёт, пока состояние снова станет согласованным: нет нарушений инвариантов
+и незавершённых заявок на закрытие. Время до этого момента от отправки
+закрытия — время восстановления приложения. В конце позиции приложения
+сверяются с портфелем брокера.
+"""
+
+import argparse
+import time
+import requests
+
+DEFAULT_SCENARIOS = [
+    "latency",
+    "flaky_reads",
+    "stop_loss_fails",
+    "order_state_down",
+    "portfolio_timeout",
+    "partial_fills",
+    "rate_limited",
+]
+
+
+def send_signal(args, exit_comment, stop_loss_price):
+    data = {
+        "ticker": args.ticker,
+        "figi": args.figi,
+        "direction": "buy",
+        "expected_sum": args.expected_sum,
+        "price": args.price,
+        "stop_loss_price": stop_loss_price,
+        "exitComment": exit_comment,
+        # Разные тела запросов, чтобы повтор не отсекался дедупликацией
+        "time": time.time(),
+    }
+    response = requests.post(f"{args.url}/webhook", json=data, timeout=60)
+    return response.status_code, response.json()
+
+
+def wait_consistent(args, headers, started):
+    while time.time() - started < args.timeout:
+        chaos = requests.get(f"{args.url}/admin/chaos", headers=headers).json()
+        orders = requests.get(f"{args.url}/admin/orders", headers=headers).json()
+        closing = [
+            order_id
+            for order_id, order in orders.items()
+            if order.get("ticker") == args.ticker
+        ]
+        if not chaos["violations"] and not closing:
+            return time.time() - started, chaos
+        time.sleep(0.5)
+    return None, chaos
+
+
+def run_scenario(args, headers, scenario):
+    requests.post(
+        f"{args.url}/admin/chaos", json={"scenario": scenario}, headers=headers
+    ).raise_for_status()
+    open_status, open_result = send_signal(
+        args, "OpenLong", round(args.price * 0.95, 2)
+    )
+    time.sleep(args.settle)
+    started = time.time()
+    close_status, close_result = send_signal(args, "LongTrTake", None)
+    time_to_recover, chaos = wait_consistent(args, headers, started)
+    positions = requests.get(f"{args.url}/admin/positions", headers=headers).json()
+    reconciled = requests.get(
+        f"{args.url}/admin/chaos", params={"reconcile": 1}, headers=headers
+    ).json()
+    return {
+        "scenario": scenario,
+        "open": (open_status, open_result),
+        "close": (close_status, close_result),
+        "injected": chaos["injected"],
+        "broker_time_to_recover": chaos["max_time_to_recover"],
+        "app_time_to_recover": time_to_recover,
+        "violations": chaos["violations"],
+        "position_left_open": args.ticker in positions,
+        "broker_mismatches": reconciled["broker_mismatches"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Прогон сценариев сбоев брокера")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--ticker", default="SBER")
+    parser.add_argument("--figi", default="BBG004730N88")
+    parser.add_argument("--price", type=float, required=True)
+    parser.add_argument("--expected-sum", type=int, default=3300)
+    parser.add_argument("--admin-token")
+    parser.add_argument("--scenario", action="append")
+    parser.add_argument("--settle", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=180.0)
+    args = parser.parse_args()
+    headers = {"X-Admin-Token": args.admin_token} if args.admin_token else {}
+
+    failed = 0
+    for scenario in args.scenario or DEFAULT_SCENARIOS:
+        result = run_scenario(args, headers, scenario)
+        ok = (
+            result["app_time_to_recover"] is not None
+            and not result["position_left_open"]
+            and not result["broker_mismatches"]
+        )
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {scenario}")
+        for key, value in result.items():
+            if key != "scenario":
+                print(f"     {key}: {value}")
+    requests.post(f"{args.url}/admin/chaos", json={"scenario": "none"}, headers=headers)
+    print(f"{failed} scenario(s) failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
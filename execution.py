@@ -0,0 +1,500 @@
+import asyncio
+import itertools
+import json
+import os
+import logging
+import threading
+import time
+import uuid
+from functools import partial
+from tinkoff.invest import (
+    Client,
+    OrderDirection,
+    OrderType,
+    OrderExecutionReportStatus,
+)
+from tinkoff.invest.constants import INVEST_GRPC_API
+from tick_math import nano_to_quotation, quotation_to_nano, price_to_nano
+from broker_client import ResilientClient
+from fault_injection import wrap_services
+
+EXECUTION_CONFIG_FILE = os.path.join(os.path.dirname(__file__), "execution_config.json")
+
+# Параметры по умолчанию; переопределяются файлом execution_config.json
+DEFAULT_EXECUTION_CONFIG = {
+    # Алгоритм для крупных ордеров: "market", "twap", "iceberg" или "peg"
+    "algo": "market",
+    # Сумма, начиная с которой ордер исполняется алгоритмом
+    "min_sum": 300_000,
+    # Переопределение алгоритма по тикеру, например {"SBER": "peg"}
+    "tickers": {},
+    "twap_slices": 5,
+    "twap_duration": 60,
+    "iceberg_display_lots": 10,
+    "poll_interval": 1.0,
+    # Сколько секунд работать лимитными заявками перед добивкой рынком
+    "timeout": 120,
+    "sweep_remainder": True,
+}
+
+FINAL_STATUSES = (
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+)
+
+
+def load_execution_config(file_path=EXECUTION_CONFIG_FILE):
+    """
+    Загружает параметры исполнения из JSON-файла поверх значений по умолчанию.
+
+    Returns:
+        dict: Параметры исполнения.
+    """
+    config = dict(DEFAULT_EXECUTION_CONFIG)
+    try:
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                config.update(json.load(f))
+            logging.info(f"Loaded execution config from {file_path}: {config}")
+    except Exception as e:
+        logging.error(f"Error loading execution config from {file_path}: {str(e)}")
+    return config
+
+
+def select_algo(ticker, expected_sum, config):
+    """
+    Выбирает алгоритм исполнения для ордера на открытие.
+
+    Returns:
+        str: Название алгоритма ("market" — одна рыночная заявка).
+    """
+    algo = config["tickers"].get(ticker, config["algo"])
+    if expected_sum is None or expected_sum < config["min_sum"]:
+        return "market"
+    return algo
+
+
+class TinkoffGateway:
+    """
+    Доступ к заявкам и стакану Тинькофф для менеджера исполнения.
+
+    Держит собственный канал, так как дочерние заявки живут дольше запроса веб-хука.
+    """
+
+    def __init__(self, token, account_id):
+        self.account_id = account_id
+        self._client_manager = Client(token, target=INVEST_GRPC_API)
+        self.client = ResilientClient(wrap_services(self._client_manager.__enter__()))
+
+    def close(self):
+        self._client_manager.__exit__(None, None, None)
+
+    def get_best_prices(self, instrument_id):
+        order_book = self.client.market_data.get_order_book(
+            instrument_id=instrument_id, depth=1
+        )
+        bid = quotation_to_nano(order_book.bids[0].price) if order_book.bids else None
+        ask = quotation_to_nano(order_book.asks[0].price) if order_book.asks else None
+        return bid, ask
+
+    def post_order(self, instrument_id, quantity, direction, price_nano=None):
+        response = self.client.orders.post_order(
+            instrument_id=instrument_id,
+            quantity=quantity,
+            price=nano_to_quotation(price_nano) if price_nano is not None else None,
+            direction=(
+                OrderDirection.ORDER_DIRECTION_BUY
+                if direction == "buy"
+                else OrderDirection.ORDER_DIRECTION_SELL
+            ),
+            account_id=self.account_id,
+            order_type=(
+                OrderType.ORDER_TYPE_LIMIT
+                if price_nano is not None
+                else OrderType.ORDER_TYPE_MARKET
+            ),
+            order_id=str(uuid.uuid4()),
+        )
+        return response.order_id
+
+    def get_order(self, order_id):
+        state = self.client.orders.get_order_state(
+            account_id=self.account_id, order_id=order_id
+        )
+        return {
+            "lots_executed": state.lots_executed,
+            "price_nano": quotation_to_nano(state.average_position_price),
+            "done": state.execution_report_status in FINAL_STATUSES,
+        }
+
+    def cancel_order(self, order_id):
+        self.client.orders.cancel_order(account_id=self.account_id, order_id=order_id)
+
+
+class SimulatedOrderBook:
+    """
+    Симулятор стакана с тем же интерфейсом, что и TinkoffGateway.
+
+    Рыночные заявки проходят по уровням стакана, лимитные исполняются при
+    пересечении цены; move() сдвигает стакан и исполняет стоящие заявки.
+    """
+
+    def __init__(self, bids, asks):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.orders = {}
+        self.bids = [list(level) for level in bids]
+        self.asks = [list(level) for level in asks]
+
+    def get_best_prices(self, instrument_id):
+        with self._lock:
+            bid = self.bids[0][0] if self.bids else None
+            ask = self.asks[0][0] if self.asks else None
+            return bid, ask
+
+    def _match(self, order):
+        levels = self.asks if order["direction"] == "buy" else self.bids
+        while levels and order["lots_executed"] < order["quantity"]:
+            price, lots = levels[0]
+            limit = order["price_nano"]
+            if limit is not None and (
+                (order["direction"] == "buy" and price > limit)
+                or (order["direction"] == "sell" and price < limit)
+            ):
+                break
+            take = min(lots, order["quantity"] - order["lots_executed"])
+            order["notional"] += take * price
+            order["lots_executed"] += take
+            if take == lots:
+                levels.pop(0)
+            else:
+                levels[0][1] -= take
+        if order["lots_executed"] == order["quantity"] or order["price_nano"] is None:
+            order["done"] = True
+
+    def post_order(self, instrument_id, quantity, direction, price_nano=None):
+        with self._lock:
+            order_id = f"sim-{next(self._ids)}"
+            order = {
+                "quantity": quantity,
+                "direction": direction,
+                "price_nano": price_nano,
+                "lots_executed": 0,
+                "notional": 0,
+                "done": False,
+            }
+            self.orders[order_id] = order
+            self._match(order)
+            return order_id
+
+    def get_order(self, order_id):
+        with self._lock:
+            order = self.orders[order_id]
+            executed = order["lots_executed"]
+            return {
+                "lots_executed": executed,
+                "price_nano": order["notional"] // executed if executed else 0,
+                "done": order["done"],
+            }
+
+    def cancel_order(self, order_id):
+        with self._lock:
+            self.orders[order_id]["done"] = True
+
+    def move(self, bids, asks):
+        with self._lock:
+            self.bids = [list(level) for level in bids]
+            self.asks = [list(level) for level in asks]
+            for order in self.orders.values():
+                if not order["done"]:
+                    self._match(order)
+
+
+class ParentOrder:
+    """
+    Родительская заявка, исполняемая алгоритмом через дочерние заявки.
+    """
+
+    def __init__(self, ticker, instrument_id, direction, quantity, signal_price, algo):
+        self.id = str(uuid.uuid4())
+        self.ticker = ticker
+        self.instrument_id = instrument_id
+        self.direction = direction
+        self.quantity = quantity
+        self.signal_price_nano = price_to_nano(signal_price)
+        self.algo = algo
+        self.children = []
+        self.status = "working"
+        self.cancel_requested = False
+        self.created = time.time()
+
+    @property
+    def filled_lots(self):
+        return sum(child["lots_executed"] for child in self.children)
+
+    @property
+    def average_price_nano(self):
+        filled = self.filled_lots
+        if not filled:
+            return None
+        notional = sum(
+            child["lots_executed"] * child["price_nano"] for child in self.children
+        )
+        return notional // filled
+
+    @property
+    def shortfall_bps(self):
+        """
+        Implementation shortfall относительно цены сигнала в б.п. (>0 — потери).
+        """
+        average = self.average_price_nano
+        if average is None or not self.signal_price_nano:
+            return None
+        shortfall = average - self.signal_price_nano
+        if self.direction == "sell":
+            shortfall = -shortfall
+        return shortfall * 10_000 / self.signal_price_nano
+
+    def report(self):
+        return {
+            "parent_order_id": self.id,
+            "ticker": self.ticker,
+            "algo": self.algo,
+            "status": self.status,
+            "quantity": self.quantity,
+            "filled_lots": self.filled_lots,
+            "average_price": (
+                self.average_price_nano / 1_000_000_000
+                if self.average_price_nano is not None
+                else None
+            ),
+            "shortfall_bps": self.shortfall_bps,
+            "children": len(self.children),
+        }
+
+
+class OrderManager:
+    """
+    Асинхронный менеджер исполнения: один цикл asyncio в фоновом потоке
+    ведёт дочерние заявки всех родительских заявок одновременно.
+    """
+
+    def __init__(self, gateway, config=None):
+        self.gateway = gateway
+        self.config = config if config is not None else load_execution_config()
+        self.parents = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="order-manager", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def has_active(self, ticker):
+        return self.active_for(ticker) is not None
+
+    def active_for(self, ticker):
+        """
+        Возвращает работающую родительскую заявку по тикеру или None.
+        """
+        for parent in list(self.parents.values()):
+            if parent.ticker == ticker and parent.status == "working":
+                return parent
+        return None
+
+    def cancel(self, parent_id):
+        """
+        Останавливает исполнение: текущая дочерняя заявка снимается, добивки
+        рынком не будет; on_done получит заявку с уже исполненным количеством.
+
+        Returns:
+            bool: True, если заявка ещё работала.
+        """
+        parent = self.parents.get(parent_id)
+        if parent is None or parent.status != "working":
+            return False
+        parent.cancel_requested = True
+        logging.info(f"Cancel requested for parent order {parent_id}")
+        return True
+
+    def submit(
+        self,
+        ticker,
+        instrument_id,
+        direction,
+        quantity,
+        signal_price,
+        algo,
+        on_done=None,
+    ):
+        """
+        Ставит родительскую заявку в работу.
+
+        Args:
+            ticker: Тикер инструмента.
+            instrument_id: UID инструмента.
+            direction: Направление ("buy" или "sell").
+            quantity: Количество лотов.
+            signal_price: Цена сигнала (для implementation shortfall).
+            algo: "twap", "iceberg" или "peg".
+            on_done: Вызывается с ParentOrder после завершения (в пуле потоков).
+
+        Returns:
+            ParentOrder: Родительская заявка.
+        """
+        parent = ParentOrder(
+            ticker, instrument_id, direction, quantity, signal_price, algo
+        )
+        self.parents[parent.id] = parent
+        asyncio.run_coroutine_threadsafe(self._run(parent, on_done), self._loop)
+        logging.info(
+            f"Submitted {algo} parent order {parent.id}: ticker={ticker}, "
+            f"direction={direction}, quantity={quantity}"
+        )
+        return parent
+
+    async def _call(self, func, *args, **kwargs):
+        return await self._loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def _run(self, parent, on_done):
+        try:
+            if parent.algo == "twap":
+                await self._twap(parent)
+            elif parent.algo == "iceberg":
+                await self._work_limit(parent, self.config["iceberg_display_lots"])
+            elif parent.algo == "peg":
+                await self._work_limit(parent, parent.quantity)
+            else:
+                child = await self._place(parent, parent.quantity, None)
+                await self._settle(parent, child, self.config["poll_interval"] * 5)
+            remaining = parent.quantity - parent.filled_lots
+            if (
+                remaining > 0
+                and self.config["sweep_remainder"]
+                and not parent.cancel_requested
+            ):
+                child = await self._place(parent, remaining, None)
+                await self._settle(parent, child, self.config["poll_interval"] * 5)
+            parent.status = "filled" if parent.filled_lots else "failed"
+        except Exception as e:
+            logging.error(f"Execution of parent order {parent.id} failed: {str(e)}")
+            for child in parent.children:
+                if not child["done"]:
+                    try:
+                        await self._cancel(child)
+                    except Exception as cancel_error:
+                        logging.error(
+                            f"Failed to refresh child order {child['order_id']}: "
+                            f"{str(cancel_error)}"
+                        )
+            parent.status = "filled" if parent.filled_lots else "failed"
+        logging.info(f"Parent order finished: {parent.report()}")
+        if on_done is not None:
+            try:
+                await self._call(on_done, parent)
+            except Exception as e:
+                logging.error(f"on_done for parent order {parent.id} failed: {str(e)}")
+        self.parents.pop(parent.id, None)
+
+    async def _place(self, parent, quantity, price_nano):
+        order_id = await self._call(
+            self.gateway.post_order,
+            parent.instrument_id,
+            quantity,
+            parent.direction,
+            price_nano,
+        )
+        child = {
+            "order_id": order_id,
+            "quantity": quantity,
+            "limit_nano": price_nano,
+            "lots_executed": 0,
+            "price_nano": 0,
+            "done": False,
+        }
+        parent.children.append(child)
+        await self._refresh(child)
+        return child
+
+    async def _refresh(self, child):
+        state = await self._call(self.gateway.get_order, child["order_id"])
+        child.update(state)
+
+    async def _wait(self, parent, child, timeout):
+        deadline = time.monotonic() + timeout
+        while (
+            not child["done"]
+            and not parent.cancel_requested
+            and time.monotonic() < deadline
+        ):
+            await asyncio.sleep(self.config["poll_interval"])
+            await self._refresh(child)
+
+    async def _settle(self, parent, child, timeout):
+        """
+        Ждёт дочернюю заявку и снимает её, если она не завершилась: следующая
+        часть считается от исполненного, и поздние исполнения не дадут перебора.
+        """
+        await self._wait(parent, child, timeout)
+        if not child["done"]:
+            await self._cancel(child)
+
+    async def _cancel(self, child):
+        try:
+            await self._call(self.gateway.cancel_order, child["order_id"])
+        except Exception as e:
+            logging.error(f"Failed to cancel child order {child['order_id']}: {str(e)}")
+        await self._refresh(child)
+        child["done"] = True
+
+    async def _twap(self, parent):
+        slices = self.config["twap_slices"]
+        interval = self.config["twap_duration"] / slices
+        for index in range(slices):
+            remaining = parent.quantity - parent.filled_lots
+            if remaining <= 0 or parent.cancel_requested:
+                break
+            quantity = -(-remaining // (slices - index))
+            child = await self._place(parent, quantity, None)
+            await self._settle(parent, child, interval)
+
+    async def _work_limit(self, parent, display_lots):
+        """
+        Лимитные заявки по лучшей цене своей стороны стакана с перевыставлением
+        при сдвиге цены; display_lots ограничивает видимый объём (айсберг).
+        """
+        deadline = time.monotonic() + self.config["timeout"]
+        while time.monotonic() < deadline:
+            remaining = parent.quantity - parent.filled_lots
+            if remaining <= 0 or parent.cancel_requested:
+                return
+            bid, ask = await self._call(
+                self.gateway.get_best_prices, parent.instrument_id
+            )
+            price_nano = bid if parent.direction == "buy" else ask
+            if price_nano is None:
+                return
+            child = await self._place(parent, min(display_lots, remaining), price_nano)
+            cancelled = False
+            while not child["done"] and child["lots_executed"] < child["quantity"]:
+                await asyncio.sleep(self.config["poll_interval"])
+                await self._refresh(child)
+                bid, ask = await self._call(
+                    self.gateway.get_best_prices, parent.instrument_id
+                )
+                best = bid if parent.direction == "buy" else ask
+                if (
+                    best != child["limit_nano"]
+                    or time.monotonic() >= deadline
+                    or parent.cancel_requested
+                ):
+                    await self._cancel(child)
+                    cancelled = True
+                    break
+            # Заявка отклонена брокером — дальше работает добивка рынком
+            if not cancelled and child["lots_executed"] < child["quantity"]:
+                return
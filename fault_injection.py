@@ -0,0 +1,376 @@
+import copy
+import dataclasses
+import fnmatch
+import logging
+import os
+import random
+import threading
+import time
+import grpc
+from tinkoff.invest import OrderExecutionReportStatus
+from tinkoff.invest.exceptions import RequestError
+
+# Имя сценария из SCENARIOS; без переменной внедрение сбоев недоступно
+CHAOS_SCENARIO = os.environ.get("CHAOS_SCENARIO")
+
+# Сценарии — списки правил. Поля правила:
+#   rpc — шаблон "service.method" (fnmatch), action — latency, error, timeout,
+#   partial_fill или drop_stream; probability — вероятность срабатывания;
+#   after — сколько подходящих вызовов пропустить; times — сколько раз сработать;
+#   duration — сколько секунд правило активно с первого срабатывания;
+#   code — grpc.StatusCode для error/timeout; delay — задержка, секунды;
+#   fraction — доля исполнения для partial_fill; after_messages — для drop_stream.
+SCENARIOS = {
+    "none": [],
+    "latency": [{"rpc": "*", "action": "latency", "delay": 0.3}],
+    "flaky_reads": [
+        {"rpc": "*.get_*", "action": "error", "code": "UNAVAILABLE", "probability": 0.3}
+    ],
+    "rate_limited": [
+        {
+            "rpc": "orders.*",
+            "action": "error",
+            "code": "RESOURCE_EXHAUSTED",
+            "probability": 0.5,
+            "duration": 30,
+        }
+    ],
+    # Рыночная заявка проходит, а стоп-лосс не ставится
+    "stop_loss_fails": [
+        {
+            "rpc": "stop_orders.post_stop_order",
+            "action": "error",
+            "code": "INTERNAL",
+            "duration": 60,
+        }
+    ],
+    # Статус заявок недоступен: закрытия должны дождаться восстановления
+    "order_state_down": [
+        {
+            "rpc": "orders.get_order*",
+            "action": "error",
+            "code": "UNAVAILABLE",
+            "duration": 120,
+        }
+    ],
+    # get_portfolio в handle_stop_close отвечает по таймауту
+    "portfolio_timeout": [
+        {
+            "rpc": "operations.get_portfolio",
+            "action": "timeout",
+            "delay": 2.0,
+            "duration": 60,
+        }
+    ],
+    "partial_fills": [
+        {"rpc": "orders.post_order", "action": "partial_fill", "fraction": 0.5},
+        {
+            "rpc": "orders.get_order_state",
+            "action": "partial_fill",
+            "fraction": 0.5,
+            "times": 5,
+        },
+    ],
+    "stream_drop": [
+        {
+            "rpc": "market_data_stream.create",
+            "action": "drop_stream",
+            "after_messages": 20,
+        }
+    ],
+}
+
+
+class FaultRule:
+    def __init__(
+        self,
+        rpc,
+        action,
+        probability=1.0,
+        after=0,
+        times=None,
+        duration=None,
+        code="UNAVAILABLE",
+        delay=0.0,
+        fraction=0.5,
+        after_messages=10,
+    ):
+        self.rpc = rpc
+        self.action = action
+        self.probability = probability
+        self.after = after
+        self.times = times
+        self.duration = duration
+        self.code = getattr(grpc.StatusCode, code)
+        self.delay = delay
+        self.fraction = fraction
+        self.after_messages = after_messages
+        self.seen = 0
+        self.fired = 0
+        self.first_fired_at = None
+
+    def triggers(self, rpc, now):
+        # Вызывается под блокировкой инжектора
+        if not fnmatch.fnmatchcase(rpc, self.rpc):
+            return False
+        self.seen += 1
+        if self.seen <= self.after:
+            return False
+        if self.times is not None and self.fired >= self.times:
+            return False
+        if (
+            self.duration is not None
+            and self.first_fired_at is not None
+            and now - self.first_fired_at > self.duration
+        ):
+            return False
+        if random.random() >= self.probability:
+            return False
+        self.fired += 1
+        if self.first_fired_at is None:
+            self.first_fired_at = now
+        return True
+
+
+class FaultInjector:
+    """
+    Внедряет сбои в вызовы брокера по правилам сценария и считает время
+    восстановления: от первого внедрённого сбоя RPC до первого успешного вызова
+    того же RPC после окончания сбоев.
+    """
+
+    def __init__(self, scenario="none"):
+        self._lock = threading.Lock()
+        self.load(scenario)
+
+    def load(self, scenario):
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown chaos scenario: {scenario}")
+        with self._lock:
+            self.scenario = scenario
+            self.rules = [FaultRule(**rule) for rule in SCENARIOS[scenario]]
+            self.injected = {}
+            self.fault_since = {}
+            self.recoveries = []
+        logging.info(f"Chaos scenario loaded: {scenario}")
+
+    def _match(self, rpc):
+        now = time.monotonic()
+        with self._lock:
+            rules = [rule for rule in self.rules if rule.triggers(rpc, now)]
+            if any(rule.action in ("error", "timeout") for rule in rules):
+                self.fault_since.setdefault(rpc, now)
+            for rule in rules:
+                key = f"{rpc}:{rule.action}"
+                self.injected[key] = self.injected.get(key, 0) + 1
+        return rules
+
+    def _succeeded(self, rpc):
+        with self._lock:
+            started = self.fault_since.pop(rpc, None)
+            if started is not None:
+                self.recoveries.append(
+                    {"rpc": rpc, "time_to_recover": time.monotonic() - started}
+                )
+
+    def call(self, rpc, func, args, kwargs):
+        rules = self._match(rpc)
+        for rule in rules:
+            if rule.action in ("latency", "timeout"):
+                time.sleep(rule.delay)
+            if rule.action in ("error", "timeout"):
+                code = (
+                    grpc.StatusCode.DEADLINE_EXCEEDED
+                    if rule.action == "timeout"
+                    else rule.code
+                )
+                raise RequestError(code, f"chaos: {self.scenario}", None)
+        result = func(*args, **kwargs)
+        for rule in rules:
+            if rule.action == "partial_fill":
+                result = _partial(result, rule.fraction)
+            elif rule.action == "drop_stream":
+                result = _DroppingStream(result, rule.after_messages)
+        if not rules:
+            self._succeeded(rpc)
+        return result
+
+    def report(self):
+        with self._lock:
+            recoveries = list(self.recoveries)
+            return {
+                "scenario": self.scenario,
+                "injected": dict(self.injected),
+                "in_fault": {
+                    rpc: time.monotonic() - started
+                    for rpc, started in self.fault_since.items()
+                },
+                "recoveries": recoveries,
+                "max_time_to_recover": max(
+                    (r["time_to_recover"] for r in recoveries), default=None
+                ),
+            }
+
+
+def _partial(response, fraction):
+    # Ответ post_order/get_order_state с частичным исполнением
+    requested = getattr(response, "lots_requested", None)
+    if not requested:
+        return response
+    changes = {
+        "lots_executed": int(requested * fraction),
+        "execution_report_status": (
+            OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+        ),
+    }
+    if dataclasses.is_dataclass(response):
+        return dataclasses.replace(response, **changes)
+    response = copy.copy(response)
+    for name, value in changes.items():
+        setattr(response, name, value)
+    return response
+
+
+class _DroppingStream:
+    """
+    Обёртка стрима, которая обрывает его после after_messages сообщений.
+    """
+
+    def __init__(self, stream, after_messages):
+        self._stream = stream
+        self._after = after_messages
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        for index, message in enumerate(self._stream):
+            if index >= self._after:
+                self._stream.stop()
+                raise RequestError(
+                    grpc.StatusCode.UNAVAILABLE, "chaos: stream dropped", None
+                )
+            yield message
+
+
+class _ChaosService:
+    def __init__(self, name, service):
+        self._name = name
+        self._service = service
+
+    def __getattr__(self, method):
+        attr = getattr(self._service, method)
+        if not callable(attr):
+            return attr
+
+        def wrapped(*args, **kwargs):
+            return injector.call(f"{self._name}.{method}", attr, args, kwargs)
+
+        return wrapped
+
+
+class ChaosServices:
+    """
+    Обёртка над сервисами Tinkoff, пропускающая вызовы через injector.
+    Ставится под ResilientClient, чтобы сбои проходили через повторы и автомат
+    отключения так же, как настоящие.
+    """
+
+    def __init__(self, services):
+        self._services = services
+
+    def __getattr__(self, name):
+        attr = getattr(self._services, name)
+        if name == "create_market_data_stream":
+            return lambda *args, **kwargs: injector.call(
+                "market_data_stream.create", attr, args, kwargs
+            )
+        if callable(attr):
+            return attr
+        return _ChaosService(name, attr)
+
+
+def wrap_services(services):
+    """
+    Возвращает сервисы с внедрением сбоев, если процесс запущен с CHAOS_SCENARIO.
+    """
+    if injector is None:
+        return services
+    return ChaosServices(services)
+
+
+def check_invariants(positions, inflight):
+    """
+    Проверяет согласованность позиций и незавершённых заявок.
+
+    Args:
+        positions: Позиции {ticker: position}.
+        inflight: Незавершённые заявки {order_id: record}.
+
+    Returns:
+        list: Описания нарушений; пустой список — состояние согласовано.
+    """
+    violations = []
+    opening = {
+        record.get("ticker")
+        for record in inflight.values()
+        if record.get("kind") == "open"
+    }
+    for ticker, position in positions.items():
+        quantity = position.get("quantity")
+        # Пока заявка на открытие или алгоритм исполняются, позиция может быть пустой
+        pending = ticker in opening or position.get("pending_parent_id")
+        minimum = 0 if pending else 1
+        if not isinstance(quantity, int) or quantity < minimum:
+            violations.append(f"{ticker}: invalid quantity {quantity}")
+        if position.get("direction") not in ("buy", "sell"):
+            violations.append(
+                f"{ticker}: invalid direction {position.get('direction')}"
+            )
+        # Стоп ставится на исполненные лоты: до первого исполнения его нет
+        if (
+            position.get("stop_loss_price") is not None
+            and not position.get("stop_order_id")
+            and quantity
+        ):
+            violations.append(f"{ticker}: stop-loss set but no stop order")
+    for order_id, record in inflight.items():
+        if record.get("kind", "close") != "close":
+            continue
+        if record.get("ticker") not in positions:
+            violations.append(
+                f"close order {order_id}: no position {record.get('ticker')}"
+            )
+    return violations
+
+
+def reconcile_with_broker(client, account_id, positions):
+    """
+    Сравнивает позиции приложения с портфелем брокера по FIGI.
+
+    Returns:
+        list: Описания расхождений.
+    """
+    held = {}
+    for item in client.operations.get_portfolio(account_id=account_id).positions:
+        if item.instrument_type == "currency":
+            continue
+        units = item.quantity.units + item.quantity.nano / 1_000_000_000
+        if units:
+            held[item.figi] = units
+    violations = []
+    expected = {}
+    for ticker, position in positions.items():
+        shares = position["quantity"] * position.get("lot", 1)
+        sign = 1 if position["direction"] == "buy" else -1
+        expected[position["figi"]] = expected.get(position["figi"], 0) + sign * shares
+    for figi in set(held) | set(expected):
+        if held.get(figi, 0) != expected.get(figi, 0):
+            violations.append(
+                f"{figi}: broker holds {held.get(figi, 0)}, app expects {expected.get(figi, 0)}"
+            )
+    return violations
+
+
+# Внедрение сбоев включается только при запуске с CHAOS_SCENARIO
+injector = FaultInjector(CHAOS_SCENARIO) if CHAOS_SCENARIO else None
@@ -1,9 +1,66 @@
-import json
-import os
 import logging
 from decimal import Decimal
 from tinkoff.invest import Client, InstrumentIdType
-from utils import quotation_to_decimal, TOKENS_FIGI_UID_FILE
+from utils import quotation_to_decimal
+from state_backend import state
+from tick_math import tick_scale_from_decimal
+
+# Шаг цены в нано-единицах по FIGI, заполняется при кэшировании инструмента
+_tick_scales = {}
+# Сектор и валюта по FIGI для риск-контроля
+_instrument_meta = {}
+# Счётчики обращений к кэшу инструментов
+_cache_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+
+def get_tick_scale(figi: str):
+    """
+    Возвращает предрассчитанный шаг цены инструмента в нано-единицах.
+
+    Args:
+        figi: FIGI инструмента.
+
+    Returns:
+        int: Шаг цены или None, если инструмент ещё не загружался.
+    """
+    return _tick_scales.get(figi)
+
+
+def get_instrument_meta(figi: str):
+    """
+    Возвращает сектор и валюту инструмента из кэша.
+
+    Args:
+        figi: FIGI инструмента.
+
+    Returns:
+        tuple: (sector, currency), "unknown" для неизвестных значений.
+    """
+    return _instrument_meta.get(figi, ("unknown", "unknown"))
+
+
+def get_cache_stats():
+    """
+    Возвращает размер кэша шагов цены и счётчики обращений к кэшу инструментов.
+    """
+    return dict(_cache_stats, cached_instruments=len(_tick_scales))
+
+
+def _backfill_meta(client: Client, figi: str, cached: dict):
+    """
+    Дописывает сектор и валюту в запись кэша; при ошибке запись остаётся прежней.
+    """
+    try:
+        instrument = client.instruments.get_instrument_by(
+            id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
+        ).instrument
+        cached["sector"] = instrument.sector or "unknown"
+        cached["currency"] = instrument.currency or "unknown"
+        state.put_instrument(figi, cached)
+        logging.info(f"Backfilled sector and currency for figi={figi}")
+    except Exception as e:
+        logging.error(f"Failed to backfill sector and currency for {figi}: {str(e)}")
+
 
 def get_instrument_data(client: Client, figi: str, ticker: str):
     """
@@ -19,28 +76,36 @@ def get_instrument_data(client: Client, figi: str, ticker: str):
     """
     instrument_data = {}
     try:
-        if os.path.exists(TOKENS_FIGI_UID_FILE):
-            with open(TOKENS_FIGI_UID_FILE, 'r', encoding='utf-8') as json_file:
-                instrument_data = json.load(json_file)
-            logging.info(f"Loaded instrument data from {TOKENS_FIGI_UID_FILE}")
-        else:
-            logging.info(f"No instrument data file found at {TOKENS_FIGI_UID_FILE}, starting with empty data")
-    except json.JSONDecodeError as e:
-        logging.error(f"Invalid JSON in {TOKENS_FIGI_UID_FILE}: {str(e)}")
-        instrument_data = {}
+        cached = state.get_instrument(figi)
+        if cached is not None:
+            instrument_data[figi] = cached
     except Exception as e:
         logging.error(f"Error loading instrument data: {str(e)}")
         instrument_data = {}
 
     # Проверка кэша
     if figi in instrument_data:
+        _cache_stats["hits"] += 1
         instrument_uid = instrument_data[figi]["instrument_uid"]
         lot = instrument_data[figi]["lot"]
         min_price_increment = Decimal(instrument_data[figi]["min_price_increment"])
+        cached = instrument_data[figi]
+        if "sector" not in cached or "currency" not in cached:
+            # Кэш до появления сектора и валюты: дописываем их из API
+            _backfill_meta(client, figi, cached)
+        if figi not in _tick_scales:
+            _tick_scales[figi] = instrument_data[figi].get(
+                "min_price_increment_nano"
+            ) or tick_scale_from_decimal(min_price_increment)
+            _instrument_meta[figi] = (
+                instrument_data[figi].get("sector") or "unknown",
+                instrument_data[figi].get("currency") or "unknown",
+            )
         logging.info(f"Found instrument in cache: figi={figi}, uid={instrument_uid}, lot={lot}, min_price_increment={min_price_increment}")
         return instrument_uid, lot, min_price_increment
 
     # Запрос к API
+    _cache_stats["misses"] += 1
     try:
         instrument = client.instruments.get_instrument_by(
             id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
@@ -52,20 +117,28 @@ def get_instrument_data(client: Client, figi: str, ticker: str):
         instrument_uid = instrument.uid
         lot = instrument.lot
         min_price_increment = quotation_to_decimal(instrument.min_price_increment)
+        _tick_scales[figi] = tick_scale_from_decimal(min_price_increment)
+        _instrument_meta[figi] = (
+            instrument.sector or "unknown",
+            instrument.currency or "unknown",
+        )
         instrument_data[figi] = {
             "ticker": ticker,
             "instrument_uid": instrument_uid,
             "lot": lot,
-            "min_price_increment": str(min_price_increment)
+            "min_price_increment": str(min_price_increment),
+            "min_price_increment_nano": _tick_scales[figi],
+            "sector": _instrument_meta[figi][0],
+            "currency": _instrument_meta[figi][1]
         }
 
         # Сохранение кэша
-        with open(TOKENS_FIGI_UID_FILE, 'w', encoding='utf-8') as json_file:
-            json.dump(instrument_data, json_file, ensure_ascii=False, indent=4)
+        state.put_instrument(figi, instrument_data[figi])
         logging.info(f"Saved new instrument data: figi={figi}, uid={instrument_uid}, lot={lot}, min_price_increment={min_price_increment}")
 
         return instrument_uid, lot, min_price_increment
 
     except Exception as e:
+        _cache_stats["errors"] += 1
         logging.error(f"Error fetching instrument data for FIGI {figi}: {str(e)}")
         return None, None, None
\ No newline at end of file
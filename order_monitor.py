@@ -1,93 +1,749 @@
 import time
-from tinkoff.invest import Client
-from tinkoff.invest.constants import INVEST_GRPC_API
-from tinkoff_api import TOKEN
-from utils import save_positions_to_json, POSITIONS_FILE
+import threading
+import uuid
+from tinkoff.invest import OrderDirection, OrderExecutionReportStatus, OrderType
+from broker_client import open_client
+from notifier import notify_error
+from state_backend import state
+from risk_manager import risk_engine
+from trade_history import history, journal_trade
+from status_board import board
+from stop_order_manager import place_stop_loss
+from tick_math import NANO, nano_to_float, price_to_nano, quotation_to_nano
 import logging
 
+# Интервал опроса незавершённых заявок, секунды
+POLL_INTERVAL = 1
+# Пауза после ошибки запроса к брокеру, секунды
+ERROR_BACKOFF = 5
+# Сколько последних ID сделок хранить в записи заявки для отсева повторов стрима
+MAX_TRADE_IDS = 100
 
-def monitor_order_completion(
-    account_id,
-    ticker,
-    open_order_id,
-    close_order_id,
-    positions,
-    log_trade_to_csv,
-    exit_comment=None,
-    exit_client_order_id=None,
-    lock=None,
-    exit_signal_price=None,
-):
-    if exit_signal_price is None:
-        logging.error(f"Missing exit_signal_price for ticker {ticker}")
-        return
-
-    with Client(TOKEN, target=INVEST_GRPC_API) as client:
-        while True:
+FAILED_STATUSES = (
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+)
+FINAL_STATUSES = (OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,) + (
+    FAILED_STATUSES
+)
+
+
+def apply_fill(position, lots, price_nano, opening):
+    """
+    Учитывает исполнение в позиции за O(1): набор пересчитывает среднюю цену
+    входа, сокращение фиксирует результат от средней цены.
+
+    Args:
+        position: Запись позиции, изменяется на месте.
+        lots: Исполнено лотов.
+        price_nano: Цена исполнения за инструмент в нано-единицах.
+        opening: True для заявки на открытие (набор), False для закрытия.
+
+    Returns:
+        int: Зафиксированный результат в нано-единицах валюты (0 при наборе).
+    """
+    lot = position.get("lot", 1)
+    quantity = position["quantity"]
+    # Позиции без средней цены (до учёта исполнений) считаются открытыми по цене сигнала
+    avg_nano = position.get("avg_price_nano")
+    if avg_nano is None:
+        avg_nano = price_to_nano(position["signal_price"]) if quantity else 0
+    realized_nano = 0
+    if opening:
+        avg_nano = (avg_nano * quantity + price_nano * lots) // (quantity + lots)
+        position["quantity"] = quantity + lots
+        position["filled_lots"] = position.get("filled_lots", quantity) + lots
+    else:
+        lots = min(lots, quantity)
+        sign = 1 if position["direction"] == "buy" else -1
+        realized_nano = sign * (price_nano - avg_nano) * lots * lot
+        position["quantity"] = quantity - lots
+        position["closed_lots"] = position.get("closed_lots", 0) + lots
+        position["realized_pnl_nano"] = (
+            position.get("realized_pnl_nano", 0) + realized_nano
+        )
+        position["realized_pnl"] = nano_to_float(position["realized_pnl_nano"])
+    position["avg_price_nano"] = avg_nano
+    position["avg_price"] = nano_to_float(avg_nano)
+    return realized_nano
+
+
+def build_trade_data(ticker, position, record, close_order_id):
+    """
+    Формирует строку trades.csv по исполнениям заявки на закрытие: количество —
+    закрытые лоты, результат — от средних цен входа и выхода.
+    """
+    exit_signal_price = record["exit_signal_price"]
+    entry_signal_price = position["signal_price"]
+    quantity = record["applied_lots"]
+    shares = quantity * record["lot"]
+    entry_price = position.get("avg_price") or entry_signal_price
+    exit_price = record["applied_amount_nano"] / shares / NANO
+
+    # Комиссия 0.05% от фактического оборота
+    entry_broker_fee = entry_price * shares * 0.0005
+    exit_broker_fee = exit_price * shares * 0.0005
+    broker_fee = entry_broker_fee + exit_broker_fee
+
+    profit_gross = nano_to_float(record["realized_nano"])
+    profit_net = profit_gross - broker_fee
+
+    return {
+        "ticker": ticker,
+        "figi": position["figi"],
+        "exitComment": record["exit_comment"],
+        "instrument_uid": position["instrument_uid"],
+        "open_datetime": position["open_datetime"],
+        "close_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "entry_signal_price": entry_signal_price,
+        "exit_signal_price": exit_signal_price,
+        "quantity": quantity,
+        "entry_broker_fee": entry_broker_fee,
+        "exit_broker_fee": exit_broker_fee,
+        "broker_fee": broker_fee,
+        "profit_gross": profit_gross,
+        "profit_net": profit_net,
+        "entry_client_order_id": position["client_order_id"],
+        "entry_exchange_order_id": record["open_order_id"],
+        "exit_client_order_id": record["exit_client_order_id"],
+        "exit_exchange_order_id": close_order_id,
+    }
+
+
+class OrderTracker:
+    """
+    Отслеживает незавершённые заявки на открытие и закрытие и ведёт позиции по
+    их исполнениям.
+
+    Каждая заявка сначала записывается в хранилище (inflight), поэтому после
+    перезапуска отслеживание продолжается. Исполнения приходят из стрима сделок
+    сразу и сверяются с опросом: статусы запрашиваются одним get_orders на все
+    заявки, состояние — отдельно только у заявок, покинувших список активных.
+    Оба источника дают накопленное исполнение, в позицию попадает только его
+    прирост, поэтому сделки не учитываются дважды.
+    """
+
+    def __init__(self, account_id_getter, token, client_factory=open_client):
+        self.get_account_id = account_id_getter
+        self.token = token
+        self.client_factory = client_factory
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._trades_context = None
+
+    def _register(self, order_id, record):
+        record.update(
+            {
+                "applied_lots": record.get("applied_lots", 0),
+                "applied_amount_nano": record.get("applied_amount_nano", 0),
+                "stream_lots": 0,
+                "stream_amount_nano": 0,
+                "realized_nano": 0,
+                "trade_ids": [],
+                "registered_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+        )
+        state.put_inflight(order_id, record)
+        with self._lock:
+            self._inflight[order_id] = record
+        board.update_order(order_id, record)
+        self._wakeup.set()
+        logging.info(
+            f"Tracking {record['kind']} order {order_id} for {record['ticker']}"
+        )
+
+    def track_open(
+        self,
+        ticker,
+        order_id,
+        lots_requested,
+        lot,
+        lots_executed=0,
+        executed_amount_nano=0,
+    ):
+        """
+        Ставит на отслеживание заявку на открытие, исполненную не полностью.
+
+        Args:
+            lots_executed: Лоты, уже учтённые в позиции по ответу post_order.
+            executed_amount_nano: Их стоимость в нано-единицах.
+        """
+        self._register(
+            order_id,
+            {
+                "ticker": ticker,
+                "kind": "open",
+                "lots_requested": lots_requested,
+                "lot": lot,
+                "applied_lots": lots_executed,
+                "applied_amount_nano": executed_amount_nano,
+            },
+        )
+
+    def track_close(
+        self,
+        ticker,
+        open_order_id,
+        close_order_id,
+        exit_comment,
+        exit_client_order_id,
+        exit_signal_price,
+        lots_requested=None,
+        lot=1,
+    ):
+        """
+        Регистрирует заявку на закрытие позиции и ставит её на отслеживание.
+        """
+        if exit_signal_price is None:
+            logging.error(f"Missing exit_signal_price for ticker {ticker}")
+            return
+        self._register(
+            close_order_id,
+            {
+                "ticker": ticker,
+                "kind": "close",
+                "lots_requested": lots_requested,
+                "lot": lot,
+                "open_order_id": open_order_id,
+                "exit_comment": exit_comment,
+                "exit_client_order_id": exit_client_order_id,
+                "exit_signal_price": exit_signal_price,
+            },
+        )
+
+    def inflight(self):
+        with self._lock:
+            return dict(self._inflight)
+
+    def open_order_for(self, ticker):
+        """
+        Возвращает ID незавершённой заявки на открытие позиции по тикеру или None.
+        """
+        for order_id, record in self.inflight().items():
+            if record["ticker"] == ticker and record["kind"] == "open":
+                return order_id
+        return None
+
+    def closing_lots(self, ticker):
+        """
+        Возвращает лоты тикера в незавершённых заявках на закрытие всех процессов,
+        ещё не учтённые в позиции.
+        """
+        return sum(
+            (record.get("lots_requested") or 0) - record.get("applied_lots", 0)
+            for record in state.get_inflight().values()
+            if record["ticker"] == ticker and record.get("kind", "close") == "close"
+        )
+
+    def start(self):
+        """
+        Загружает незавершённые заявки из хранилища и запускает опрос и стрим сделок.
+        """
+        recovered = state.get_inflight()
+        positions = state.get_positions()
+        for order_id, record in recovered.items():
+            # Записи прежнего формата — только заявки на закрытие без учтённых исполнений
+            position = positions.get(record["ticker"], {})
+            record.setdefault("kind", "close")
+            record.setdefault("lots_requested", None)
+            record.setdefault("lot", position.get("lot", 1))
+            for field in (
+                "applied_lots",
+                "applied_amount_nano",
+                "stream_lots",
+                "stream_amount_nano",
+                "realized_nano",
+            ):
+                record.setdefault(field, 0)
+            record.setdefault("trade_ids", [])
+        with self._lock:
+            self._inflight.update(recovered)
+        for order_id, record in recovered.items():
+            board.update_order(order_id, record, event="order_recovered")
+        if recovered:
+            logging.info(f"Resuming {len(recovered)} in-flight orders")
+        for target, name in (
+            (self._run, "order-tracker"),
+            (self._run_trades, "order-trades"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """
+        Завершает опрос и стрим сделок; незавершённые заявки остаются в хранилище.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        # Стрим блокируется в ожидании сделок — прерываем его закрытием канала
+        self._close_trades_stream()
+        for thread in self._threads:
+            thread.join(timeout)
+            if thread.is_alive():
+                logging.error(f"Thread {thread.name} did not stop in {timeout}s")
+        self._threads = []
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self.inflight():
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
             try:
-                close_state = client.orders.get_order_state(
-                    account_id=account_id, order_id=close_order_id
-                )
+                with self.client_factory(self.token) as client:
+                    while self.inflight() and not self._stopping.is_set():
+                        self._poll(client)
+                        self._stopping.wait(POLL_INTERVAL)
             except Exception as e:
-                logging.error(
-                    f"Failed to get order state for {close_order_id}: {str(e)}"
+                logging.error(f"Order tracker failed: {str(e)}")
+                self._stopping.wait(ERROR_BACKOFF)
+
+    def _run_trades(self):
+        while not self._stopping.is_set():
+            context = self.client_factory(self.token)
+            try:
+                client = context.__enter__()
+                with self._lock:
+                    self._trades_context = context
+                # stop() мог не застать канал открытым — проверяем после записи
+                if self._stopping.is_set():
+                    break
+                for response in client.orders_stream.trades_stream(
+                    accounts=[self.get_account_id()]
+                ):
+                    if self._stopping.is_set():
+                        break
+                    if response.order_trades:
+                        self.on_trades(client, response.order_trades)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    logging.error(f"Trades stream failed: {str(e)}")
+            finally:
+                self._close_trades_stream(context)
+            self._stopping.wait(ERROR_BACKOFF)
+
+    def _close_trades_stream(self, context=None):
+        """
+        Закрывает канал стрима сделок (однократно: из stop() или из самого потока).
+        """
+        with self._lock:
+            current = self._trades_context
+            if current is None or (context is not None and current is not context):
+                return
+            self._trades_context = None
+        try:
+            current.__exit__(None, None, None)
+        except Exception as e:
+            logging.error(f"Failed to close trades stream: {str(e)}")
+
+    def on_trades(self, client, order_trades):
+        """
+        Учитывает сделки из стрима по отслеживаемой заявке.
+        """
+        order_id = order_trades.order_id
+        with self._lock:
+            record = self._inflight.get(order_id)
+        if record is None:
+            return
+        for trade in order_trades.trades:
+            # quantity сделки — в штуках инструмента
+            self._apply(
+                client,
+                order_id,
+                trade=(
+                    trade.trade_id or f"{trade.date_time}:{trade.quantity}",
+                    trade.quantity // record["lot"],
+                    quotation_to_nano(trade.price) * trade.quantity,
+                ),
+            )
+
+    def _poll(self, client):
+        account_id = self.get_account_id()
+        active = {
+            order.order_id: order
+            for order in client.orders.get_orders(account_id=account_id).orders
+        }
+        for order_id in self.inflight():
+            order_state = active.get(order_id)
+            if order_state is not None:
+                self._apply(client, order_id, order_state=order_state)
+                continue
+            try:
+                order_state = client.orders.get_order_state(
+                    account_id=account_id, order_id=order_id
                 )
-                time.sleep(5)
+            except Exception as e:
+                logging.error(f"Failed to get order state for {order_id}: {str(e)}")
                 continue
-            if (
-                close_state.lots_executed == close_state.lots_requested
-                and close_state.execution_report_status == 1
-            ):
-                entry_signal_price = positions[ticker]["signal_price"]
-                quantity = positions[ticker]["quantity"]
-                direction = positions[ticker]["direction"]
-                lot = positions[ticker].get(
-                    "lot", 1
-                )  # Assuming lot is available in positions, default to 1 if not present
-
-                # Calculate commissions
-                entry_broker_fee = (
-                    entry_signal_price * quantity * 0.0005
-                )  # Example commission rate of 0.05%
-                exit_broker_fee = (
-                    exit_signal_price * quantity * 0.0005
-                )  # Example commission rate of 0.05%
-                broker_fee = entry_broker_fee + exit_broker_fee
-
-                # Calculate profit
-                profit_gross = (
-                    (exit_signal_price - entry_signal_price) * quantity * lot
-                    if direction == "buy"
-                    else (entry_signal_price - exit_signal_price) * quantity * lot
+            self._apply(client, order_id, order_state=order_state)
+            if order_state.execution_report_status in FINAL_STATUSES:
+                self._finish(client, order_id, order_state.execution_report_status)
+
+    def settle_open(self, client, ticker):
+        """
+        Снимает незавершённую заявку на открытие перед закрытием позиции и
+        учитывает её итоговое исполнение. Вызывается под блокировкой тикера.
+
+        Returns:
+            dict: Позиция после учёта исполнений или None, если ничего не исполнено.
+        """
+        order_id = self.open_order_for(ticker)
+        if order_id is None:
+            return state.get_positions().get(ticker)
+        account_id = self.get_account_id()
+        try:
+            client.orders.cancel_order(account_id=account_id, order_id=order_id)
+        except Exception as e:
+            # Заявка могла исполниться до отмены
+            logging.error(f"Failed to cancel open order {order_id}: {str(e)}")
+        order_state = client.orders.get_order_state(
+            account_id=account_id, order_id=order_id
+        )
+        fill = self._apply_locked(order_id, order_state=order_state)
+        if fill is not None:
+            self._after_fill(client, order_id, *fill, resize_stop=False)
+        outcome = self._finish_locked(order_id, order_state.execution_report_status)
+        if outcome is not None:
+            self._after_finish(client, outcome, resize_stop=False)
+        return state.get_positions().get(ticker)
+
+    def flatten(self, client, ticker, exit_comment):
+        """
+        Закрывает позицию рыночной заявкой, например если её не удалось защитить
+        стоп-лоссом: снимает незавершённую заявку на открытие и ставит закрытие
+        исполненного на отслеживание. Вызывается под блокировкой тикера.
+
+        Returns:
+            str: ID заявки на закрытие или None, если закрывать нечего.
+        """
+        position = self.settle_open(client, ticker)
+        if position is None or position["quantity"] <= 0:
+            return None
+        client_order_id = str(uuid.uuid4())
+        response = client.orders.post_order(
+            instrument_id=position["instrument_uid"],
+            quantity=position["quantity"],
+            direction=(
+                OrderDirection.ORDER_DIRECTION_SELL
+                if position["direction"] == "buy"
+                else OrderDirection.ORDER_DIRECTION_BUY
+            ),
+            account_id=self.get_account_id(),
+            order_type=OrderType.ORDER_TYPE_MARKET,
+            order_id=client_order_id,
+        )
+        exit_signal_price = position.get("avg_price") or position["signal_price"]
+        history.record_order(
+            {
+                "exchange_order_id": response.order_id,
+                "client_order_id": client_order_id,
+                "ticker": ticker,
+                "figi": position["figi"],
+                "instrument_uid": position["instrument_uid"],
+                "direction": "sell" if position["direction"] == "buy" else "buy",
+                "quantity": position["quantity"],
+                "order_type": "market",
+                "signal_price": exit_signal_price,
+                "exitComment": exit_comment,
+            }
+        )
+        self.track_close(
+            ticker,
+            position["exchange_order_id"],
+            response.order_id,
+            exit_comment,
+            client_order_id,
+            exit_signal_price,
+            lots_requested=position["quantity"],
+            lot=position.get("lot", 1),
+        )
+        logging.info(
+            f"Flattening {ticker}: {position['quantity']} lots, order {response.order_id}"
+        )
+        return response.order_id
+
+    def _apply(self, client, order_id, order_state=None, trade=None):
+        with self._lock:
+            record = self._inflight.get(order_id)
+        if record is None:
+            return
+        with state.lock(f"ticker:{record['ticker']}"):
+            fill = self._apply_locked(order_id, order_state, trade)
+        if fill is not None:
+            self._after_fill(client, order_id, *fill)
+
+    def _reload(self, order_id):
+        """
+        Перечитывает запись заявки из хранилища под блокировкой тикера: заявки
+        после перезапуска видят все воркеры, и учтённое другим процессом не
+        должно применяться повторно.
+
+        Returns:
+            dict: Копия записи или None, если заявку уже завершил другой воркер.
+        """
+        with self._lock:
+            record = self._inflight.get(order_id)
+        if record is None:
+            return None
+        stored = state.get_inflight().get(order_id)
+        if stored is None:
+            with self._lock:
+                self._inflight.pop(order_id, None)
+            board.remove_order(order_id, event="order_finished_elsewhere")
+            logging.info(f"Order {order_id} was finished by another worker")
+            return None
+        # Поля записи прежнего формата дополнены при загрузке
+        record = dict(record)
+        record.update(stored)
+        return record
+
+    def _apply_locked(self, order_id, order_state=None, trade=None):
+        # Накопленное исполнение по источнику: сумма сделок стрима или lots_executed
+        # заявки. В позицию идёт только превышение над уже учтённым.
+        record = self._reload(order_id)
+        if record is None:
+            return None
+        lot = record["lot"]
+        if trade is not None:
+            trade_id, lots, amount_nano = trade
+            if trade_id in record["trade_ids"]:
+                return None
+            record["trade_ids"] = (record["trade_ids"] + [trade_id])[-MAX_TRADE_IDS:]
+            record["stream_lots"] += lots
+            record["stream_amount_nano"] += amount_nano
+            executed_lots = record["stream_lots"]
+            executed_amount_nano = record["stream_amount_nano"]
+        else:
+            executed_lots = order_state.lots_executed
+            # average_position_price — средняя цена за инструмент
+            # (executed_order_price — уже сумма по заявке)
+            executed_amount_nano = (
+                quotation_to_nano(order_state.average_position_price)
+                * executed_lots
+                * lot
+            )
+        lots = executed_lots - record["applied_lots"]
+        fill = None
+        if lots > 0:
+            ticker = record["ticker"]
+            position = state.get_positions().get(ticker)
+            amount_nano = executed_amount_nano - record["applied_amount_nano"]
+            if amount_nano <= 0 < executed_amount_nano:
+                # Источники разошлись в цене — берём среднюю по источнику
+                amount_nano = executed_amount_nano * lots // executed_lots
+            elif amount_nano <= 0:
+                # Брокер не сообщил цену исполнения — считаем по цене сигнала
+                reference = record.get("exit_signal_price") or (position or {}).get(
+                    "signal_price", 0
                 )
-                profit_net = profit_gross - broker_fee
-
-                trade_data = {
-                    "ticker": ticker,
-                    "figi": positions[ticker]["figi"],
-                    "exitComment": exit_comment,
-                    "instrument_uid": positions[ticker]["instrument_uid"],
-                    "open_datetime": positions[ticker]["open_datetime"],
-                    "close_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
-                    "entry_signal_price": entry_signal_price,
-                    "exit_signal_price": exit_signal_price,
-                    "quantity": quantity,
-                    "entry_broker_fee": entry_broker_fee,
-                    "exit_broker_fee": exit_broker_fee,
-                    "broker_fee": broker_fee,
-                    "profit_gross": profit_gross,
-                    "profit_net": profit_net,
-                    "entry_client_order_id": positions[ticker]["client_order_id"],
-                    "entry_exchange_order_id": open_order_id,
-                    "exit_client_order_id": exit_client_order_id,
-                    "exit_exchange_order_id": close_order_id,
-                }
+                amount_nano = price_to_nano(reference) * lots * lot
+            price_nano = amount_nano // (lots * lot)
+            if position is not None:
+                realized_nano = apply_fill(
+                    position, lots, price_nano, record["kind"] == "open"
+                )
+                record["realized_nano"] += realized_nano
+                state.put_position(ticker, position)
+                fill = (ticker, position, lots, price_nano)
+            record["applied_lots"] = executed_lots
+            record["applied_amount_nano"] += amount_nano
+        elif trade is None:
+            return None
+        state.put_inflight(order_id, record)
+        with self._lock:
+            if order_id in self._inflight:
+                self._inflight[order_id] = record
+        return fill
+
+    def _after_fill(
+        self, client, order_id, ticker, position, lots, price_nano, resize_stop=True
+    ):
+        history.record_fill(
+            {
+                "exchange_order_id": order_id,
+                "ticker": ticker,
+                "figi": position["figi"],
+                "lots": lots,
+                "price": nano_to_float(price_nano),
+            }
+        )
+        board.update_position(ticker, position, event="position_filled")
+        risk_engine.on_open(ticker, position)
+        with self._lock:
+            record = self._inflight.get(order_id)
+        if record is not None:
+            board.update_order(order_id, record, event="order_partially_filled")
+        logging.info(
+            f"Applied fill of order {order_id}: {ticker} {lots} lots at "
+            f"{nano_to_float(price_nano)}, position {position['quantity']} lots, "
+            f"avg {position['avg_price']}"
+        )
+        if resize_stop and record is not None and record["kind"] == "open":
+            # Стоп покрывает только исполненные лоты
+            self._resize_stop(client, ticker)
+
+    def _forget(self, order_id, event, **details):
+        state.delete_inflight(order_id)
+        with self._lock:
+            self._inflight.pop(order_id, None)
+        board.remove_order(order_id, event=event, **details)
+
+    def _finish(self, client, order_id, status):
+        with self._lock:
+            record = self._inflight.get(order_id)
+        if record is None:
+            return
+        with state.lock(f"ticker:{record['ticker']}"):
+            outcome = self._finish_locked(order_id, status)
+        if outcome is not None:
+            self._after_finish(client, outcome)
+
+    def _finish_locked(self, order_id, status):
+        record = self._reload(order_id)
+        if record is None:
+            return None
+        ticker = record["ticker"]
+        position = state.get_positions().get(ticker)
+        trade_data = None
+        if record["kind"] == "close" and record["applied_lots"]:
+            if position is None:
+                logging.error(f"Position {ticker} already closed for {order_id}")
+            else:
+                trade_data = build_trade_data(ticker, position, record, order_id)
                 try:
-                    log_trade_to_csv(trade_data)
+                    journal_trade(trade_data, position["quantity"] <= 0)
                 except Exception as e:
                     logging.error(f"Failed to write to trades.csv: {str(e)}")
-                with lock:
-                    del positions[ticker]
-                    save_positions_to_json(positions)
-                break
-            time.sleep(1)
+        removed = position is not None and position["quantity"] <= 0
+        if removed:
+            state.delete_position(ticker)
+        self._forget(
+            order_id,
+            "order_filled" if record["applied_lots"] else "order_failed",
+            status=str(status),
+        )
+        return {
+            "order_id": order_id,
+            "record": record,
+            "status": status,
+            "position": position,
+            "removed": removed,
+            "trade_data": trade_data,
+        }
+
+    def _after_finish(self, client, outcome, resize_stop=True):
+        order_id = outcome["order_id"]
+        record = outcome["record"]
+        position = outcome["position"]
+        trade_data = outcome["trade_data"]
+        ticker = record["ticker"]
+        profit_net = trade_data["profit_net"] if trade_data else 0.0
+        if outcome["removed"]:
+            self._cancel_stop(client, ticker, position)
+            board.remove_position(
+                ticker,
+                exit_comment=record.get("exit_comment"),
+                profit_net=profit_net,
+            )
+            risk_engine.on_close(ticker, profit_net)
+            logging.info(f"Closed position {ticker} by order {order_id}")
+        elif position is not None:
+            if trade_data is not None:
+                # Частичное закрытие: фиксируем результат и пересчитываем остаток
+                risk_engine.on_close(ticker, profit_net)
+                risk_engine.on_open(ticker, position)
+                board.update_position(ticker, position, event="position_reduced")
+            if resize_stop and trade_data is not None:
+                self._resize_stop(client, ticker)
+
+        unfilled = (record["lots_requested"] or 0) - record["applied_lots"]
+        if record["kind"] == "close" and outcome["status"] in FAILED_STATUSES:
+            logging.error(
+                f"Close order {order_id} for {ticker} ended with status "
+                f"{outcome['status']}, executed {record['applied_lots']} lots"
+            )
+            notify_error(
+                ticker,
+                "N/A",
+                "CloseOrderError",
+                f"Close order {order_id} executed {record['applied_lots']} of "
+                f"{record['lots_requested']} lots. Check Tinkoff terminal.",
+            )
+        elif record["kind"] == "open" and unfilled > 0:
+            logging.error(
+                f"Open order {order_id} for {ticker} ended with status "
+                f"{outcome['status']}, executed {record['applied_lots']} of "
+                f"{record['lots_requested']} lots"
+            )
+            if not record["applied_lots"]:
+                notify_error(
+                    ticker,
+                    "N/A",
+                    "OpenOrderError",
+                    f"Open order {order_id} not executed. Check Tinkoff terminal.",
+                )
+
+    def _cancel_stop(self, client, ticker, position):
+        stop_order_id = position.get("stop_order_id") if position else None
+        if not stop_order_id:
+            return True
+        try:
+            client.stop_orders.cancel_stop_order(
+                account_id=self.get_account_id(), stop_order_id=stop_order_id
+            )
+            return True
+        except Exception as e:
+            # Стоп мог уже сработать или быть отменён
+            logging.error(
+                f"Failed to cancel stop {stop_order_id} for {ticker}: {str(e)}"
+            )
+            return False
+
+    def _resize_stop(self, client, ticker):
+        """
+        Ставит стоп-лосс на фактически удерживаемое количество лотов: переставляет
+        прежний или ставит первый, если до сих пор ничего не было исполнено.
+        Позиция, которую не удалось защитить, закрывается.
+        """
+        with state.lock(f"ticker:{ticker}"):
+            position = state.get_positions().get(ticker)
+            if (
+                position is None
+                or position.get("stop_loss_price") is None
+                or position["quantity"] <= 0
+            ):
+                return
+            if not self._cancel_stop(client, ticker, position):
+                # Стоп уже сработал — закрытием занимается веб-хук
+                return
+            stop_order_id = place_stop_loss(
+                client,
+                self.get_account_id(),
+                position["instrument_uid"],
+                position["quantity"],
+                position["stop_loss_price"],
+                position["direction"],
+            )
+            position["stop_order_id"] = stop_order_id
+            state.put_position(ticker, position)
+            if stop_order_id is None:
+                logging.error(f"Failed to resize stop for {ticker}, closing position")
+                try:
+                    close_order_id = self.flatten(client, ticker, "StopLossFailed")
+                except Exception as e:
+                    close_order_id = None
+                    logging.error(f"Failed to close unprotected {ticker}: {str(e)}")
+                notify_error(
+                    ticker,
+                    "N/A",
+                    "StopOrderError",
+                    f"Stop-loss not placed for {ticker}, position closed by order "
+                    f"{close_order_id}. Check Tinkoff terminal.",
+                )
+                return
+        board.update_position(ticker, position, event="stop_moved")
+        logging.info(f"Resized stop for {ticker} to {position['quantity']} lots")
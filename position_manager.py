@@ -0,0 +1,388 @@
+import json
+import os
+import logging
+import threading
+import time
+import uuid
+from tinkoff.invest import LastPriceInstrument, OrderDirection, OrderType
+from notifier import notify_error
+from stop_order_manager import place_stop_loss
+from state_backend import state
+from trade_history import history
+from status_board import board
+from tick_math import quotation_to_nano, nano_to_float, price_to_nano
+
+POSITION_MANAGER_CONFIG_FILE = os.path.join(
+    os.path.dirname(__file__), "position_manager_config.json"
+)
+# Интервал сверки сопровождаемых позиций с хранилищем, секунды
+SYNC_INTERVAL = 5
+
+# Правила по умолчанию и по тикерам; trail_ticks = 0 и пустые take_profits — без сопровождения
+DEFAULT_POSITION_MANAGER_CONFIG = {
+    "default": {
+        # Расстояние трейлинг-стопа от лучшей цены, в шагах цены
+        "trail_ticks": 0,
+        # Минимальный сдвиг стопа, при котором он переставляется у брокера
+        "step_ticks": 5,
+        # Частичные тейки: [{"ticks": 100, "fraction": 0.5}, ...] от цены входа
+        "take_profits": [],
+    },
+    "tickers": {},
+    # Интервал пакетной отправки изменений брокеру, секунды
+    "debounce": 2.0,
+}
+
+
+def load_position_manager_config(file_path=POSITION_MANAGER_CONFIG_FILE):
+    """
+    Загружает правила сопровождения позиций из JSON-файла поверх значений по умолчанию.
+
+    Returns:
+        dict: Правила сопровождения.
+    """
+    config = json.loads(json.dumps(DEFAULT_POSITION_MANAGER_CONFIG))
+    try:
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            config["default"].update(loaded.get("default", {}))
+            config["tickers"].update(loaded.get("tickers", {}))
+            config["debounce"] = loaded.get("debounce", config["debounce"])
+            logging.info(f"Loaded position manager config from {file_path}: {config}")
+    except Exception as e:
+        logging.error(
+            f"Error loading position manager config from {file_path}: {str(e)}"
+        )
+    return config
+
+
+class PositionManager:
+    """
+    Трейлинг-стопы и частичные тейк-профиты для всех открытых позиций.
+
+    Один поток читает общий стрим последних цен, второй раз в debounce секунд
+    отправляет брокеру накопленные изменения. Стоп переставляется только при
+    сдвиге не меньше step_ticks, поэтому число вызовов API не зависит от частоты цен.
+
+    Работает в одном процессе из воркеров (ведущем); позиции, открытые и
+    закрытые другими воркерами, подхватываются сверкой с хранилищем.
+    """
+
+    def __init__(
+        self, token, account_id_getter, client_factory, order_tracker, config=None
+    ):
+        self.token = token
+        self.get_account_id = account_id_getter
+        self.client_factory = client_factory
+        self.order_tracker = order_tracker
+        self.config = config if config is not None else load_position_manager_config()
+        self._lock = threading.Lock()
+        self._tracked = {}
+        self._by_figi = {}
+        self._pending_stops = {}
+        self._pending_takes = []
+        self._stream = None
+        self._running = False
+        self._tick_lookup = None
+        self._synced_at = 0.0
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def rules_for(self, ticker):
+        rules = dict(self.config["default"])
+        rules.update(self.config["tickers"].get(ticker, {}))
+        return rules
+
+    def _is_active(self, rules):
+        return rules["trail_ticks"] > 0 or bool(rules["take_profits"])
+
+    @property
+    def enabled(self):
+        return self._is_active(self.config["default"]) or any(
+            self._is_active(self.rules_for(ticker)) for ticker in self.config["tickers"]
+        )
+
+    def track(self, ticker, position, tick):
+        """
+        Ставит позицию на сопровождение.
+
+        Args:
+            ticker: Тикер инструмента.
+            position: Запись позиции из хранилища.
+            tick: Шаг цены в нано-единицах.
+        """
+        rules = self.rules_for(ticker)
+        if not self._running or not self._is_active(rules) or tick is None:
+            return
+        entry_nano = position.get("avg_price_nano") or price_to_nano(
+            position["signal_price"]
+        )
+        stop = position.get("stop_loss_price")
+        with self._lock:
+            self._tracked[ticker] = {
+                "figi": position["figi"],
+                "direction": position["direction"],
+                "entry_nano": entry_nano,
+                "best_nano": entry_nano,
+                "stop_nano": price_to_nano(stop) if stop is not None else None,
+                "tick": tick,
+                "rules": rules,
+                "takes_done": set(),
+            }
+            self._by_figi[position["figi"]] = ticker
+        if self._stream is not None:
+            self._stream.last_price.subscribe(
+                [LastPriceInstrument(figi=position["figi"])]
+            )
+        logging.info(f"Tracking position {ticker} with rules {rules}")
+
+    def untrack(self, ticker):
+        with self._lock:
+            tracked = self._tracked.pop(ticker, None)
+            if tracked is None:
+                return
+            self._by_figi.pop(tracked["figi"], None)
+            self._pending_stops.pop(ticker, None)
+            self._pending_takes = [t for t in self._pending_takes if t[0] != ticker]
+        if self._stream is not None:
+            self._stream.last_price.unsubscribe(
+                [LastPriceInstrument(figi=tracked["figi"])]
+            )
+
+    def on_price(self, figi, price_nano):
+        """
+        Обрабатывает новую цену: O(1) на позицию, без обращений к брокеру.
+        """
+        with self._lock:
+            ticker = self._by_figi.get(figi)
+            if ticker is None:
+                return
+            tracked = self._tracked[ticker]
+            rules = tracked["rules"]
+            tick = tracked["tick"]
+            sign = 1 if tracked["direction"] == "buy" else -1
+
+            if (price_nano - tracked["best_nano"]) * sign > 0:
+                tracked["best_nano"] = price_nano
+            if rules["trail_ticks"] > 0:
+                desired = tracked["best_nano"] - sign * rules["trail_ticks"] * tick
+                current = tracked["stop_nano"]
+                if (
+                    current is None
+                    or (desired - current) * sign >= rules["step_ticks"] * tick
+                ):
+                    tracked["stop_nano"] = desired
+                    self._pending_stops[ticker] = desired
+
+            for index, level in enumerate(rules["take_profits"]):
+                if index in tracked["takes_done"]:
+                    continue
+                target = tracked["entry_nano"] + sign * level["ticks"] * tick
+                if (price_nano - target) * sign >= 0:
+                    tracked["takes_done"].add(index)
+                    self._pending_takes.append((ticker, level["fraction"], price_nano))
+
+    def start(self, positions, tick_lookup):
+        """
+        Ставит на сопровождение открытые позиции и запускает потоки стрима и отправки.
+
+        Args:
+            positions: Словарь открытых позиций.
+            tick_lookup: Функция figi -> шаг цены в нано-единицах.
+        """
+        self._tick_lookup = tick_lookup
+        self._stopping.clear()
+        self._running = True
+        self.sync(positions)
+        for target, name in (
+            (self._run_feed, "position-feed"),
+            (self._run_flusher, "position-flusher"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def sync(self, positions):
+        """
+        Сверяет сопровождаемые позиции с хранилищем: ставит новые, снимает закрытые.
+        """
+        self._synced_at = time.monotonic()
+        with self._lock:
+            tracked = set(self._tracked)
+        for ticker, position in positions.items():
+            # Резерв алгоритма заменит позиция, она встанет на сопровождение сама
+            if ticker not in tracked and not position.get("pending_parent_id"):
+                self.track(ticker, position, self._tick_lookup(position["figi"]))
+        for ticker in tracked - set(positions):
+            self.untrack(ticker)
+
+    def pending(self):
+        """
+        Возвращает число позиций на сопровождении и изменений, ждущих отправки брокеру.
+        """
+        return {
+            "tracked": len(self._tracked),
+            "stops": len(self._pending_stops),
+            "takes": len(self._pending_takes),
+        }
+
+    def stop(self):
+        self._running = False
+        self._stopping.set()
+        if self._stream is not None:
+            self._stream.stop()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        with self._lock:
+            self._tracked.clear()
+            self._by_figi.clear()
+            self._pending_stops.clear()
+            self._pending_takes = []
+
+    def _run_feed(self):
+        while not self._stopping.is_set():
+            try:
+                with self.client_factory(self.token) as client:
+                    self._stream = client.create_market_data_stream()
+                    with self._lock:
+                        figis = list(self._by_figi)
+                    if figis:
+                        self._stream.last_price.subscribe(
+                            [LastPriceInstrument(figi=figi) for figi in figis]
+                        )
+                    for marketdata in self._stream:
+                        if self._stopping.is_set():
+                            break
+                        if marketdata.last_price:
+                            self.on_price(
+                                marketdata.last_price.figi,
+                                quotation_to_nano(marketdata.last_price.price),
+                            )
+            except Exception as e:
+                logging.error(f"Market data stream failed: {str(e)}")
+            finally:
+                self._stream = None
+            self._stopping.wait(5)
+
+    def _run_flusher(self):
+        while not self._stopping.wait(self.config["debounce"]):
+            if time.monotonic() - self._synced_at >= SYNC_INTERVAL:
+                try:
+                    self.sync(state.get_positions())
+                except Exception as e:
+                    logging.error(f"Failed to sync tracked positions: {str(e)}")
+            with self._lock:
+                stops, self._pending_stops = self._pending_stops, {}
+                takes, self._pending_takes = self._pending_takes, []
+            if not stops and not takes:
+                continue
+            try:
+                with self.client_factory(self.token) as client:
+                    for ticker, fraction, price_nano in takes:
+                        self._take_profit(client, ticker, fraction, price_nano)
+                    for ticker, stop_nano in stops.items():
+                        self._replace_stop(client, ticker, stop_nano)
+            except Exception as e:
+                logging.error(f"Failed to flush position updates: {str(e)}")
+
+    def _replace_stop(self, client, ticker, stop_nano, quantity=None):
+        account_id = self.get_account_id()
+        with state.lock(f"ticker:{ticker}"):
+            position = state.get_positions().get(ticker)
+            if position is None:
+                self.untrack(ticker)
+                return
+            if quantity is None:
+                quantity = position["quantity"]
+            if quantity <= 0:
+                # Позиция уже закрыта полностью — её стоп снимает закрытие
+                logging.info(f"Position {ticker} has no lots, stop is not moved")
+                return
+            old_stop_id = position.get("stop_order_id")
+            if old_stop_id:
+                try:
+                    client.stop_orders.cancel_stop_order(
+                        account_id=account_id, stop_order_id=old_stop_id
+                    )
+                except Exception as e:
+                    # Стоп уже сработал или отменён — закрытием занимается веб-хук
+                    logging.error(
+                        f"Failed to cancel stop {old_stop_id} for {ticker}: {str(e)}"
+                    )
+                    return
+            stop_order_id = place_stop_loss(
+                client,
+                account_id,
+                position["instrument_uid"],
+                quantity,
+                nano_to_float(stop_nano),
+                position["direction"],
+                stop_price_nano=stop_nano,
+            )
+            if stop_order_id is None:
+                notify_error(
+                    ticker, "N/A", "StopOrderError", f"Failed to move stop for {ticker}"
+                )
+            position["stop_order_id"] = stop_order_id
+            position["stop_loss_price"] = nano_to_float(stop_nano)
+            state.put_position(ticker, position)
+        board.update_position(ticker, position, event="stop_moved")
+        logging.info(f"Moved stop for {ticker} to {nano_to_float(stop_nano)}")
+
+    def _take_profit(self, client, ticker, fraction, price_nano):
+        account_id = self.get_account_id()
+        with state.lock(f"ticker:{ticker}"):
+            position = state.get_positions().get(ticker)
+            if position is None:
+                self.untrack(ticker)
+                return
+            # Лоты в незавершённых закрытиях уже проданы или продаются
+            quantity = position["quantity"] - self.order_tracker.closing_lots(ticker)
+            lots = int(quantity * fraction)
+            if lots <= 0 or lots >= quantity:
+                return
+            client_order_id = str(uuid.uuid4())
+            response = client.orders.post_order(
+                instrument_id=position["instrument_uid"],
+                quantity=lots,
+                direction=(
+                    OrderDirection.ORDER_DIRECTION_SELL
+                    if position["direction"] == "buy"
+                    else OrderDirection.ORDER_DIRECTION_BUY
+                ),
+                account_id=account_id,
+                order_type=OrderType.ORDER_TYPE_MARKET,
+                order_id=client_order_id,
+            )
+            # Позицию, журнал, риск и стоп на остаток ведёт трекер по фактическим
+            # исполнениям заявки
+            self.order_tracker.track_close(
+                ticker,
+                position["exchange_order_id"],
+                response.order_id,
+                "PartialTake",
+                client_order_id,
+                nano_to_float(price_nano),
+                lots_requested=lots,
+                lot=position.get("lot", 1),
+            )
+        history.record_order(
+            {
+                "exchange_order_id": response.order_id,
+                "client_order_id": client_order_id,
+                "ticker": ticker,
+                "figi": position["figi"],
+                "instrument_uid": position["instrument_uid"],
+                "direction": "sell" if position["direction"] == "buy" else "buy",
+                "quantity": lots,
+                "order_type": "market",
+                "signal_price": nano_to_float(price_nano),
+                "exitComment": "PartialTake",
+            }
+        )
+        logging.info(
+            f"Partial take for {ticker}: {lots} lots at ~{nano_to_float(price_nano)}, "
+            f"order_id={response.order_id}"
+        )
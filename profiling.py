@@ -0,0 +1,245 @@
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILES_DIR = os.path.join(os.path.dirname(__file__), "profiles")
+# Интервал сэмплирования стеков, секунды
+SAMPLE_INTERVAL = 0.01
+# Порог, выше которого профиль запроса сохраняется, миллисекунды
+SLOW_REQUEST_MS = 500
+# Сколько последних медленных запросов держать в памяти
+MAX_SLOW_REQUESTS = 20
+# Модули долгоживущих потоков для отчёта tracemalloc
+TRACKED_MODULES = (
+    "order_monitor.py",
+    "position_manager.py",
+    "trade_history.py",
+    "execution.py",
+    "sizing.py",
+    "trading_calendar.py",
+    "status_board.py",
+)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: раз в interval снимает стеки всех потоков через
+    sys._current_frames и считает одинаковые стеки. Результат — строки
+    "поток;функция;...;функция count", формат folded для flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self.sample_count = 0
+        self.started_at = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.samples = {}
+        self.sample_count = 0
+        self.started_at = time.time()
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def folded(self):
+        # Копия словаря не прерывается потоком сэмплирования
+        samples = dict(self.samples)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(samples.items()))
+
+
+class Profiler:
+    """
+    Профилирование в работающем процессе: сэмплирующий профайлер, cProfile
+    медленных запросов и снимки tracemalloc. Все части выключены по умолчанию
+    и включаются через /admin/profiling или сигналы.
+    """
+
+    def __init__(self, profiles_dir=PROFILES_DIR):
+        self.profiles_dir = profiles_dir
+        self.sampler = SamplingProfiler()
+        self.request_profiling = False
+        self.slow_request_ms = SLOW_REQUEST_MS
+        self.slow_requests = ()
+        # В Python 3.12+ одновременно может работать только один cProfile
+        self._request_lock = threading.Lock()
+        self._last_snapshot = None
+        self._seq = itertools.count(1)
+
+    def status(self):
+        return {
+            "sampler": self.sampler.running,
+            "sampler_started_at": self.sampler.started_at,
+            "samples": self.sampler.sample_count,
+            "request_profiling": self.request_profiling,
+            "slow_request_ms": self.slow_request_ms,
+            "slow_requests": list(self.slow_requests),
+            "tracemalloc": tracemalloc.is_tracing(),
+        }
+
+    def configure(self, sampler=None, requests=None, slow_request_ms=None, memory=None):
+        """
+        Включает или выключает части профилирования; None — без изменений.
+        """
+        if sampler is True:
+            self.sampler.start()
+            logging.info("Sampling profiler started")
+        elif sampler is False and self.sampler.running:
+            self.sampler.stop()
+            logging.info(f"Sampling profiler stopped, dumped to {self.dump_stacks()}")
+        if requests is not None:
+            self.request_profiling = bool(requests)
+        if slow_request_ms is not None:
+            self.slow_request_ms = float(slow_request_ms)
+        if memory is True and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._last_snapshot = None
+            logging.info("tracemalloc started")
+        elif memory is False and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._last_snapshot = None
+            logging.info("tracemalloc stopped")
+        return self.status()
+
+    def _path(self, name):
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        return os.path.join(
+            self.profiles_dir,
+            f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{next(self._seq)}",
+        )
+
+    def dump_stacks(self):
+        """
+        Записывает накопленные стеки в profiles/stacks-*.folded.
+
+        Returns:
+            str: Путь к файлу.
+        """
+        path = self._path("stacks") + ".folded"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.sampler.folded())
+        return path
+
+    # Профилирование запросов
+
+    def begin_request(self):
+        """
+        Начинает cProfile запроса, если профилирование включено и cProfile свободен.
+
+        Returns:
+            tuple: (profile, started) — profile равен None без профилирования.
+        """
+        started = time.perf_counter()
+        if not self.request_profiling or not self._request_lock.acquire(False):
+            return None, started
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Профилирование уже включено другим инструментом
+            self._request_lock.release()
+            return None, started
+        return profile, started
+
+    def end_request(self, profile, started, label):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if profile is None:
+            return
+        profile.disable()
+        self._request_lock.release()
+        if elapsed_ms < self.slow_request_ms:
+            return
+        path = self._path("request") + ".prof"
+        profile.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(15)
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "request": label,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "profile": path,
+            "top": output.getvalue(),
+        }
+        self.slow_requests = (self.slow_requests + (entry,))[-MAX_SLOW_REQUESTS:]
+        logging.info(f"Slow request {label} took {elapsed_ms:.1f}ms, saved {path}")
+
+    # Память
+
+    def memory_snapshot(self, limit=20):
+        """
+        Снимает tracemalloc и возвращает крупнейшие места выделения в модулях
+        фоновых потоков вместе с приростом от предыдущего снимка.
+        """
+        if not tracemalloc.is_tracing():
+            return {"error": "tracemalloc is not running"}
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, f"*{module}") for module in TRACKED_MODULES]
+        )
+        path = self._path("memory") + ".tracemalloc"
+        snapshot.dump(path)
+        top = [
+            {"location": str(stat.traceback[0]), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+        growth = []
+        if self._last_snapshot is not None:
+            growth = [
+                {
+                    "location": str(stat.traceback[0]),
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in snapshot.compare_to(self._last_snapshot, "lineno")[:limit]
+            ]
+        self._last_snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "traced_current": current,
+            "traced_peak": peak,
+            "top": top,
+            "growth": growth,
+            "snapshot": path,
+        }
+
+
+# Общий для процесса экземпляр
+profiler = Profiler()
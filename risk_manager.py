@@ -0,0 +1,239 @@
+import json
+import os
+import logging
+import threading
+import time
+
+RISK_LIMITS_FILE = os.path.join(os.path.dirname(__file__), "risk_limits.json")
+
+# Лимиты по умолчанию (в валюте счёта); переопределяются файлом risk_limits.json
+DEFAULT_RISK_LIMITS = {
+    "max_gross_exposure": 1_000_000,
+    "max_net_exposure": 1_000_000,
+    "max_sector_exposure": 400_000,
+    "max_currency_exposure": 1_000_000,
+    "max_daily_loss": 30_000,
+    "max_open_risk": 50_000,
+}
+
+
+def load_risk_limits(file_path=RISK_LIMITS_FILE):
+    """
+    Загружает лимиты риска из JSON-файла поверх значений по умолчанию.
+
+    Returns:
+        dict: Лимиты риска.
+    """
+    limits = dict(DEFAULT_RISK_LIMITS)
+    try:
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                limits.update(json.load(f))
+            logging.info(f"Loaded risk limits from {file_path}: {limits}")
+    except Exception as e:
+        logging.error(f"Error loading risk limits from {file_path}: {str(e)}")
+    return limits
+
+
+class RiskEngine:
+    """
+    Предторговый риск-контроль на инкрементальных агрегатах.
+
+    Агрегаты (валовая/чистая экспозиция, экспозиция по секторам и валютам,
+    риск до стопа, реализованный убыток за день) обновляются при открытии и
+    закрытии позиции, поэтому проверка ордера выполняется за O(1).
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else load_risk_limits()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.gross_exposure = 0.0
+        self.net_exposure = 0.0
+        self.sector_exposure = {}
+        self.currency_exposure = {}
+        self.open_risk = 0.0
+        self.daily_pnl = 0.0
+        self.pnl_date = time.strftime("%Y-%m-%d")
+        self._contributions = {}
+
+    def rebuild(self, positions, daily_pnl=None):
+        """
+        Пересчитывает агрегаты по текущим позициям (однократно при старте).
+
+        Args:
+            positions: Словарь текущих позиций.
+            daily_pnl: Реализованный PnL за сегодня из истории сделок; None —
+                оставить накопленный в памяти.
+        """
+        with self._lock:
+            previous_pnl, pnl_date = self.daily_pnl, self.pnl_date
+            self._reset()
+            if daily_pnl is None:
+                self.daily_pnl, self.pnl_date = previous_pnl, pnl_date
+            else:
+                self.daily_pnl = daily_pnl
+            for ticker, position in positions.items():
+                if not position.get("lot"):
+                    logging.error(f"Position {ticker} has no lot size, assuming 1")
+                self._add(ticker, position)
+        logging.info(f"Risk engine rebuilt: {self.snapshot()}")
+
+    def _roll_day(self):
+        today = time.strftime("%Y-%m-%d")
+        if today != self.pnl_date:
+            self.pnl_date = today
+            self.daily_pnl = 0.0
+
+    def _add(self, ticker, position):
+        lot = position.get("lot", 1)
+        quantity = position.get("quantity", 0)
+        price = position.get("avg_price") or position.get("signal_price") or 0
+        stop = position.get("stop_loss_price")
+        notional = price * quantity * lot
+        signed = notional if position.get("direction") == "buy" else -notional
+        risk = abs(price - stop) * quantity * lot if stop is not None else notional
+        sector = position.get("sector", "unknown")
+        currency = position.get("currency", "unknown")
+
+        self.gross_exposure += notional
+        self.net_exposure += signed
+        self.sector_exposure[sector] = self.sector_exposure.get(sector, 0) + notional
+        self.currency_exposure[currency] = (
+            self.currency_exposure.get(currency, 0) + notional
+        )
+        self.open_risk += risk
+        self._contributions[ticker] = (notional, signed, sector, currency, risk)
+
+    def _remove(self, ticker):
+        contribution = self._contributions.pop(ticker, None)
+        if contribution is None:
+            return
+        notional, signed, sector, currency, risk = contribution
+        self.gross_exposure -= notional
+        self.net_exposure -= signed
+        self.sector_exposure[sector] -= notional
+        self.currency_exposure[currency] -= notional
+        self.open_risk -= risk
+
+    def check_order(
+        self,
+        ticker,
+        direction,
+        quantity,
+        lot,
+        signal_price,
+        stop_loss_price,
+        sector="unknown",
+        currency="unknown",
+    ):
+        """
+        Проверяет ордер на открытие против лимитов и при необходимости уменьшает его.
+
+        Args:
+            ticker: Тикер инструмента.
+            direction: Направление ("buy" или "sell").
+            quantity: Запрошенное количество лотов.
+            lot: Размер лота.
+            signal_price: Цена сигнала.
+            stop_loss_price: Цена стоп-лосса или None.
+            sector: Сектор инструмента.
+            currency: Валюта инструмента.
+
+        Returns:
+            tuple: (quantity, reason)
+                - quantity: Допустимое количество лотов (0 — ордер отклонён).
+                - reason: Название ограничившего лимита или None.
+        """
+        lot_notional = signal_price * lot
+        if lot_notional <= 0:
+            return 0, "invalid_price"
+        lot_risk = (
+            abs(signal_price - stop_loss_price) * lot
+            if stop_loss_price is not None
+            else lot_notional
+        )
+        limits = self.limits
+
+        with self._lock:
+            self._roll_day()
+            if -self.daily_pnl >= limits["max_daily_loss"]:
+                return 0, "max_daily_loss"
+
+            if direction == "buy":
+                net_headroom = limits["max_net_exposure"] - self.net_exposure
+            else:
+                net_headroom = limits["max_net_exposure"] + self.net_exposure
+            headrooms = {
+                "max_gross_exposure": (
+                    limits["max_gross_exposure"] - self.gross_exposure,
+                    lot_notional,
+                ),
+                "max_net_exposure": (net_headroom, lot_notional),
+                "max_sector_exposure": (
+                    limits["max_sector_exposure"] - self.sector_exposure.get(sector, 0),
+                    lot_notional,
+                ),
+                "max_currency_exposure": (
+                    limits["max_currency_exposure"]
+                    - self.currency_exposure.get(currency, 0),
+                    lot_notional,
+                ),
+                "max_open_risk": (limits["max_open_risk"] - self.open_risk, lot_risk),
+            }
+        # Неизвестный сектор или валюта — не общая группа: такие инструменты
+        # ограничены только общими лимитами
+        if sector == "unknown":
+            del headrooms["max_sector_exposure"]
+        if currency == "unknown":
+            del headrooms["max_currency_exposure"]
+
+        allowed, reason = quantity, None
+        for name, (headroom, per_lot) in headrooms.items():
+            if per_lot <= 0:
+                continue
+            max_lots = max(int(headroom // per_lot), 0)
+            if max_lots < allowed:
+                allowed, reason = max_lots, name
+        if reason is not None:
+            logging.info(
+                f"Risk check for {ticker}: quantity {quantity} -> {allowed} by {reason}"
+            )
+        return allowed, reason
+
+    def on_open(self, ticker, position):
+        """
+        Учитывает открытую позицию в агрегатах.
+        """
+        with self._lock:
+            self._remove(ticker)
+            self._add(ticker, position)
+
+    def on_close(self, ticker, profit_net=None):
+        """
+        Убирает закрытую позицию из агрегатов и учитывает реализованный PnL.
+        """
+        with self._lock:
+            self._remove(ticker)
+            self._roll_day()
+            if profit_net is not None:
+                self.daily_pnl += profit_net
+
+    def snapshot(self):
+        """
+        Возвращает текущие значения агрегатов.
+        """
+        return {
+            "gross_exposure": self.gross_exposure,
+            "net_exposure": self.net_exposure,
+            "sector_exposure": dict(self.sector_exposure),
+            "currency_exposure": dict(self.currency_exposure),
+            "open_risk": self.open_risk,
+            "daily_pnl": self.daily_pnl,
+        }
+
+
+# Общий экземпляр для веб-хука и мониторов закрытия
+risk_engine = RiskEngine()
@@ -0,0 +1,227 @@
+import glob
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Адаптеры, кроме веб-хука, включаются переменными окружения
+SIGNAL_TCP_HOST = os.environ.get("SIGNAL_TCP_HOST", "127.0.0.1")
+SIGNAL_TCP_PORT = os.environ.get("SIGNAL_TCP_PORT")
+SIGNAL_DIR = os.environ.get("SIGNAL_DIR")
+SIGNAL_FIFO = os.environ.get("SIGNAL_FIFO")
+# Интервал опроса каталога сигналов, секунды
+DIR_POLL_INTERVAL = 0.2
+# Сколько тикеров пакета обрабатывать параллельно
+BATCH_WORKERS = 4
+
+
+def process_batch(signals, handler, max_workers=BATCH_WORKERS):
+    """
+    Обрабатывает пакет сигналов: сигналы одного тикера — по порядку,
+    разные тикеры — параллельно.
+
+    Args:
+        signals: Список сигналов в формате тела веб-хука.
+        handler: Конвейер сигнала, возвращает (result, status).
+
+    Returns:
+        list: (result, status) в порядке входного списка.
+    """
+    results = [None] * len(signals)
+    by_ticker = {}
+    for index, data in enumerate(signals):
+        ticker = data.get("ticker") if isinstance(data, dict) else None
+        by_ticker.setdefault(ticker, []).append(index)
+
+    def run(indexes):
+        for index in indexes:
+            try:
+                results[index] = handler(signals[index])
+            except Exception as e:
+                logging.error(f"Failed to process batch signal {index}: {str(e)}")
+                results[index] = ({"error": str(e)}, 500)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(run, by_ticker.values()))
+    return results
+
+
+def handle_line(line, handler):
+    """
+    Разбирает одну строку источника (JSON-объект или массив сигналов) и
+    передаёт сигналы в конвейер.
+
+    Returns:
+        list: (result, status) по каждому сигналу строки.
+    """
+    line = line.strip()
+    if not line:
+        return []
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        logging.error(f"Invalid signal line: {line!r}: {str(e)}")
+        return [({"error": f"Неверный JSON: {str(e)}"}, 400)]
+    if isinstance(data, list):
+        return process_batch(data, handler)
+    return [handler(data, line.encode("utf-8"))]
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        peer = self.client_address
+        logging.info(f"Signal connection opened from {peer}")
+        for raw in self.rfile:
+            for result, status in handle_line(
+                raw.decode("utf-8", "replace"), self.server.signal_handler
+            ):
+                response = json.dumps(
+                    {"status": status, "result": result}, ensure_ascii=False
+                )
+                self.wfile.write(response.encode("utf-8") + b"\n")
+        logging.info(f"Signal connection closed from {peer}")
+
+
+class LineServer(socketserver.ThreadingTCPServer):
+    """
+    Постоянное TCP-соединение: одна строка JSON — один сигнал (или массив),
+    ответ — строка JSON со статусом на каждый сигнал.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, signal_handler):
+        self.signal_handler = signal_handler
+        super().__init__(address, _LineHandler)
+
+
+class DirectoryWatcher:
+    """
+    Читает файлы *.json из каталога: объект, массив или JSON-строки.
+
+    Обработанный файл переносится в processed/, нечитаемый — в failed/.
+    Стратегия должна записывать файл под другим именем и переименовывать его
+    в *.json, чтобы не прочитать его недописанным.
+    """
+
+    def __init__(self, path, handler, interval=DIR_POLL_INTERVAL):
+        self.path = path
+        self.handler = handler
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        for name in ("processed", "failed"):
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        while not self._stopping.wait(self.interval):
+            for file_path in sorted(glob.glob(os.path.join(self.path, "*.json"))):
+                self._process(file_path)
+
+    def _process(self, file_path):
+        target = "processed"
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            try:
+                lines = [json.dumps(json.loads(content))]
+            except ValueError:
+                lines = content.splitlines()
+            for line in lines:
+                handle_line(line, self.handler)
+        except Exception as e:
+            logging.error(f"Failed to process signal file {file_path}: {str(e)}")
+            target = "failed"
+        try:
+            os.replace(
+                file_path,
+                os.path.join(self.path, target, os.path.basename(file_path)),
+            )
+        except OSError as e:
+            logging.error(f"Failed to move signal file {file_path}: {str(e)}")
+
+    def stop(self):
+        self._stopping.set()
+
+
+class FifoReader:
+    """
+    Читает JSON-строки из именованного канала; создаёт канал, если его нет.
+    """
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self._stopping = threading.Event()
+
+    def run(self):
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+        elif not stat.S_ISFIFO(os.stat(self.path).st_mode):
+            logging.error(f"{self.path} is not a FIFO, signal reader not started")
+            return
+        while not self._stopping.is_set():
+            try:
+                # open блокируется до появления писателя, EOF — когда все писатели закрыли канал
+                with open(self.path, "r", encoding="utf-8") as fifo:
+                    for line in fifo:
+                        handle_line(line, self.handler)
+            except Exception as e:
+                logging.error(f"Signal FIFO {self.path} failed: {str(e)}")
+                self._stopping.wait(1)
+
+    def stop(self):
+        self._stopping.set()
+        # Разблокирует open, если писателей нет
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def start_ingestion(handler):
+    """
+    Запускает адаптеры, заданные переменными окружения.
+
+    Args:
+        handler: Конвейер сигнала process_signal(data, raw=None).
+
+    Returns:
+        list: Запущенные адаптеры (у каждого есть stop или shutdown).
+    """
+    adapters = []
+    if SIGNAL_TCP_PORT:
+        server = LineServer((SIGNAL_TCP_HOST, int(SIGNAL_TCP_PORT)), handler)
+        _start_thread(server.serve_forever, "signal-tcp")
+        logging.info(f"Signal TCP listener on {SIGNAL_TCP_HOST}:{SIGNAL_TCP_PORT}")
+        adapters.append(server)
+    if SIGNAL_DIR:
+        watcher = DirectoryWatcher(SIGNAL_DIR, handler)
+        _start_thread(watcher.run, "signal-dir")
+        logging.info(f"Watching signal directory {SIGNAL_DIR}")
+        adapters.append(watcher)
+    if SIGNAL_FIFO:
+        reader = FifoReader(SIGNAL_FIFO, handler)
+        _start_thread(reader.run, "signal-fifo")
+        logging.info(f"Reading signals from FIFO {SIGNAL_FIFO}")
+        adapters.append(reader)
+    return adapters
+
+
+def stop_ingestion(adapters):
+    for adapter in adapters:
+        if isinstance(adapter, LineServer):
+            adapter.shutdown()
+            adapter.server_close()
+        else:
+            adapter.stop()
+
+
+def _start_thread(target, name):
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,255 @@
+import json
+import os
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from tinkoff.invest import CandleInterval
+from tick_math import NANO, price_to_nano, quotation_to_nano, quantity_for_sum
+
+SIZING_CONFIG_FILE = os.path.join(os.path.dirname(__file__), "sizing_config.json")
+
+# Режимы: notional — на expected_sum из сигнала; risk — риск до стопа;
+# atr — риск до atr_multiple * ATR; equity — доля стоимости портфеля
+DEFAULT_SIZING_CONFIG = {
+    "default": {
+        "mode": "notional",
+        # Риск на сделку в валюте счёта для режимов risk и atr
+        "risk_per_trade": 1000,
+        "atr_period": 14,
+        "atr_multiple": 2.0,
+        # Доля стоимости портфеля на сделку для режима equity
+        "equity_fraction": 0.1,
+        # Не превышать expected_sum из сигнала в режимах risk, atr и equity
+        "cap_to_expected_sum": True,
+    },
+    "tickers": {},
+    # Интервал фонового обновления свечей и портфеля, секунды
+    "refresh_interval": 300,
+}
+
+SIZING_MODES = ("notional", "risk", "atr", "equity")
+
+
+def load_sizing_config(file_path=SIZING_CONFIG_FILE):
+    """
+    Загружает правила расчёта размера позиции из JSON-файла поверх значений по умолчанию.
+
+    Returns:
+        dict: Правила расчёта размера.
+    """
+    config = json.loads(json.dumps(DEFAULT_SIZING_CONFIG))
+    try:
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            config["default"].update(loaded.get("default", {}))
+            config["tickers"].update(loaded.get("tickers", {}))
+            config["refresh_interval"] = loaded.get(
+                "refresh_interval", config["refresh_interval"]
+            )
+            logging.info(f"Loaded sizing config from {file_path}: {config}")
+    except Exception as e:
+        logging.error(f"Error loading sizing config from {file_path}: {str(e)}")
+    return config
+
+
+def average_true_range(candles, period):
+    """
+    Считает ATR по дневным свечам в нано-единицах (простое среднее true range).
+
+    Args:
+        candles: Свечи в порядке времени.
+        period: Число true range в среднем.
+
+    Returns:
+        int: ATR или None, если свечей недостаточно.
+    """
+    ranges = []
+    prev_close = None
+    for candle in candles:
+        high = quotation_to_nano(candle.high)
+        low = quotation_to_nano(candle.low)
+        if prev_close is None:
+            ranges.append(high - low)
+        else:
+            ranges.append(max(high, prev_close) - min(low, prev_close))
+        prev_close = quotation_to_nano(candle.close)
+    if len(ranges) < period:
+        return None
+    return sum(ranges[-period:]) // period
+
+
+class SizingEngine:
+    """
+    Расчёт количества лотов для открытия позиции.
+
+    Расчёт использует только данные в памяти: ATR по инструментам и стоимость
+    портфеля обновляет фоновый поток, поэтому вызов size не делает RPC.
+    Пока данных для режима нет, используется режим notional.
+    """
+
+    def __init__(self, token, account_id_getter, client_factory, config=None):
+        self.token = token
+        self.get_account_id = account_id_getter
+        self.client_factory = client_factory
+        self.config = config if config is not None else load_sizing_config()
+        self._rules = {}
+        self._atr = {}
+        self._atr_periods = {}
+        self._equity_nano = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def rules_for(self, ticker):
+        rules = self._rules.get(ticker)
+        if rules is None:
+            rules = dict(self.config["default"])
+            rules.update(self.config["tickers"].get(ticker, {}))
+            if rules["mode"] not in SIZING_MODES:
+                logging.error(
+                    f"Unknown sizing mode {rules['mode']} for {ticker}, using notional"
+                )
+                rules["mode"] = "notional"
+            self._rules[ticker] = rules
+        return rules
+
+    @property
+    def uses_equity(self):
+        return self.config["default"]["mode"] == "equity" or any(
+            rules.get("mode") == "equity" for rules in self.config["tickers"].values()
+        )
+
+    def watch(self, figi, ticker):
+        """
+        Добавляет инструмент в фоновое обновление ATR, если его режим — atr.
+        """
+        rules = self.rules_for(ticker)
+        if rules["mode"] != "atr":
+            return
+        with self._lock:
+            if figi in self._atr_periods:
+                return
+            self._atr_periods[figi] = rules["atr_period"]
+        self._wakeup.set()
+
+    def snapshot(self):
+        return {
+            "equity": self._equity_nano / NANO if self._equity_nano else None,
+            "atr": {figi: atr / NANO for figi, atr in self._atr.items()},
+        }
+
+    def size(
+        self, ticker, figi, expected_sum, signal_price_nano, stop_loss_price_nano, lot
+    ):
+        """
+        Рассчитывает количество лотов по режиму тикера.
+
+        Args:
+            ticker: Тикер инструмента.
+            figi: FIGI инструмента.
+            expected_sum: Сумма на сделку из сигнала.
+            signal_price_nano: Цена сигнала в нано-единицах.
+            stop_loss_price_nano: Цена стоп-лосса в нано-единицах или None.
+            lot: Размер лота.
+
+        Returns:
+            tuple: (quantity, mode) — количество лотов и фактически применённый режим.
+        """
+        rules = self.rules_for(ticker)
+        mode = rules["mode"]
+        notional = quantity_for_sum(expected_sum, signal_price_nano, lot)
+        if mode == "notional" or lot <= 0:
+            return notional, "notional"
+
+        quantity = None
+        if mode == "risk" and stop_loss_price_nano is not None:
+            distance = abs(signal_price_nano - stop_loss_price_nano)
+            quantity = _lots_for_risk(rules["risk_per_trade"], distance, lot)
+        elif mode == "atr":
+            atr = self._atr.get(figi)
+            if atr is None:
+                self.watch(figi, ticker)
+            else:
+                distance = int(atr * rules["atr_multiple"])
+                quantity = _lots_for_risk(rules["risk_per_trade"], distance, lot)
+        elif mode == "equity" and self._equity_nano is not None:
+            budget = self._equity_nano * rules["equity_fraction"] / NANO
+            quantity = quantity_for_sum(budget, signal_price_nano, lot)
+
+        if quantity is None:
+            logging.info(f"No data for sizing mode {mode} on {ticker}, using notional")
+            return notional, "notional"
+        if rules["cap_to_expected_sum"] and expected_sum:
+            quantity = min(quantity, notional)
+        return quantity, mode
+
+    def start(self):
+        """
+        Запускает фоновое обновление, если хотя бы один режим его требует.
+        """
+        modes = {self.config["default"]["mode"]} | {
+            rules.get("mode") for rules in self.config["tickers"].values()
+        }
+        if not modes & {"atr", "equity"}:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="sizing-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.client_factory(self.token) as client:
+                    self.refresh(client)
+            except Exception as e:
+                logging.error(f"Failed to refresh sizing data: {str(e)}")
+            self._wakeup.wait(self.config["refresh_interval"])
+            self._wakeup.clear()
+
+    def refresh(self, client):
+        """
+        Обновляет стоимость портфеля и ATR отслеживаемых инструментов.
+        """
+        if self.uses_equity:
+            portfolio = client.operations.get_portfolio(
+                account_id=self.get_account_id()
+            )
+            self._equity_nano = quotation_to_nano(portfolio.total_amount_portfolio)
+        with self._lock:
+            periods = dict(self._atr_periods)
+        now = datetime.now(timezone.utc)
+        # Новый словарь подменяется целиком, чтобы чтение в size не видело частичных данных
+        atr_values = dict(self._atr)
+        for figi, period in periods.items():
+            try:
+                candles = client.market_data.get_candles(
+                    figi=figi,
+                    from_=now - timedelta(days=period * 2 + 7),
+                    to=now,
+                    interval=CandleInterval.CANDLE_INTERVAL_DAY,
+                ).candles
+            except Exception as e:
+                logging.error(f"Failed to load candles for {figi}: {str(e)}")
+                continue
+            atr = average_true_range(candles, period)
+            if atr:
+                atr_values[figi] = atr
+            else:
+                logging.error(f"Not enough candles to compute ATR for {figi}")
+        self._atr = atr_values
+
+
+def _lots_for_risk(risk_per_trade, distance_nano, lot):
+    # Количество лотов, при котором движение на distance_nano стоит risk_per_trade
+    if distance_nano <= 0:
+        return None
+    return max(price_to_nano(risk_per_trade) // (distance_nano * lot), 0)
@@ -0,0 +1,682 @@
+import json
+import os
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from utils import (
+    load_positions_from_json,
+    save_positions_to_json,
+    POSITIONS_FILE,
+    TOKENS_FIGI_UID_FILE,
+)
+
+INFLIGHT_FILE = os.path.join(os.path.dirname(__file__), "inflight_orders.json")
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки только внутри процесса
+    fcntl = None
+
+# Выбор хранилища: "json" (по умолчанию, один процесс), "sqlite" или "redis"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "json")
+STATE_DB_FILE = os.environ.get(
+    "STATE_DB_FILE", os.path.join(os.path.dirname(__file__), "state.db")
+)
+REDIS_HOST = os.environ.get("REDIS_HOST", "127.0.0.1")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
+REDIS_PREFIX = os.environ.get("REDIS_PREFIX", "trading")
+LOCKS_DIR = os.path.join(os.path.dirname(__file__), ".locks")
+
+# Время жизни блокировки тикера и ожидание её захвата, секунды
+LOCK_TTL = 60
+LOCK_WAIT = 30
+# Время жизни аренды ведущего процесса, секунды; продлевается каждую треть срока
+LEADER_TTL = 15
+
+
+class LockTimeoutError(Exception):
+    pass
+
+
+class StateBackend:
+    """
+    Общее состояние веб-хука: позиции, дедупликация сигналов, кэш инструментов
+    и блокировки по тикерам. Реализации позволяют запускать несколько воркеров.
+    """
+
+    def get_positions(self):
+        raise NotImplementedError
+
+    def put_position(self, ticker, position):
+        raise NotImplementedError
+
+    def delete_position(self, ticker):
+        raise NotImplementedError
+
+    def mark_signal(self, key, ttl):
+        """
+        Отмечает сигнал как полученный.
+
+        Returns:
+            bool: True, если сигнал новый; False, если это повтор в пределах ttl.
+        """
+        raise NotImplementedError
+
+    def forget_signal(self, key):
+        """
+        Снимает отметку сигнала, чтобы его повтор после отказа был исполнен.
+        """
+        raise NotImplementedError
+
+    def get_instrument(self, figi):
+        raise NotImplementedError
+
+    def put_instrument(self, figi, data):
+        raise NotImplementedError
+
+    def get_inflight(self):
+        """
+        Возвращает незавершённые заявки (открытие и закрытие) по ID биржевой заявки.
+        """
+        raise NotImplementedError
+
+    def put_inflight(self, order_id, record):
+        raise NotImplementedError
+
+    def delete_inflight(self, order_id):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, name, ttl=LOCK_TTL, wait=LOCK_WAIT):
+        raise NotImplementedError
+        yield
+
+    def claim(self, name, owner, ttl):
+        """
+        Захватывает аренду name для owner или продлевает её, не дожидаясь освобождения.
+
+        Returns:
+            bool: True, если аренда принадлежит owner.
+        """
+        raise NotImplementedError
+
+    def release(self, name, owner):
+        raise NotImplementedError
+
+
+class JsonStateBackend(StateBackend):
+    """
+    Хранение в positions.json и tokens_figi_uid.json (прежнее поведение).
+
+    Запись идёт под файловой блокировкой, поэтому безопасна для нескольких
+    процессов на одном хосте.
+    """
+
+    def __init__(
+        self,
+        positions_file=POSITIONS_FILE,
+        instruments_file=TOKENS_FIGI_UID_FILE,
+        inflight_file=INFLIGHT_FILE,
+    ):
+        self.positions_file = positions_file
+        self.instruments_file = instruments_file
+        self.inflight_file = inflight_file
+        self._signals = {}
+        self._signals_lock = threading.Lock()
+        self._thread_locks = {}
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+        os.makedirs(LOCKS_DIR, exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self, name, wait=None):
+        """
+        Блокировка внутри процесса и между процессами (flock).
+
+        Args:
+            name: Имя блокировки.
+            wait: Сколько ждать захвата, секунды; None — без ограничения.
+        """
+        deadline = None if wait is None else time.monotonic() + wait
+        thread_lock = self._thread_locks.setdefault(name, threading.Lock())
+        if not thread_lock.acquire(timeout=-1 if wait is None else wait):
+            raise LockTimeoutError(f"Timeout acquiring lock {name}")
+        try:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(LOCKS_DIR, f"{name}.lock"), "a") as lock_file:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise LockTimeoutError(f"Timeout acquiring lock {name}")
+                        time.sleep(0.05)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            thread_lock.release()
+
+    def get_positions(self):
+        return load_positions_from_json(self.positions_file)
+
+    def put_position(self, ticker, position):
+        with self._file_lock("positions"):
+            positions = load_positions_from_json(self.positions_file)
+            positions[ticker] = position
+            save_positions_to_json(positions, self.positions_file)
+
+    def delete_position(self, ticker):
+        with self._file_lock("positions"):
+            positions = load_positions_from_json(self.positions_file)
+            positions.pop(ticker, None)
+            save_positions_to_json(positions, self.positions_file)
+
+    def mark_signal(self, key, ttl):
+        now = time.time()
+        with self._signals_lock:
+            for expired in [k for k, v in self._signals.items() if v <= now]:
+                del self._signals[expired]
+            if key in self._signals:
+                return False
+            self._signals[key] = now + ttl
+            return True
+
+    def forget_signal(self, key):
+        with self._signals_lock:
+            self._signals.pop(key, None)
+
+    def _load_instruments(self):
+        try:
+            if os.path.exists(self.instruments_file):
+                with open(self.instruments_file, "r", encoding="utf-8") as json_file:
+                    return json.load(json_file)
+        except Exception as e:
+            logging.error(f"Error loading instrument data: {str(e)}")
+        return {}
+
+    def get_instrument(self, figi):
+        return self._load_instruments().get(figi)
+
+    def put_instrument(self, figi, data):
+        with self._file_lock("instruments"):
+            instrument_data = self._load_instruments()
+            instrument_data[figi] = data
+            with open(self.instruments_file, "w", encoding="utf-8") as json_file:
+                json.dump(instrument_data, json_file, ensure_ascii=False, indent=4)
+
+    def get_inflight(self):
+        return load_positions_from_json(self.inflight_file)
+
+    def put_inflight(self, order_id, record):
+        with self._file_lock("inflight"):
+            inflight = load_positions_from_json(self.inflight_file)
+            inflight[order_id] = record
+            save_positions_to_json(inflight, self.inflight_file)
+
+    def delete_inflight(self, order_id):
+        with self._file_lock("inflight"):
+            inflight = load_positions_from_json(self.inflight_file)
+            inflight.pop(order_id, None)
+            save_positions_to_json(inflight, self.inflight_file)
+
+    @contextmanager
+    def lock(self, name, ttl=LOCK_TTL, wait=LOCK_WAIT):
+        # ttl не нужен: flock снимается системой, если процесс завершился
+        with self._file_lock(name.replace(":", "_"), wait):
+            yield
+
+    def claim(self, name, owner, ttl):
+        # Аренда — удерживаемый flock: снимается системой вместе с процессом
+        with self._leases_lock:
+            held = self._leases.get(name)
+            if held is not None:
+                return held[0] == owner
+            lease_file = open(os.path.join(LOCKS_DIR, f"{name}.lease"), "a")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lease_file.close()
+                    return False
+            self._leases[name] = (owner, lease_file)
+            return True
+
+    def release(self, name, owner):
+        with self._leases_lock:
+            held = self._leases.get(name)
+            if held is None or held[0] != owner:
+                return
+            del self._leases[name]
+        # Закрытие файла снимает flock
+        held[1].close()
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    Хранение в SQLite в режиме WAL: несколько процессов на одном хосте.
+    """
+
+    def __init__(self, db_file=STATE_DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS positions (ticker TEXT PRIMARY KEY, data TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS signals (key TEXT PRIMARY KEY, expires REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS instruments (figi TEXT PRIMARY KEY, data TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS inflight (order_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+                """
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_positions(self):
+        rows = self._connect().execute("SELECT ticker, data FROM positions")
+        return {ticker: json.loads(data) for ticker, data in rows}
+
+    def put_position(self, ticker, position):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO positions (ticker, data) VALUES (?, ?)",
+                (ticker, json.dumps(position, ensure_ascii=False)),
+            )
+
+    def delete_position(self, ticker):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM positions WHERE ticker = ?", (ticker,))
+
+    def mark_signal(self, key, ttl):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM signals WHERE expires <= ?", (now,))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO signals (key, expires) VALUES (?, ?)",
+                (key, now + ttl),
+            )
+            return cursor.rowcount == 1
+
+    def forget_signal(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM signals WHERE key = ?", (key,))
+
+    def get_instrument(self, figi):
+        row = (
+            self._connect()
+            .execute("SELECT data FROM instruments WHERE figi = ?", (figi,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def put_instrument(self, figi, data):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO instruments (figi, data) VALUES (?, ?)",
+                (figi, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def get_inflight(self):
+        rows = self._connect().execute("SELECT order_id, data FROM inflight")
+        return {order_id: json.loads(data) for order_id, data in rows}
+
+    def put_inflight(self, order_id, record):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO inflight (order_id, data) VALUES (?, ?)",
+                (order_id, json.dumps(record, ensure_ascii=False)),
+            )
+
+    def delete_inflight(self, order_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM inflight WHERE order_id = ?", (order_id,))
+
+    def _try_lock(self, name, owner, ttl):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM locks WHERE name = ? AND expires <= ?", (name, now)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO locks (name, owner, expires) VALUES (?, ?, ?)",
+                (name, owner, now + ttl),
+            )
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def lock(self, name, ttl=LOCK_TTL, wait=LOCK_WAIT):
+        owner = str(uuid.uuid4())
+        deadline = time.monotonic() + wait
+        while not self._try_lock(name, owner, ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeoutError(f"Timeout acquiring lock {name}")
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            self.release(name, owner)
+
+    def claim(self, name, owner, ttl):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM locks WHERE name = ? AND expires <= ?", (name, now)
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO locks (name, owner, expires) VALUES (?, ?, ?)",
+                (name, owner, now + ttl),
+            )
+            cursor = conn.execute(
+                "UPDATE locks SET expires = ? WHERE name = ? AND owner = ?",
+                (now + ttl, name, owner),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name, owner):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+
+class RespConnection:
+    """
+    Минимальный клиент протокола Redis (RESP2) поверх сокета.
+
+    Достаточен для Redis, KeyDB, Dragonfly и локальных заглушек, понимающих RESP.
+    """
+
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT, timeout=5):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def _ensure(self):
+        if self._sock is None:
+            self._sock = socket.create_connection(self.address, timeout=self.timeout)
+            self._reader = self._sock.makefile("rb")
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+
+    def execute(self, *args):
+        payload = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            payload.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        with self._lock:
+            try:
+                self._ensure()
+                self._sock.sendall(b"".join(payload))
+                return self._read()
+            except (OSError, ConnectionError):
+                self.close()
+                raise
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RuntimeError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+
+# Снятие блокировки только её владельцем
+_UNLOCK_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+# Продление блокировки только её владельцем
+_RENEW_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+)
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Хранение в Redis: несколько хостов, распределённые блокировки по тикерам.
+    """
+
+    def __init__(self, connection=None, prefix=REDIS_PREFIX):
+        self.conn = connection or RespConnection()
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def get_positions(self):
+        flat = self.conn.execute("HGETALL", self._key("positions")) or []
+        return {flat[i]: json.loads(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+    def put_position(self, ticker, position):
+        self.conn.execute(
+            "HSET",
+            self._key("positions"),
+            ticker,
+            json.dumps(position, ensure_ascii=False),
+        )
+
+    def delete_position(self, ticker):
+        self.conn.execute("HDEL", self._key("positions"), ticker)
+
+    def mark_signal(self, key, ttl):
+        reply = self.conn.execute(
+            "SET", self._key("signal", key), 1, "NX", "PX", int(ttl * 1000)
+        )
+        return reply == "OK"
+
+    def forget_signal(self, key):
+        self.conn.execute("DEL", self._key("signal", key))
+
+    def get_instrument(self, figi):
+        data = self.conn.execute("HGET", self._key("instruments"), figi)
+        return json.loads(data) if data else None
+
+    def put_instrument(self, figi, data):
+        self.conn.execute(
+            "HSET", self._key("instruments"), figi, json.dumps(data, ensure_ascii=False)
+        )
+
+    def get_inflight(self):
+        flat = self.conn.execute("HGETALL", self._key("inflight")) or []
+        return {flat[i]: json.loads(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+    def put_inflight(self, order_id, record):
+        self.conn.execute(
+            "HSET",
+            self._key("inflight"),
+            order_id,
+            json.dumps(record, ensure_ascii=False),
+        )
+
+    def delete_inflight(self, order_id):
+        self.conn.execute("HDEL", self._key("inflight"), order_id)
+
+    def _unlock(self, key, owner):
+        try:
+            self.conn.execute("EVAL", _UNLOCK_SCRIPT, 1, key, owner)
+        except RuntimeError:
+            # Сервер без Lua: неатомарная проверка владельца
+            if self.conn.execute("GET", key) == owner:
+                self.conn.execute("DEL", key)
+
+    @contextmanager
+    def lock(self, name, ttl=LOCK_TTL, wait=LOCK_WAIT):
+        key = self._key("lock", name)
+        owner = str(uuid.uuid4())
+        deadline = time.monotonic() + wait
+        while self.conn.execute("SET", key, owner, "NX", "PX", int(ttl * 1000)) != "OK":
+            if time.monotonic() >= deadline:
+                raise LockTimeoutError(f"Timeout acquiring lock {name}")
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            self._unlock(key, owner)
+
+    def claim(self, name, owner, ttl):
+        key = self._key("lock", name)
+        ttl_ms = int(ttl * 1000)
+        if self.conn.execute("SET", key, owner, "NX", "PX", ttl_ms) == "OK":
+            return True
+        try:
+            return self.conn.execute("EVAL", _RENEW_SCRIPT, 1, key, owner, ttl_ms) == 1
+        except RuntimeError:
+            # Сервер без Lua: неатомарная проверка владельца
+            if self.conn.execute("GET", key) != owner:
+                return False
+            return self.conn.execute("PEXPIRE", key, ttl_ms) == 1
+
+    def release(self, name, owner):
+        self._unlock(self._key("lock", name), owner)
+
+
+class LeaderLease:
+    """
+    Выбирает среди воркеров один процесс для фоновых задач, которые нельзя
+    запускать в каждом, например сопровождение позиций.
+
+    Аренда продлевается каждую треть ttl. Если ведущий процесс завершился или
+    потерял связь с хранилищем, через ttl аренду захватывает другой воркер.
+
+    Args:
+        backend: Хранилище состояния.
+        name: Имя аренды.
+        on_acquired: Вызывается без аргументов, когда процесс стал ведущим.
+        on_lost: Вызывается, когда процесс перестал быть ведущим.
+        ttl: Время жизни аренды, секунды.
+    """
+
+    def __init__(self, backend, name, on_acquired, on_lost, ttl=LEADER_TTL):
+        self.backend = backend
+        self.name = name
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4()}"
+        self.held = False
+        self._renewed_at = 0.0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # Первая попытка сразу: единственный процесс запускает задачи при старте
+        self._renew()
+        self._thread = threading.Thread(
+            target=self._run, name=f"lease-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Останавливает продление и освобождает аренду, если она была захвачена.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.held:
+            self._set_held(False)
+            try:
+                self.backend.release(self.name, self.owner)
+            except Exception as e:
+                logging.error(f"Failed to release lease {self.name}: {str(e)}")
+            logging.info(f"Released lease {self.name}")
+
+    def _run(self):
+        while not self._stopping.wait(self.ttl / 3):
+            self._renew()
+
+    def _renew(self):
+        try:
+            held = self.backend.claim(self.name, self.owner, self.ttl)
+            if held:
+                self._renewed_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Failed to renew lease {self.name}: {str(e)}")
+            # Аренда действует до конца ttl от последнего продления
+            held = self.held and time.monotonic() - self._renewed_at < self.ttl
+        if held and not self.held:
+            logging.info(f"Acquired lease {self.name} as {self.owner}")
+            self._set_held(True)
+        elif self.held and not held:
+            logging.error(f"Lost lease {self.name} held by {self.owner}")
+            self._set_held(False)
+
+    def _set_held(self, held):
+        self.held = held
+        try:
+            (self.on_acquired if held else self.on_lost)()
+        except Exception as e:
+            logging.error(f"Lease {self.name} callback failed: {str(e)}")
+
+
+def create_state_backend(kind=STATE_BACKEND):
+    """
+    Создаёт хранилище состояния по названию.
+
+    Args:
+        kind: "json", "sqlite" или "redis".
+
+    Returns:
+        StateBackend: Хранилище состояния.
+    """
+    if kind == "sqlite":
+        backend = SqliteStateBackend()
+    elif kind == "redis":
+        backend = RedisStateBackend()
+    else:
+        backend = JsonStateBackend()
+    logging.info(f"Using state backend: {type(backend).__name__}")
+    return backend
+
+
+# Общее хранилище процесса
+state = create_state_backend()
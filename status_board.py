@@ -0,0 +1,224 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+# Сколько последних ошибок и событий держать в памяти
+MAX_ERRORS = 100
+MAX_EVENTS = 500
+# Очередь событий одного подписчика; отстающий подписчик отключается
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Интервал комментария-пинга в потоке событий, секунды
+HEARTBEAT_INTERVAL = 15
+
+
+class StatusBoard:
+    """
+    Снимки состояния процесса для админ-API и поток событий для дашбордов.
+
+    Запись копирует словарь и подменяет ссылку (copy-on-write), поэтому
+    чтение не берёт блокировок и не обращается к диску: читатель всегда
+    получает целостный снимок, который больше не изменяется.
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._positions = {}
+        self._orders = {}
+        self._errors = ()
+        self._events = ()
+        self._gauges = {}
+        self._subscribers = ()
+        self.started_at = time.time()
+
+    # Снимки только для чтения
+
+    def positions(self):
+        return self._positions
+
+    def orders(self):
+        return self._orders
+
+    def errors(self):
+        return self._errors
+
+    def queues(self):
+        """
+        Возвращает текущие значения зарегистрированных счётчиков очередей.
+        """
+        result = {}
+        for name, func in self._gauges.items():
+            try:
+                result[name] = func()
+            except Exception as e:
+                result[name] = f"error: {str(e)}"
+        return result
+
+    def events_since(self, last_id):
+        return tuple(event for event in self._events if event["id"] > last_id)
+
+    # Публикация
+
+    def register_gauge(self, name, func):
+        """
+        Регистрирует счётчик очереди. func вызывается на каждом чтении и должен
+        быть дешёвым и не брать блокировок приложения.
+        """
+        with self._write_lock:
+            gauges = dict(self._gauges)
+            gauges[name] = func
+            self._gauges = gauges
+
+    def load_positions(self, positions):
+        with self._write_lock:
+            self._positions = {
+                ticker: dict(position) for ticker, position in positions.items()
+            }
+
+    def update_position(self, ticker, position, event="position_updated"):
+        with self._write_lock:
+            positions = dict(self._positions)
+            positions[ticker] = dict(position)
+            self._positions = positions
+            self._emit(event, {"ticker": ticker, "position": positions[ticker]})
+
+    def remove_position(self, ticker, event="position_closed", **details):
+        with self._write_lock:
+            positions = dict(self._positions)
+            position = positions.pop(ticker, None)
+            self._positions = positions
+            self._emit(event, dict(details, ticker=ticker, position=position))
+
+    def update_order(self, order_id, record, event="order_tracked"):
+        with self._write_lock:
+            orders = dict(self._orders)
+            orders[order_id] = dict(record)
+            self._orders = orders
+            self._emit(event, {"order_id": order_id, "order": orders[order_id]})
+
+    def remove_order(self, order_id, event="order_done", **details):
+        with self._write_lock:
+            orders = dict(self._orders)
+            order = orders.pop(order_id, None)
+            self._orders = orders
+            self._emit(event, dict(details, order_id=order_id, order=order))
+
+    def record_error(self, source, message):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "source": source,
+            "message": message,
+        }
+        with self._write_lock:
+            self._errors = (self._errors + (entry,))[-MAX_ERRORS:]
+            self._emit("log_error", entry)
+
+    # Поток событий
+
+    def _emit(self, event_type, data):
+        # Вызывается под _write_lock, поэтому id идут по порядку
+        event = {
+            "id": next(self._seq),
+            "type": event_type,
+            "time": time.time(),
+            "data": data,
+        }
+        self._events = (self._events + (event,))[-MAX_EVENTS:]
+        dropped = []
+        for subscriber in self._subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                dropped.append(subscriber)
+        if dropped:
+            self._subscribers = tuple(s for s in self._subscribers if s not in dropped)
+            for subscriber in dropped:
+                _close_subscriber(subscriber)
+
+    def subscribe(self):
+        subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._write_lock:
+            self._subscribers = self._subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._write_lock:
+            self._subscribers = tuple(
+                s for s in self._subscribers if s is not subscriber
+            )
+
+    def stream(self, last_id=0):
+        """
+        Генератор Server-Sent Events: сначала события после last_id из буфера,
+        затем новые по мере появления.
+        """
+        subscriber = self.subscribe()
+        sent = last_id
+        try:
+            for event in self.events_since(last_id):
+                sent = event["id"]
+                yield _format_sse(event)
+            while True:
+                try:
+                    event = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                if event["id"] <= sent:
+                    continue
+                sent = event["id"]
+                yield _format_sse(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self):
+        """
+        Завершает потоки событий всех подписчиков.
+        """
+        with self._write_lock:
+            subscribers, self._subscribers = self._subscribers, ()
+        for subscriber in subscribers:
+            _close_subscriber(subscriber)
+
+
+def _close_subscriber(subscriber):
+    # Освобождаем место под маркер завершения, если очередь переполнена
+    while True:
+        try:
+            subscriber.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _format_sse(event):
+    payload = json.dumps(event["data"], ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+class StatusLogHandler(logging.Handler):
+    """
+    Передаёт записи лога уровня ERROR и выше в список последних ошибок.
+    """
+
+    def __init__(self, status_board, level=logging.ERROR):
+        super().__init__(level)
+        self.status_board = status_board
+
+    def emit(self, record):
+        try:
+            self.status_board.record_error(record.module, record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+# Общий для процесса экземпляр
+board = StatusBoard()
@@ -5,11 +5,13 @@ from decimal import Decimal
 from tinkoff.invest import (
     Client,
     StopOrderDirection,
+    StopOrderStatusOption,
     StopOrderType,
     StopOrderExpirationType,
 )
 from tinkoff.invest.utils import decimal_to_quotation
 from notifier import notify_error
+from tick_math import nano_to_float, nano_to_quotation, quotation_to_nano
 
 
 def place_stop_loss(
@@ -19,6 +21,7 @@ def place_stop_loss(
     quantity: int,
     stop_loss_price,
     direction: str,
+    stop_price_nano: int = None,
 ):
     """
     Размещает стоп-лосс для позиции.
@@ -30,13 +33,17 @@ def place_stop_loss(
         quantity: Количество лотов.
         stop_loss_price: Цена стоп-лосса (за акцию).
         direction: Направление позиции ("buy" или "sell").
+        stop_price_nano: Цена стоп-лосса в нано-единицах, если уже округлена.
 
     Returns:
         str: ID стоп-приказа или None при ошибке.
     """
     try:
         # Проверка типа stop_loss_price
-        stop_price = decimal_to_quotation(Decimal(str(stop_loss_price)))
+        if stop_price_nano is not None:
+            stop_price = nano_to_quotation(stop_price_nano)
+        else:
+            stop_price = decimal_to_quotation(Decimal(str(stop_loss_price)))
     except (ValueError, TypeError) as e:
         logging.error(f"Invalid stop_loss_price format: {str(e)}")
         return None
@@ -104,29 +111,12 @@ def handle_stop_close(
         )
         return False, None
 
-    # Проверить, открыта ли еще позиция с несколькими попытками
-    max_attempts = 3
-    attempt = 0
-    is_position_open = True  # По умолчанию предполагаем, что позиция открыта
-    while attempt < max_attempts:
-        try:
-            portfolio = client.operations.get_portfolio(account_id=account_id)
-            is_position_open = any(pos.figi == figi for pos in portfolio.positions)
-            break  # Успешный запрос, выходим из цикла
-        except Exception as e:
-            logging.error(
-                f"Error checking portfolio for {ticker}: {str(e)}, attempt {attempt + 1}"
-            )
-            attempt += 1
-            if attempt < max_attempts:
-                time.sleep(1)
-            continue
-
-    # После всех попыток
-    if attempt >= max_attempts:
-        logging.error(
-            f"Failed to check portfolio for {ticker} after {max_attempts} attempts"
-        )
+    # Проверить, открыта ли еще позиция (повторы с backoff выполняет клиент)
+    try:
+        portfolio = client.operations.get_portfolio(account_id=account_id)
+        is_position_open = any(pos.figi == figi for pos in portfolio.positions)
+    except Exception as e:
+        logging.error(f"Failed to check portfolio for {ticker}: {str(e)}")
         notify_error(
             ticker,
             "N/A",
@@ -145,48 +135,83 @@ def handle_stop_close(
             f"Position {ticker} still open, stop order not executed",
         )
         return False, None
+
+    position = positions[ticker]
+    exit_order_id, exit_price_nano = find_stop_execution(
+        client, account_id, stop_order_id
+    )
+    if exit_price_nano:
+        exit_price = nano_to_float(exit_price_nano)
+        logging.info(
+            f"Stop order {stop_order_id} for {ticker} executed at {exit_price}"
+        )
     else:
-        # Позиция закрыта, предполагаем, что стоп-приказ был исполнен
-        logging.info(f"Position {ticker} closed, assuming stop order was executed")
-        # Формируем trade_data
-        entry_signal_price = positions[ticker].get("signal_price", 0)
-        exit_signal_price = positions[ticker][
-            "stop_loss_price"
-        ]  # Используем stop_loss_price как цену исполнения для стоп-лосса
-        quantity = positions[ticker]["quantity"]
-        lot_size = positions[ticker].get(
-            "lot_size", 1
-        )  # По умолчанию 1, если не указано
-        total_shares = quantity * lot_size
-        entry_broker_fee = positions[ticker].get("entry_broker_fee", 0)
-        exit_broker_fee = (
-            0.0005 * exit_signal_price * total_shares
-        )  # Комиссия 0.05% от размера позиции при закрытии
-        broker_fee = entry_broker_fee + exit_broker_fee
-        profit_gross = (
-            exit_signal_price - entry_signal_price
-        ) * total_shares  # Валовая прибыль
-        profit_net = profit_gross - broker_fee  # Чистая прибыль с вычетом комиссий
-        trade_data = {
-            "ticker": ticker,
-            "figi": positions[ticker]["figi"],
-            "exitComment": exit_comment,
-            "instrument_uid": positions[ticker]["instrument_uid"],
-            "open_datetime": positions[ticker]["open_datetime"],
-            "close_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
-            "quantity": quantity,
-            "entry_signal_price": entry_signal_price,
-            "exit_signal_price": exit_signal_price,
-            "entry_broker_fee": entry_broker_fee,
-            "exit_broker_fee": exit_broker_fee,
-            "broker_fee": broker_fee,
-            "profit_gross": profit_gross,
-            "profit_net": profit_net,
-            "entry_client_order_id": positions[ticker]["client_order_id"],
-            "entry_exchange_order_id": positions[ticker]["exchange_order_id"],
-            "exit_client_order_id": stop_order_id,
-            "exit_exchange_order_id": positions[ticker].get(
-                "exchange_order_id", None
-            ),  # Предполагаем, что это ордер закрытия
-        }
-        return True, trade_data
+        # Цена исполнения неизвестна — считаем по цене стопа
+        exit_price = position["stop_loss_price"]
+        logging.error(
+            f"Position {ticker} closed, execution of stop order {stop_order_id} "
+            f"not found, using stop price {exit_price}"
+        )
+    entry_price = position.get("avg_price") or position.get("signal_price", 0)
+    quantity = position["quantity"]
+    shares = quantity * position.get("lot", 1)
+    # Комиссия 0.05% от оборота на входе и выходе
+    entry_broker_fee = 0.0005 * entry_price * shares
+    exit_broker_fee = 0.0005 * exit_price * shares
+    broker_fee = entry_broker_fee + exit_broker_fee
+    profit_gross = (
+        (exit_price - entry_price) * shares
+        if position["direction"] == "buy"
+        else (entry_price - exit_price) * shares
+    )
+    profit_net = profit_gross - broker_fee
+    trade_data = {
+        "ticker": ticker,
+        "figi": position["figi"],
+        "exitComment": exit_comment,
+        "instrument_uid": position["instrument_uid"],
+        "open_datetime": position["open_datetime"],
+        "close_datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quantity": quantity,
+        "entry_signal_price": position.get("signal_price", 0),
+        "exit_signal_price": position["stop_loss_price"],
+        "entry_broker_fee": entry_broker_fee,
+        "exit_broker_fee": exit_broker_fee,
+        "broker_fee": broker_fee,
+        "profit_gross": profit_gross,
+        "profit_net": profit_net,
+        "entry_client_order_id": position["client_order_id"],
+        "entry_exchange_order_id": position["exchange_order_id"],
+        "exit_client_order_id": stop_order_id,
+        "exit_exchange_order_id": exit_order_id,
+    }
+    return True, trade_data
+
+
+def find_stop_execution(client: Client, account_id: str, stop_order_id: str):
+    """
+    Находит биржевую заявку исполненного стоп-приказа и её среднюю цену.
+
+    Returns:
+        tuple: (exchange_order_id, price_nano) — цена за инструмент в нано-единицах;
+            (None, None), если исполнение не найдено.
+    """
+    try:
+        response = client.stop_orders.get_stop_orders(
+            account_id=account_id,
+            status=StopOrderStatusOption.STOP_ORDER_STATUS_EXECUTED,
+        )
+        for stop_order in response.stop_orders:
+            if stop_order.stop_order_id != stop_order_id:
+                continue
+            if not stop_order.exchange_order_id:
+                return None, None
+            order_state = client.orders.get_order_state(
+                account_id=account_id, order_id=stop_order.exchange_order_id
+            )
+            return stop_order.exchange_order_id, quotation_to_nano(
+                order_state.average_position_price
+            )
+    except Exception as e:
+        logging.error(f"Failed to get execution of stop {stop_order_id}: {str(e)}")
+    return None, None
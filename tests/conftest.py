@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Модули создают базы при импорте: уводим их из рабочего дерева
+_STATE_DIR = tempfile.mkdtemp(prefix="webhook-tests-")
+os.environ.setdefault("STATE_BACKEND", "sqlite")
+os.environ.setdefault("STATE_DB_FILE", os.path.join(_STATE_DIR, "state.db"))
+os.environ.setdefault("HISTORY_DB_FILE", os.path.join(_STATE_DIR, "history.db"))
+
+
+@pytest.fixture(autouse=True)
+def _work_dir(tmp_path, monkeypatch):
+    # trades.csv и подобные файлы пишутся в текущий каталог
+    monkeypatch.chdir(tmp_path)
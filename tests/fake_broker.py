@@ -0,0 +1,234 @@
+"""
+Брокер в памяти процесса для тестов: рыночные заявки, стоп-заявки и портфель
+с ответами в форме Tinkoff Invest API.
+"""
+
+import itertools
+import threading
+from dataclasses import dataclass, field
+from tinkoff.invest import (
+    OrderDirection,
+    OrderExecutionReportStatus,
+    Quotation,
+    StopOrderDirection,
+)
+from tick_math import nano_to_quotation, quotation_to_nano
+
+FILL = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+NEW = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+PARTIALLYFILL = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+CANCELLED = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED
+
+
+@dataclass
+class OrderState:
+    order_id: str
+    instrument_uid: str
+    direction: object
+    lots_requested: int
+    lots_executed: int = 0
+    execution_report_status: int = NEW
+    # Как в OrderState API: средняя цена за инструмент и общая стоимость исполненного
+    average_position_price: Quotation = field(default_factory=Quotation)
+    executed_order_price: Quotation = field(default_factory=Quotation)
+
+
+@dataclass
+class PortfolioPosition:
+    figi: str
+    quantity: Quotation
+    instrument_type: str = "share"
+
+
+@dataclass
+class StopOrder:
+    stop_order_id: str
+    instrument_uid: str
+    lots_requested: int
+    exchange_order_id: str = None
+
+
+@dataclass
+class _Reply:
+    orders: list = None
+    positions: list = None
+    stop_order_id: str = None
+    stop_orders: list = None
+
+
+class FakeBroker:
+    """
+    Рыночная заявка исполняется по цене price_nano: сразу или частями по
+    fill_step лотов на каждый запрос списка активных заявок, если задан fill_step.
+
+    Args:
+        instruments: {instrument_uid: (figi, lot)}.
+        price_nano: Цена исполнения за инструмент в нано-единицах.
+        fill_step: Сколько лотов исполнять за запрос get_orders; None — всё сразу.
+    """
+
+    def __init__(self, instruments, price_nano, fill_step=None):
+        self.instruments = instruments
+        self.price_nano = price_nano
+        self.fill_step = fill_step
+        self.state = {}
+        self.by_client_id = {}
+        self.stops = {}
+        self.executed_stops = {}
+        self.holdings = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.orders = _Orders(self)
+        self.stop_orders = _StopOrders(self)
+        self.operations = _Operations(self)
+
+    def _execute(self, order, lots):
+        figi, lot = self.instruments[order.instrument_uid]
+        lots = min(lots, order.lots_requested - order.lots_executed)
+        if lots <= 0:
+            return
+        executed_nano = (
+            quotation_to_nano(order.executed_order_price) + self.price_nano * lots * lot
+        )
+        order.lots_executed += lots
+        sign = 1 if order.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+        self.holdings[figi] = self.holdings.get(figi, 0) + sign * lots * lot
+        order.executed_order_price = nano_to_quotation(executed_nano)
+        order.average_position_price = nano_to_quotation(
+            executed_nano // (order.lots_executed * lot)
+        )
+        order.execution_report_status = (
+            FILL if order.lots_executed == order.lots_requested else PARTIALLYFILL
+        )
+
+    def shares(self, figi):
+        return self.holdings.get(figi, 0)
+
+    def trigger_stop(self, stop_order_id):
+        """
+        Исполняет стоп-приказ рыночной заявкой по price_nano.
+
+        Returns:
+            str: ID биржевой заявки стопа.
+        """
+        with self._lock:
+            stop = self.stops.pop(stop_order_id)
+            direction = (
+                OrderDirection.ORDER_DIRECTION_SELL
+                if stop["direction"] == StopOrderDirection.STOP_ORDER_DIRECTION_SELL
+                else OrderDirection.ORDER_DIRECTION_BUY
+            )
+            order = OrderState(
+                f"ex-{next(self._ids)}",
+                stop["instrument_id"],
+                direction,
+                stop["quantity"],
+            )
+            self.state[order.order_id] = order
+            self._execute(order, stop["quantity"])
+            self.executed_stops[stop_order_id] = StopOrder(
+                stop_order_id,
+                stop["instrument_id"],
+                stop["quantity"],
+                order.order_id,
+            )
+            return order.order_id
+
+
+class _Orders:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def post_order(
+        self,
+        instrument_id,
+        quantity,
+        direction,
+        account_id,
+        order_type,
+        order_id,
+        price=None,
+    ):
+        broker = self.broker
+        with broker._lock:
+            existing = broker.by_client_id.get(order_id)
+            if existing is not None:
+                order = broker.state[existing]
+            else:
+                order = OrderState(
+                    f"ex-{next(broker._ids)}", instrument_id, direction, quantity
+                )
+                broker.state[order.order_id] = order
+                broker.by_client_id[order_id] = order.order_id
+                if broker.fill_step is None:
+                    broker._execute(order, quantity)
+            # PostOrderResponse отдаёт среднюю цену за инструмент
+            return OrderState(
+                order.order_id,
+                order.instrument_uid,
+                order.direction,
+                order.lots_requested,
+                order.lots_executed,
+                order.execution_report_status,
+                order.average_position_price,
+                order.average_position_price,
+            )
+
+    def get_orders(self, account_id):
+        # Каждый запрос — шаг времени: активные заявки исполняются на fill_step
+        broker = self.broker
+        with broker._lock:
+            active = []
+            for order in broker.state.values():
+                if order.execution_report_status not in (NEW, PARTIALLYFILL):
+                    continue
+                if broker.fill_step:
+                    broker._execute(order, broker.fill_step)
+                if order.execution_report_status in (NEW, PARTIALLYFILL):
+                    active.append(OrderState(**vars(order)))
+        return _Reply(orders=active)
+
+    def get_order_state(self, account_id, order_id):
+        with self.broker._lock:
+            return OrderState(**vars(self.broker.state[order_id]))
+
+    def cancel_order(self, account_id, order_id):
+        with self.broker._lock:
+            order = self.broker.state[order_id]
+            if order.execution_report_status in (NEW, PARTIALLYFILL):
+                order.execution_report_status = CANCELLED
+
+
+class _StopOrders:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def post_stop_order(self, **kwargs):
+        with self.broker._lock:
+            stop_order_id = f"stop-{next(self.broker._ids)}"
+            self.broker.stops[stop_order_id] = kwargs
+        return _Reply(stop_order_id=stop_order_id)
+
+    def cancel_stop_order(self, account_id, stop_order_id):
+        with self.broker._lock:
+            self.broker.stops.pop(stop_order_id)
+
+    def get_stop_orders(self, account_id, status=None):
+        # Достаточно исполненных стопов: их ищет закрытие по стоп-лоссу
+        with self.broker._lock:
+            return _Reply(stop_orders=list(self.broker.executed_stops.values()))
+
+
+class _Operations:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def get_portfolio(self, account_id):
+        with self.broker._lock:
+            positions = [
+                PortfolioPosition(figi, Quotation(units=shares, nano=0))
+                for figi, shares in self.broker.holdings.items()
+                # Закрытые позиции портфель не возвращает
+                if shares
+            ]
+        return _Reply(positions=positions)
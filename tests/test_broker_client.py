@@ -0,0 +1,37 @@
+import time
+from broker_client import QUOTA_RESERVE, _Quota
+
+
+def test_remaining_without_reset_is_ignored():
+    quota = _Quota(100)
+    quota.update(0, None)
+    quota.acquire()
+    assert quota.remaining is None
+    assert quota.used == 1
+
+
+def test_low_remaining_waits_for_reset():
+    quota = _Quota(100)
+    quota.update(QUOTA_RESERVE, 0.1)
+    started = time.monotonic()
+    quota.acquire()
+    assert time.monotonic() - started >= 0.05
+    assert quota.remaining is None
+
+
+def test_low_remaining_without_reset_falls_back_to_window():
+    quota = _Quota(100)
+    quota.remaining = QUOTA_RESERVE
+    quota.window_start = time.monotonic() - 59.9
+    quota.acquire()
+    assert quota.remaining is None
+    assert quota.used == 1
+
+
+def test_window_limit_keeps_reserve():
+    quota = _Quota(QUOTA_RESERVE + 2)
+    quota.acquire()
+    quota.acquire()
+    quota.window_start = time.monotonic() - 60
+    quota.acquire()
+    assert quota.used == 1
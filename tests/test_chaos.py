@@ -0,0 +1,261 @@
+"""
+Сценарии сбоев из fault_injection.SCENARIOS против брокера в памяти процесса.
+Сигналы проходят настоящий конвейер app.process_signal → place_order, сбои
+внедряются под ResilientClient, как при запуске с CHAOS_SCENARIO.
+"""
+
+import csv
+import importlib
+import os
+import random
+import sys
+import time
+import types
+from contextlib import nullcontext
+import pytest
+import broker_client
+import fault_injection
+from broker_client import BrokerGuard, ResilientClient
+from fault_injection import (
+    ChaosServices,
+    FaultInjector,
+    check_invariants,
+    reconcile_with_broker,
+)
+from order_monitor import OrderTracker
+from risk_manager import risk_engine
+from state_backend import state
+from trade_history import history
+from tick_math import NANO
+from fake_broker import FakeBroker
+
+ACCOUNT = "account"
+TICKER = "SBER"
+FIGI = "BBG004730N88"
+UID = "e6123145-9665-43e0-8413-cd61b8aa9b13"
+LOT = 10
+PRICE_NANO = 300 * NANO
+OPEN_SIGNAL = {
+    "ticker": TICKER,
+    "figi": FIGI,
+    "direction": "buy",
+    "expected_sum": 12000,
+    "price": 300,
+    "stop_loss_price": 285,
+    "exitComment": "OpenLong",
+}
+CLOSE_SIGNAL = {
+    "ticker": TICKER,
+    "figi": FIGI,
+    "direction": "sell",
+    "price": 300,
+    "exitComment": "LongTrTake",
+}
+LOTS = 4
+
+# Длительности сценариев укорачиваются, чтобы тест ждал восстановления секунды
+SHORT_DURATION = 0.5
+# Допустимое время от первого сбоя RPC до его успешного вызова, секунды
+MAX_TIME_TO_RECOVER = SHORT_DURATION + 3
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # tinkoff_api при импорте спрашивает пароль к токену — подставляем токен
+    if "tinkoff_api" not in sys.modules:
+        tinkoff_api = types.ModuleType("tinkoff_api")
+        tinkoff_api.TOKEN = "token"
+        tinkoff_api.initialize_account = lambda token: []
+        sys.modules["tinkoff_api"] = tinkoff_api
+    # app.log создаётся в текущем каталоге при импорте
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        return importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def broker(app_module, monkeypatch):
+    monkeypatch.setattr(broker_client, "guard", BrokerGuard())
+    monkeypatch.setattr(broker_client, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(broker_client, "BREAKER_COOLDOWN", 0.2)
+    monkeypatch.setattr(fault_injection, "injector", None)
+    random.seed(7)
+    for ticker in state.get_positions():
+        state.delete_position(ticker)
+    for order_id in state.get_inflight():
+        state.delete_inflight(order_id)
+    risk_engine.rebuild({}, daily_pnl=0.0)
+    state.put_instrument(
+        FIGI,
+        {
+            "ticker": TICKER,
+            "instrument_uid": UID,
+            "lot": LOT,
+            "min_price_increment": "0.01",
+            "min_price_increment_nano": NANO // 100,
+            "sector": "financial",
+            "currency": "rub",
+        },
+    )
+    broker = FakeBroker({UID: (FIGI, LOT)}, PRICE_NANO)
+    client = ResilientClient(ChaosServices(broker))
+    monkeypatch.setattr(app_module, "open_client", lambda token: nullcontext(client))
+    monkeypatch.setattr(app_module, "account_id", ACCOUNT)
+    monkeypatch.setattr(
+        app_module, "order_tracker", OrderTracker(lambda: ACCOUNT, "token")
+    )
+    # Календарь не ограничивает сигналы
+    monkeypatch.setitem(app_module.scheduler.config, "enabled", False)
+    broker.client = client
+    return broker
+
+
+def load_scenario(monkeypatch, scenario):
+    injector = FaultInjector(scenario)
+    for rule in injector.rules:
+        if rule.duration is not None:
+            rule.duration = SHORT_DURATION
+        rule.delay = min(rule.delay, 0.05)
+    monkeypatch.setattr(fault_injection, "injector", injector)
+    return injector
+
+
+def send_signal(app_module, data, attempts=5):
+    # Время алерта отличает сигнал от повтора того же сигнала
+    data = dict(data, alert_time=time.time_ns())
+    # Источник повторяет сигнал, заявка по которому не дошла до брокера
+    for attempt in range(attempts):
+        result, status = app_module.process_signal(dict(data))
+        rejected = status >= 500 or "Ошибка при размещении ордера" in str(
+            result.get("error")
+        )
+        if not rejected:
+            break
+        time.sleep(SHORT_DURATION)
+    return result, status
+
+
+def wait_consistent(app_module, client, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            app_module.order_tracker._poll(client)
+        except Exception:
+            pass
+        violations = check_invariants(state.get_positions(), state.get_inflight())
+        if not app_module.order_tracker.inflight() and not violations:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def reconcile(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return reconcile_with_broker(client, ACCOUNT, state.get_positions())
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)
+
+
+def round_trip(app_module, broker):
+    """
+    Открывает и закрывает позицию сигналами и ждёт согласованного состояния.
+
+    Returns:
+        tuple: Статусы ответов на открытие и закрытие.
+    """
+    _, open_status = send_signal(app_module, OPEN_SIGNAL)
+    assert wait_consistent(app_module, broker.client)
+    assert reconcile(broker.client) == []
+    _, close_status = send_signal(app_module, CLOSE_SIGNAL)
+    assert wait_consistent(app_module, broker.client)
+    assert TICKER not in state.get_positions()
+    assert broker.shares(FIGI) == 0
+    assert broker.stops == {}
+    assert reconcile(broker.client) == []
+    return open_status, close_status
+
+
+def journal_rows():
+    """
+    Возвращает строки trades.csv теста и сделки истории с теми же заявками
+    на закрытие: база истории общая для всех тестов модуля.
+    """
+    history.flush()
+    with open("trades.csv", encoding="utf-8") as f:
+        csv_rows = list(csv.DictReader(f))
+    trades = {
+        trade["exit_client_order_id"]: trade
+        for trade in history.query_trades(ticker=TICKER)
+    }
+    return csv_rows, [trades.get(row["exit_client_order_id"]) for row in csv_rows]
+
+
+@pytest.mark.parametrize(
+    "scenario",
+    [
+        "none",
+        "latency",
+        "flaky_reads",
+        "rate_limited",
+        "stop_loss_fails",
+        "order_state_down",
+        "portfolio_timeout",
+        "partial_fills",
+    ],
+)
+def test_scenario_recovers(app_module, broker, monkeypatch, scenario):
+    injector = load_scenario(monkeypatch, scenario)
+
+    statuses = round_trip(app_module, broker)
+    if scenario == "stop_loss_fails":
+        # Позиция без стопа закрыта сразу, закрывать по сигналу нечего
+        assert statuses == (400, 400)
+    else:
+        assert statuses == (200, 200)
+    # После окончания сбоев сигналы снова исполняются полностью
+    time.sleep(SHORT_DURATION)
+    assert round_trip(app_module, broker) == (200, 200)
+
+    csv_rows, trades = journal_rows()
+    first_exit = "StopLossFailed" if scenario == "stop_loss_fails" else "LongTrTake"
+    assert [row["exitComment"] for row in csv_rows] == [first_exit, "LongTrTake"]
+    assert [trade["exitComment"] for trade in trades] == [first_exit, "LongTrTake"]
+    for row, trade in zip(csv_rows, trades):
+        assert int(row["quantity"]) == trade["quantity"] == LOTS
+        assert row["exit_exchange_order_id"] == trade["exit_exchange_order_id"]
+        assert trade["profit_gross"] == 0
+
+    report = injector.report()
+    if scenario != "none":
+        assert report["injected"]
+    if any(rule.action in ("error", "timeout") for rule in injector.rules):
+        assert report["recoveries"]
+        assert report["max_time_to_recover"] < MAX_TIME_TO_RECOVER
+    if all(rule.duration is not None for rule in injector.rules):
+        # Все ограниченные по времени сбои закончились успешным вызовом
+        assert report["in_fault"] == {}
+
+
+def test_unprotected_partial_open_is_flattened(app_module, broker, monkeypatch):
+    # Открытие исполняется частями, стоп на исполненные лоты не ставится:
+    # остаток заявки снимается, исполненное закрывается
+    broker.fill_step = 1
+    load_scenario(monkeypatch, "stop_loss_fails")
+
+    _, status = send_signal(app_module, OPEN_SIGNAL)
+    assert status == 200
+    assert wait_consistent(app_module, broker.client)
+    assert TICKER not in state.get_positions()
+    assert broker.shares(FIGI) == 0
+    assert reconcile(broker.client) == []
+
+    csv_rows, trades = journal_rows()
+    assert [row["exitComment"] for row in csv_rows] == ["StopLossFailed"]
+    assert [trade["quantity"] for trade in trades] == [1]
@@ -0,0 +1,167 @@
+import threading
+import time
+import pytest
+from execution import OrderManager, SimulatedOrderBook, DEFAULT_EXECUTION_CONFIG
+
+BOOK_BIDS = [(100, 1_000)]
+BOOK_ASKS = [(101, 1_000)]
+
+
+def make_config(**overrides):
+    config = dict(DEFAULT_EXECUTION_CONFIG)
+    config.update(
+        {
+            "twap_slices": 3,
+            "twap_duration": 0.3,
+            "iceberg_display_lots": 10,
+            "poll_interval": 0.01,
+            "timeout": 2,
+        }
+    )
+    config.update(overrides)
+    return config
+
+
+def run_parent(gateway, algo, quantity, action=None, **config):
+    """
+    Исполняет родительскую заявку и возвращает её после on_done; action
+    вызывается в отдельном потоке, пока алгоритм работает.
+    """
+    manager = OrderManager(gateway, make_config(**config))
+    done = threading.Event()
+    try:
+        parent = manager.submit(
+            "SBER", "uid", "buy", quantity, 1.0, algo, on_done=lambda _: done.set()
+        )
+        if action is not None:
+            action(manager, parent)
+        assert done.wait(10), "parent order did not finish"
+        deadline = time.monotonic() + 1
+        while parent.id in manager.parents and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        manager.stop()
+    assert parent.id not in manager.parents
+    return parent
+
+
+class LaggingBook(SimulatedOrderBook):
+    """
+    Рыночные заявки исполняются не сразу, а через lag запросов состояния.
+    """
+
+    def __init__(self, bids, asks, lag):
+        super().__init__(bids, asks)
+        self.lag = lag
+        self._polls = {}
+
+    def post_order(self, instrument_id, quantity, direction, price_nano=None):
+        if price_nano is not None:
+            return super().post_order(instrument_id, quantity, direction, price_nano)
+        with self._lock:
+            order_id = f"sim-{next(self._ids)}"
+            self.orders[order_id] = {
+                "quantity": quantity,
+                "direction": direction,
+                "price_nano": None,
+                "lots_executed": 0,
+                "notional": 0,
+                "done": False,
+            }
+            self._polls[order_id] = 0
+            return order_id
+
+    def get_order(self, order_id):
+        with self._lock:
+            order = self.orders[order_id]
+            self._polls[order_id] = self._polls.get(order_id, 0) + 1
+            if not order["done"] and self._polls[order_id] > self.lag:
+                self._match(order)
+        return super().get_order(order_id)
+
+
+def test_twap_fills_quantity_in_slices():
+    book = SimulatedOrderBook(BOOK_BIDS, BOOK_ASKS)
+    parent = run_parent(book, "twap", 30)
+    assert parent.filled_lots == 30
+    assert [child["quantity"] for child in parent.children] == [10, 10, 10]
+    assert parent.status == "filled"
+    assert parent.average_price_nano == 101
+
+
+def test_twap_cancels_unfinished_slice_before_next():
+    # Срез исполняется позже, чем длится интервал: его нужно снять, иначе
+    # поздние исполнения дадут больше запрошенного
+    book = LaggingBook(BOOK_BIDS, BOOK_ASKS, lag=1_000)
+    parent = run_parent(book, "twap", 30, sweep_remainder=False)
+    assert all(child["done"] for child in parent.children)
+    book.lag = 0
+    for order_id in list(book.orders):
+        book.get_order(order_id)
+    assert parent.filled_lots <= parent.quantity
+    assert sum(order["lots_executed"] for order in book.orders.values()) == 0
+
+
+def test_sweep_child_cancelled_when_still_open():
+    book = LaggingBook(BOOK_BIDS, BOOK_ASKS, lag=1_000)
+    parent = run_parent(book, "market", 5)
+    assert all(child["done"] for child in parent.children)
+    assert all(order["done"] for order in book.orders.values())
+
+
+def test_iceberg_caps_visible_size():
+    book = SimulatedOrderBook(BOOK_BIDS, BOOK_ASKS)
+
+    def cross(manager, parent):
+        time.sleep(0.05)
+        # Продавец встаёт на лучший бид — стоящие заявки исполняются
+        book.move([(100, 1_000)], [(100, 1_000)])
+
+    parent = run_parent(book, "iceberg", 25, action=cross, sweep_remainder=False)
+    assert parent.filled_lots == 25
+    assert max(child["quantity"] for child in parent.children) <= 10
+    assert all(child["limit_nano"] == 100 for child in parent.children)
+
+
+def test_peg_reposts_when_best_bid_moves():
+    book = SimulatedOrderBook(BOOK_BIDS, BOOK_ASKS)
+
+    def move(manager, parent):
+        time.sleep(0.05)
+        book.move([(102, 1_000)], [(103, 1_000)])
+        time.sleep(0.05)
+        book.move([(102, 1_000)], [(102, 1_000)])
+
+    parent = run_parent(book, "peg", 20, action=move, sweep_remainder=False)
+    assert parent.filled_lots == 20
+    prices = [child["limit_nano"] for child in parent.children]
+    assert prices[0] == 100 and prices[-1] == 102
+
+
+def test_limit_timeout_sweeps_remainder_at_market():
+    book = SimulatedOrderBook(BOOK_BIDS, BOOK_ASKS)
+    parent = run_parent(book, "peg", 20, timeout=0.1)
+    assert parent.filled_lots == 20
+    assert parent.children[-1]["limit_nano"] is None
+    assert parent.average_price_nano == 101
+
+
+def test_cancel_stops_without_sweep():
+    book = SimulatedOrderBook(BOOK_BIDS, BOOK_ASKS)
+
+    def cancel(manager, parent):
+        time.sleep(0.05)
+        assert manager.cancel(parent.id)
+
+    parent = run_parent(book, "peg", 20, action=cancel, timeout=5)
+    assert parent.filled_lots == 0
+    assert parent.status == "failed"
+    assert all(child["limit_nano"] is not None for child in parent.children)
+    assert all(order["done"] for order in book.orders.values())
+
+
+@pytest.mark.parametrize("algo", ["twap", "iceberg", "peg"])
+def test_no_overfill_with_partial_liquidity(algo):
+    book = SimulatedOrderBook([(100, 1_000)], [(100, 7), (101, 1_000)])
+    parent = run_parent(book, algo, 25, timeout=0.2)
+    assert parent.filled_lots == 25
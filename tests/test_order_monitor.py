@@ -0,0 +1,198 @@
+import threading
+import time
+from contextlib import contextmanager
+from tinkoff.invest import OrderDirection, OrderType
+from order_monitor import OrderTracker
+from state_backend import state
+from tick_math import NANO
+from fake_broker import FakeBroker
+
+TICKER = "SBER"
+FIGI = "BBG004730N88"
+UID = "e6123145-9665-43e0-8413-cd61b8aa9b13"
+LOT = 10
+
+
+class BlockingStreamClient:
+    """
+    Клиент, у которого стрим сделок ждёт, пока не закроют канал.
+    """
+
+    def __init__(self):
+        self.closed = threading.Event()
+        self.orders_stream = self
+
+    def trades_stream(self, accounts):
+        self.closed.wait(30)
+        raise RuntimeError("Channel closed")
+        yield
+
+
+def test_stop_interrupts_trades_stream():
+    clients = []
+
+    @contextmanager
+    def client_factory(token):
+        client = BlockingStreamClient()
+        clients.append(client)
+        try:
+            yield client
+        finally:
+            client.closed.set()
+
+    tracker = OrderTracker(lambda: "account", "token", client_factory)
+    tracker.start()
+    deadline = time.monotonic() + 5
+    while tracker._trades_context is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    threads = list(tracker._threads)
+    started = time.monotonic()
+    tracker.stop(timeout=5)
+    assert time.monotonic() - started < 2
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(clients) == 1 and clients[0].closed.is_set()
+
+
+def test_polled_fills_use_average_price():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 300 * NANO, fill_step=2)
+    tracker = OrderTracker(lambda: "account", "token")
+    response = broker.orders.post_order(
+        instrument_id=UID,
+        quantity=4,
+        direction=OrderDirection.ORDER_DIRECTION_BUY,
+        account_id="account",
+        order_type=OrderType.ORDER_TYPE_MARKET,
+        order_id="client-1",
+    )
+    state.put_position(
+        TICKER,
+        {
+            "figi": FIGI,
+            "instrument_uid": UID,
+            "open_datetime": "2026-10-19T10:00:00",
+            "quantity": 0,
+            "lots_requested": 4,
+            "filled_lots": 0,
+            "avg_price_nano": None,
+            "avg_price": None,
+            "client_order_id": "client-1",
+            "exchange_order_id": response.order_id,
+            "direction": "buy",
+            "signal_price": 290.0,
+            "stop_loss_price": None,
+            "stop_order_id": None,
+            "exitComment": "OpenLong",
+            "lot": LOT,
+        },
+    )
+    tracker.track_open(TICKER, response.order_id, 4, LOT)
+    tracker._poll(broker)
+    position = state.get_positions()[TICKER]
+    assert position["quantity"] == 2
+    assert position["avg_price_nano"] == 300 * NANO
+
+    broker.price_nano = 310 * NANO
+    tracker._poll(broker)
+    position = state.get_positions()[TICKER]
+    assert position["quantity"] == 4
+    assert position["avg_price_nano"] == 305 * NANO
+    assert position["avg_price"] == 305.0
+    assert not tracker.inflight()
+    state.delete_position(TICKER)
+
+
+def test_workers_apply_shared_order_once():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 300 * NANO, fill_step=1)
+    response = broker.orders.post_order(
+        instrument_id=UID,
+        quantity=4,
+        direction=OrderDirection.ORDER_DIRECTION_BUY,
+        account_id="account",
+        order_type=OrderType.ORDER_TYPE_MARKET,
+        order_id="client-2",
+    )
+    state.put_position(
+        TICKER,
+        {
+            "figi": FIGI,
+            "instrument_uid": UID,
+            "open_datetime": "2026-10-19T10:00:00",
+            "quantity": 0,
+            "lots_requested": 4,
+            "filled_lots": 0,
+            "avg_price_nano": None,
+            "avg_price": None,
+            "client_order_id": "client-2",
+            "exchange_order_id": response.order_id,
+            "direction": "buy",
+            "signal_price": 290.0,
+            "stop_loss_price": None,
+            "stop_order_id": None,
+            "exitComment": "OpenLong",
+            "lot": LOT,
+        },
+    )
+    first = OrderTracker(lambda: "account", "token")
+    first.track_open(TICKER, response.order_id, 4, LOT)
+    # Второй воркер загрузил ту же заявку при старте
+    second = OrderTracker(lambda: "account", "token")
+    second._inflight = {
+        order_id: dict(record) for order_id, record in first.inflight().items()
+    }
+    for tracker in (first, second, first, second):
+        tracker._poll(broker)
+        assert (
+            state.get_positions()[TICKER]["quantity"]
+            == broker.state[response.order_id].lots_executed
+        )
+    # Заявку завершил один воркер, другой её только забывает
+    first._poll(broker)
+    second._poll(broker)
+    assert not first.inflight() and not second.inflight()
+    assert response.order_id not in state.get_inflight()
+    assert state.get_positions()[TICKER]["quantity"] == 4
+    state.delete_position(TICKER)
+
+
+def test_stop_follows_filled_lots():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 300 * NANO, fill_step=1)
+    response = broker.orders.post_order(
+        instrument_id=UID,
+        quantity=3,
+        direction=OrderDirection.ORDER_DIRECTION_BUY,
+        account_id="account",
+        order_type=OrderType.ORDER_TYPE_MARKET,
+        order_id="client-3",
+    )
+    # Заявка ещё не исполнялась: стоп не выставлен, но его цена известна
+    state.put_position(
+        TICKER,
+        {
+            "figi": FIGI,
+            "instrument_uid": UID,
+            "open_datetime": "2026-10-19T10:00:00",
+            "quantity": 0,
+            "lots_requested": 3,
+            "filled_lots": 0,
+            "avg_price_nano": None,
+            "avg_price": None,
+            "client_order_id": "client-3",
+            "exchange_order_id": response.order_id,
+            "direction": "buy",
+            "signal_price": 300.0,
+            "stop_loss_price": 290.0,
+            "stop_order_id": None,
+            "exitComment": "OpenLong",
+            "lot": LOT,
+        },
+    )
+    tracker = OrderTracker(lambda: "account", "token")
+    tracker.track_open(TICKER, response.order_id, 3, LOT)
+    for filled in (1, 2, 3):
+        tracker._poll(broker)
+        position = state.get_positions()[TICKER]
+        assert position["quantity"] == filled
+        assert len(broker.stops) == 1
+        assert broker.stops[position["stop_order_id"]]["quantity"] == filled
+    assert not tracker.inflight()
+    state.delete_position(TICKER)
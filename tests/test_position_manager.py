@@ -0,0 +1,109 @@
+import csv
+from position_manager import PositionManager
+from order_monitor import OrderTracker
+from state_backend import state
+from trade_history import history
+from tick_math import NANO
+from fake_broker import FakeBroker
+
+TICKER = "GAZP"
+FIGI = "BBG004730RP0"
+UID = "962e2a95-02a9-4171-abd7-aa198dbe643a"
+LOT = 10
+CONFIG = {
+    "default": {
+        "trail_ticks": 0,
+        "step_ticks": 5,
+        "take_profits": [{"ticks": 100, "fraction": 0.5}],
+    },
+    "tickers": {},
+    "debounce": 0.1,
+}
+
+
+def open_position(broker, quantity):
+    broker.holdings[FIGI] = quantity * LOT
+    position = {
+        "figi": FIGI,
+        "instrument_uid": UID,
+        "open_datetime": "2026-10-19T10:00:00",
+        "quantity": quantity,
+        "lots_requested": quantity,
+        "filled_lots": quantity,
+        "avg_price_nano": 150 * NANO,
+        "avg_price": 150.0,
+        "client_order_id": "entry-client",
+        "exchange_order_id": "entry-order",
+        "direction": "buy",
+        "signal_price": 150.0,
+        "stop_loss_price": None,
+        "stop_order_id": None,
+        "exitComment": "OpenLong",
+        "lot": LOT,
+    }
+    state.put_position(TICKER, position)
+    return position
+
+
+def make_manager():
+    tracker = OrderTracker(lambda: "account", "token")
+    manager = PositionManager("token", lambda: "account", None, tracker, config=CONFIG)
+    return tracker, manager
+
+
+def test_take_applies_only_executed_lots():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 160 * NANO, fill_step=1)
+    open_position(broker, 4)
+    tracker, manager = make_manager()
+    manager._take_profit(broker, TICKER, 0.5, 160 * NANO)
+    # Заявка отправлена, но позиция не меняется до исполнения
+    assert state.get_positions()[TICKER]["quantity"] == 4
+    (order_id,) = tracker.inflight()
+    assert tracker.closing_lots(TICKER) == 2
+
+    tracker._poll(broker)
+    assert state.get_positions()[TICKER]["quantity"] == 3
+    broker.orders.cancel_order(account_id="account", order_id=order_id)
+    tracker._poll(broker)
+
+    position = state.get_positions()[TICKER]
+    assert position["quantity"] == 3
+    assert not tracker.inflight()
+    history.flush()
+    (trade,) = history.query_trades(ticker=TICKER)
+    assert trade["quantity"] == 1
+    assert trade["exit_exchange_order_id"] == order_id
+    assert trade["exit_client_order_id"] == (
+        history.query_orders(order_id=order_id)[0]["client_order_id"]
+    )
+    with open("trades.csv", encoding="utf-8") as f:
+        (row,) = csv.DictReader(f)
+    assert row["exit_client_order_id"] == trade["exit_client_order_id"]
+    state.delete_position(TICKER)
+
+
+def test_take_skips_lots_already_closing():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 160 * NANO, fill_step=1)
+    open_position(broker, 4)
+    tracker, manager = make_manager()
+    tracker.track_close(
+        TICKER, "entry-order", "close-order", "CloseLong", "c", 160.0, 4, LOT
+    )
+    manager._take_profit(broker, TICKER, 0.5, 160 * NANO)
+    assert not broker.state
+    state.delete_inflight("close-order")
+    state.delete_position(TICKER)
+
+
+def test_sync_follows_positions_of_other_workers():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 160 * NANO)
+    tracker, manager = make_manager()
+    # Ведущий процесс без запущенных потоков
+    manager._running = True
+    manager._tick_lookup = lambda figi: NANO // 100
+    open_position(broker, 4)
+    manager.sync(state.get_positions())
+    assert manager.pending()["tracked"] == 1
+    state.delete_position(TICKER)
+    manager.sync(state.get_positions())
+    assert manager.pending()["tracked"] == 0
@@ -0,0 +1,35 @@
+from risk_manager import RiskEngine, DEFAULT_RISK_LIMITS
+
+
+def make_engine(**limits):
+    return RiskEngine(dict(DEFAULT_RISK_LIMITS, **limits))
+
+
+def position(sector, currency="rub", quantity=10):
+    return {
+        "direction": "buy",
+        "quantity": quantity,
+        "lot": 1,
+        "signal_price": 100.0,
+        "stop_loss_price": None,
+        "sector": sector,
+        "currency": currency,
+    }
+
+
+def test_sector_limit_caps_known_sector():
+    engine = make_engine(max_sector_exposure=1_500)
+    engine.on_open("SBER", position("financial"))
+    quantity, reason = engine.check_order(
+        "VTBR", "buy", 10, 1, 100.0, None, "financial", "rub"
+    )
+    assert (quantity, reason) == (5, "max_sector_exposure")
+
+
+def test_unknown_sector_is_not_a_shared_limit():
+    engine = make_engine(max_sector_exposure=1_500, max_currency_exposure=1_500)
+    engine.on_open("SBER", position("unknown", "unknown"))
+    quantity, reason = engine.check_order(
+        "GAZP", "buy", 10, 1, 100.0, None, "unknown", "unknown"
+    )
+    assert (quantity, reason) == (10, None)
@@ -0,0 +1,256 @@
+import socketserver
+import threading
+import time
+import pytest
+import state_backend
+from state_backend import (
+    JsonStateBackend,
+    LockTimeoutError,
+    RedisStateBackend,
+    LeaderLease,
+    RespConnection,
+    SqliteStateBackend,
+)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    Локальная замена Redis: команды, которыми пользуется RedisStateBackend,
+    кроме EVAL (проверяется запасной путь снятия блокировки).
+    """
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*"
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def _write(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self._write(item)
+        else:
+            data = value.encode()
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(data), data))
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command, *params = args
+            with server.lock:
+                now = time.monotonic()
+                for key in [k for k, t in server.expires.items() if t <= now]:
+                    server.data.pop(key, None)
+                    del server.expires[key]
+                if command == "SET":
+                    key, value, *options = params
+                    if "NX" in options and key in server.data:
+                        self._write(None)
+                        continue
+                    server.data[key] = value
+                    if "PX" in options:
+                        ttl = int(options[options.index("PX") + 1]) / 1000
+                        server.expires[key] = now + ttl
+                    self.wfile.write(b"+OK\r\n")
+                elif command == "PEXPIRE":
+                    key, ttl = params
+                    if key in server.data:
+                        server.expires[key] = now + int(ttl) / 1000
+                    self._write(int(key in server.data))
+                elif command == "GET":
+                    self._write(server.data.get(params[0]))
+                elif command == "DEL":
+                    self._write(int(server.data.pop(params[0], None) is not None))
+                    server.expires.pop(params[0], None)
+                elif command == "HSET":
+                    key, field, value = params
+                    server.data.setdefault(key, {})[field] = value
+                    self._write(1)
+                elif command == "HGET":
+                    self._write(server.data.get(params[0], {}).get(params[1]))
+                elif command == "HDEL":
+                    removed = server.data.get(params[0], {}).pop(params[1], None)
+                    self._write(int(removed is not None))
+                elif command == "HGETALL":
+                    flat = []
+                    for field, value in server.data.get(params[0], {}).items():
+                        flat.extend([field, value])
+                    self._write(flat)
+                else:
+                    self.wfile.write(
+                        b"-ERR unknown command '%s'\r\n" % command.encode()
+                    )
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.expires = {}
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["json", "sqlite", "redis"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(state_backend, "LOCKS_DIR", str(tmp_path / ".locks"))
+        yield JsonStateBackend(
+            str(tmp_path / "positions.json"),
+            str(tmp_path / "tokens_figi_uid.json"),
+            str(tmp_path / "inflight_orders.json"),
+        )
+    elif request.param == "sqlite":
+        yield SqliteStateBackend(str(tmp_path / "state.db"))
+    else:
+        server = request.getfixturevalue("redis_server")
+        connection = RespConnection(*server.server_address)
+        yield RedisStateBackend(connection, prefix="test")
+        connection.close()
+
+
+def test_positions_roundtrip(backend):
+    position = {"figi": "BBG004730N88", "quantity": 2, "comment": "вход"}
+    backend.put_position("SBER", position)
+    backend.put_position("GAZP", {"figi": "BBG004730RP0", "quantity": 1})
+    assert backend.get_positions()["SBER"] == position
+    backend.delete_position("GAZP")
+    assert list(backend.get_positions()) == ["SBER"]
+
+
+def test_inflight_and_instruments(backend):
+    backend.put_inflight("order-1", {"ticker": "SBER", "kind": "open"})
+    assert backend.get_inflight() == {"order-1": {"ticker": "SBER", "kind": "open"}}
+    backend.delete_inflight("order-1")
+    assert backend.get_inflight() == {}
+    backend.put_instrument("BBG004730N88", {"ticker": "SBER", "lot": 10})
+    assert backend.get_instrument("BBG004730N88")["lot"] == 10
+
+
+def test_signal_dedupe_and_forget(backend):
+    assert backend.mark_signal("key", 60)
+    assert not backend.mark_signal("key", 60)
+    backend.forget_signal("key")
+    assert backend.mark_signal("key", 60)
+
+
+def test_signal_mark_expires(backend):
+    assert backend.mark_signal("short", 0.05)
+    time.sleep(0.1)
+    assert backend.mark_signal("short", 60)
+
+
+def test_lock_is_exclusive(backend):
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with backend.lock("ticker:SBER"):
+            acquired.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert acquired.wait(5)
+    try:
+        with pytest.raises(LockTimeoutError):
+            with backend.lock("ticker:SBER", wait=0.1):
+                pass
+    finally:
+        release.set()
+        holder.join()
+    with backend.lock("ticker:SBER", wait=1):
+        pass
+
+
+def test_claim_is_exclusive_and_renewable(backend):
+    assert backend.claim("leader", "first", ttl=5)
+    assert not backend.claim("leader", "second", ttl=5)
+    # Продление владельцем
+    assert backend.claim("leader", "first", ttl=5)
+    backend.release("leader", "second")
+    assert not backend.claim("leader", "second", ttl=5)
+    backend.release("leader", "first")
+    assert backend.claim("leader", "second", ttl=5)
+    backend.release("leader", "second")
+
+
+def test_leader_lease_moves_to_next_worker(tmp_path):
+    backend = SqliteStateBackend(str(tmp_path / "state.db"))
+    events = []
+    leases = [
+        LeaderLease(
+            backend,
+            "leader",
+            on_acquired=lambda i=i: events.append(("acquired", i)),
+            on_lost=lambda i=i: events.append(("lost", i)),
+            ttl=0.3,
+        )
+        for i in range(2)
+    ]
+    for lease in leases:
+        lease.start()
+    try:
+        assert [lease.held for lease in leases] == [True, False]
+        time.sleep(0.5)
+        # Ведущий продлевает аренду, второй воркер её не получает
+        assert events == [("acquired", 0)]
+        leases[0].stop()
+        deadline = time.monotonic() + 2
+        while not leases[1].held and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert events == [("acquired", 0), ("lost", 0), ("acquired", 1)]
+    finally:
+        for lease in leases:
+            lease.stop()
+
+
+def test_json_lock_times_out_across_processes(tmp_path, monkeypatch):
+    # Два экземпляра — как два процесса: общий только flock на файле
+    monkeypatch.setattr(state_backend, "LOCKS_DIR", str(tmp_path / ".locks"))
+    first = JsonStateBackend(
+        *(str(tmp_path / n) for n in ("p.json", "t.json", "i.json"))
+    )
+    second = JsonStateBackend(
+        *(str(tmp_path / n) for n in ("p.json", "t.json", "i.json"))
+    )
+    with first.lock("ticker:SBER"):
+        started = time.monotonic()
+        with pytest.raises(LockTimeoutError):
+            with second.lock("ticker:SBER", wait=0.2):
+                pass
+        assert time.monotonic() - started < 1
+    with second.lock("ticker:SBER", wait=0.2):
+        pass
+
+
+def test_resp_connection_replies(redis_server):
+    connection = RespConnection(*redis_server.server_address)
+    try:
+        assert connection.execute("SET", "k", "значение") == "OK"
+        assert connection.execute("GET", "k") == "значение"
+        assert connection.execute("GET", "missing") is None
+        assert connection.execute("DEL", "k") == 1
+        assert connection.execute("HGETALL", "missing") == []
+        with pytest.raises(RuntimeError):
+            connection.execute("EVAL", "return 1", 0)
+    finally:
+        connection.close()
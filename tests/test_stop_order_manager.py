@@ -0,0 +1,69 @@
+import pytest
+from tinkoff.invest import OrderDirection, OrderType
+from stop_order_manager import handle_stop_close, place_stop_loss
+from tick_math import NANO
+from fake_broker import FakeBroker
+
+TICKER = "LKOH"
+FIGI = "BBG004731032"
+UID = "02cfdf61-6298-4c0f-a9ca-9cabc82afaf3"
+LOT = 10
+
+
+@pytest.mark.parametrize("direction", ["buy", "sell"])
+def test_stop_close_uses_average_and_executed_price(direction):
+    broker = FakeBroker({UID: (FIGI, LOT)}, 7000 * NANO)
+    broker.orders.post_order(
+        instrument_id=UID,
+        quantity=3,
+        direction=(
+            OrderDirection.ORDER_DIRECTION_BUY
+            if direction == "buy"
+            else OrderDirection.ORDER_DIRECTION_SELL
+        ),
+        account_id="account",
+        order_type=OrderType.ORDER_TYPE_MARKET,
+        order_id="entry-client",
+    )
+    stop_price = 6900.0 if direction == "buy" else 7100.0
+    stop_order_id = place_stop_loss(broker, "account", UID, 3, stop_price, direction)
+    # Стоп исполнился с проскальзыванием
+    broker.price_nano = 6890 * NANO if direction == "buy" else 7110 * NANO
+    exit_order_id = broker.trigger_stop(stop_order_id)
+    positions = {
+        TICKER: {
+            "figi": FIGI,
+            "instrument_uid": UID,
+            "open_datetime": "2026-10-19T10:00:00",
+            "quantity": 3,
+            "lot": LOT,
+            "avg_price": 7000.0,
+            "client_order_id": "entry-client",
+            "exchange_order_id": "ex-1",
+            "direction": direction,
+            "signal_price": 6990.0,
+            "stop_loss_price": stop_price,
+            "stop_order_id": stop_order_id,
+        }
+    }
+    is_executed, trade = handle_stop_close(
+        broker, "account", TICKER, FIGI, positions, "LongStop"
+    )
+    assert is_executed
+    assert trade["exit_exchange_order_id"] == exit_order_id
+    assert trade["exit_client_order_id"] == stop_order_id
+    # 3 лота по 10 акций, вход по средней 7000, выход по цене исполнения стопа
+    assert trade["profit_gross"] == pytest.approx(-3300.0)
+    exit_price = 6890 if direction == "buy" else 7110
+    fees = 0.0005 * 7000 * 30 + 0.0005 * exit_price * 30
+    assert trade["broker_fee"] == pytest.approx(fees)
+    assert trade["profit_net"] == pytest.approx(-3300.0 - fees)
+
+
+def test_stop_close_rejected_while_position_held():
+    broker = FakeBroker({UID: (FIGI, LOT)}, 7000 * NANO)
+    broker.holdings[FIGI] = 30
+    positions = {TICKER: {"stop_order_id": "stop-1"}}
+    assert handle_stop_close(
+        broker, "account", TICKER, FIGI, positions, "LongStop"
+    ) == (False, None)
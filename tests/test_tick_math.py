@@ -0,0 +1,74 @@
+import random
+from decimal import ROUND_DOWN, Decimal
+import pytest
+from tinkoff.invest import Quotation
+from tinkoff.invest.utils import decimal_to_quotation
+from tick_math import (
+    NANO,
+    nano_to_quotation,
+    price_to_nano,
+    quantity_for_sum,
+    quotation_to_nano,
+    round_price,
+    tick_scale_from_decimal,
+)
+
+INCREMENTS = ["0.01", "0.005", "0.02", "0.1", "0.5", "1", "5", "0.0001", "1E-7"]
+
+
+def reference_round(value, min_price_increment):
+    # Прежнее округление через Decimal
+    price = Decimal(str(value))
+    price = (price / min_price_increment).quantize(
+        Decimal("1"), rounding=ROUND_DOWN
+    ) * min_price_increment
+    return float(price), decimal_to_quotation(price)
+
+
+def test_round_price_matches_decimal_reference():
+    rng = random.Random(0)
+    for _ in range(20_000):
+        increment = Decimal(rng.choice(INCREMENTS))
+        tick = tick_scale_from_decimal(increment)
+        value = round(rng.uniform(0, 100_000), rng.randint(0, 10))
+        expected_float, expected_quotation = reference_round(value, increment)
+        actual_float, actual_nano = round_price(value, tick)
+        actual_quotation = nano_to_quotation(actual_nano)
+        assert actual_float == expected_float, (value, increment)
+        assert (actual_quotation.units, actual_quotation.nano) == (
+            expected_quotation.units,
+            expected_quotation.nano,
+        ), (value, increment)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("311.257", 311_257_000_000),
+        (311.25, 311_250_000_000),
+        (5, 5 * NANO),
+        ("1e-7", 100),
+        ("1.5E2", 150 * NANO),
+        ("-0.25", -250_000_000),
+        ("0.1234567891", 123_456_789),
+    ],
+)
+def test_price_to_nano(value, expected):
+    assert price_to_nano(value) == expected
+
+
+def test_price_to_nano_rejects_garbage():
+    with pytest.raises(ValueError):
+        price_to_nano("abc")
+
+
+def test_quotation_roundtrip():
+    for price_nano in (0, 1, 311_257_000_000, -250_000_000):
+        assert quotation_to_nano(nano_to_quotation(price_nano)) == price_nano
+    assert quotation_to_nano(Quotation(units=2, nano=500_000_000)) == 2_500_000_000
+
+
+def test_quantity_for_sum_does_not_lose_lot_on_boundary():
+    # 3 / (0.1 * 3) во float даёт 9.999...
+    assert quantity_for_sum(3, price_to_nano("0.1"), 3) == 10
+    assert quantity_for_sum(100, 0, 1) == 0
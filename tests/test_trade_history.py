@@ -0,0 +1,76 @@
+import sqlite3
+import pytest
+import trade_history
+from trade_history import TradeHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    journal = TradeHistory(str(tmp_path / "history.db"))
+    yield journal
+    journal.stop()
+
+
+def open_position(history, client_order_id="entry-1"):
+    history.record_position_open(
+        "SBER",
+        {
+            "figi": "BBG004730N88",
+            "direction": "buy",
+            "quantity": 10,
+            "signal_price": 300.0,
+            "open_datetime": "2026-10-19T10:00:00",
+            "client_order_id": client_order_id,
+            "exchange_order_id": "ex-1",
+        },
+    )
+
+
+def trade(exit_client_order_id, quantity, profit_net):
+    return {
+        "ticker": "SBER",
+        "figi": "BBG004730N88",
+        "exitComment": "PartialTake",
+        "close_datetime": "2026-10-19T11:00:00",
+        "quantity": quantity,
+        "profit_net": profit_net,
+        "entry_client_order_id": "entry-1",
+        "exit_client_order_id": exit_client_order_id,
+    }
+
+
+def test_partial_exit_keeps_position_open(history):
+    open_position(history)
+    history.record_trade(trade("exit-1", 4, 10.0), position_closed=False)
+    history.flush()
+    assert history.query_positions("SBER")[0]["status"] == "open"
+    history.record_trade(trade("exit-2", 6, 5.0))
+    history.flush()
+    position = history.query_positions("SBER")[0]
+    assert position["status"] == "closed"
+    assert position["close_datetime"] == "2026-10-19T11:00:00"
+    assert history.realized_pnl("2026-10-19") == 15.0
+
+
+def test_bad_record_does_not_drop_batch(history, monkeypatch):
+    monkeypatch.setitem(
+        trade_history._STATEMENTS, "broken", "INSERT INTO missing_table VALUES (?)"
+    )
+    open_position(history, "entry-1")
+    history._put("broken", (1,))
+    open_position(history, "entry-2")
+    history.record_trade(trade("exit-1", 10, 7.0))
+    assert history.flush()
+    positions = history.query_positions("SBER")
+    assert {p["entry_client_order_id"] for p in positions} == {"entry-1", "entry-2"}
+    assert len(history.query_trades("SBER")) == 1
+
+
+def test_schema_is_reusable(tmp_path):
+    db_file = str(tmp_path / "history.db")
+    TradeHistory(db_file)
+    TradeHistory(db_file)
+    conn = sqlite3.connect(db_file)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    conn.close()
+    assert {"orders", "fills", "positions", "trades"} <= tables
@@ -0,0 +1,162 @@
+import logging
+from decimal import Decimal
+from tinkoff.invest import Quotation
+
+# Цены внутри модуля хранятся целым числом нано-единиц (1e-9), как в Quotation
+NANO = 1_000_000_000
+
+
+def tick_scale_from_decimal(min_price_increment):
+    """
+    Переводит шаг цены инструмента в целое число нано-единиц.
+
+    Вызывается один раз при кэшировании инструмента, дальше вся арифметика
+    идёт на целых числах.
+
+    Args:
+        min_price_increment: Шаг цены (Decimal или строка).
+
+    Returns:
+        int: Шаг цены в нано-единицах.
+    """
+    tick = int((Decimal(str(min_price_increment)) * NANO).to_integral_value())
+    if tick <= 0:
+        raise ValueError(f"Invalid min_price_increment: {min_price_increment}")
+    return tick
+
+
+def price_to_nano(value):
+    """
+    Разбирает цену (float, int или строку) в целое число нано-единиц без Decimal.
+
+    Разбор идёт по str(value), как и прежний Decimal(str(value)); знаки
+    после девятого отбрасываются (округление к нулю).
+
+    Args:
+        value: Цена.
+
+    Returns:
+        int: Цена в нано-единицах.
+    """
+    text = value.strip() if isinstance(value, str) else str(value)
+    # Быстрый путь: обычная десятичная запись без экспоненты
+    whole, _, frac = text.partition(".")
+    if len(frac) <= 9 and whole.isdigit() and (frac.isdigit() or not frac):
+        return int(whole + frac.ljust(9, "0"))
+    negative = text.startswith("-")
+    if text[:1] in ("+", "-"):
+        text = text[1:]
+    mantissa, _, exponent = text.lower().partition("e")
+    whole, _, frac = mantissa.partition(".")
+    digits = whole + frac
+    if not digits or not digits.isdigit():
+        raise ValueError(f"Invalid price: {value!r}")
+    point = len(whole) + (int(exponent) if exponent else 0) + 9
+    if point <= 0:
+        nano = 0
+    elif point >= len(digits):
+        nano = int(digits + "0" * (point - len(digits)))
+    else:
+        nano = int(digits[:point])
+    return -nano if negative else nano
+
+
+def round_to_tick(price_nano, tick):
+    """
+    Округляет цену вниз (к нулю) до кратного шагу цены.
+
+    Args:
+        price_nano: Цена в нано-единицах.
+        tick: Шаг цены в нано-единицах.
+
+    Returns:
+        int: Округлённая цена в нано-единицах.
+    """
+    if price_nano >= 0:
+        return price_nano // tick * tick
+    return -((-price_nano) // tick * tick)
+
+
+def nano_to_float(price_nano):
+    """
+    Преобразует цену в нано-единицах во float.
+
+    Деление целых в Python округляется корректно, как и float(Decimal),
+    поэтому результат совпадает с прежним округлением побитово.
+    """
+    return price_nano / NANO
+
+
+def nano_to_quotation(price_nano):
+    """
+    Преобразует цену в нано-единицах в Quotation (как decimal_to_quotation).
+    """
+    sign = -1 if price_nano < 0 else 1
+    units, nano = divmod(abs(price_nano), NANO)
+    return Quotation(units=sign * units, nano=sign * nano)
+
+
+def quotation_to_nano(quotation):
+    """
+    Преобразует Quotation (или MoneyValue) в цену в нано-единицах.
+    """
+    return quotation.units * NANO + quotation.nano
+
+
+def quantity_for_sum(expected_sum, price_nano, lot):
+    """
+    Рассчитывает количество лотов на сумму целочисленно.
+
+    В отличие от float-деления не теряет лот на границе
+    (например, 3 / (0.1 * 3) во float даёт 9.999...).
+
+    Args:
+        expected_sum: Сумма на сделку.
+        price_nano: Цена за бумагу в нано-единицах.
+        lot: Размер лота.
+
+    Returns:
+        int: Количество лотов или 0.
+    """
+    try:
+        cost_per_lot = price_nano * lot
+        if cost_per_lot <= 0:
+            return 0
+        quantity = price_to_nano(expected_sum) // cost_per_lot
+        return quantity if quantity > 0 else 0
+    except Exception as e:
+        logging.error(f"Ошибка при расчёте количества: {str(e)}")
+        return 0
+
+
+def round_price(value, tick):
+    """
+    Округляет цену вниз до шага и возвращает (float, нано-единицы).
+    """
+    price_nano = round_to_tick(price_to_nano(value), tick)
+    return nano_to_float(price_nano), price_nano
+
+
+# Замер скорости против прежнего Decimal-округления при прямом запуске файла;
+# совпадение результатов проверяет tests/test_tick_math.py
+if __name__ == "__main__":
+    import timeit
+    from decimal import ROUND_DOWN
+    from tinkoff.invest.utils import decimal_to_quotation
+
+    def reference_round(value, min_price_increment):
+        price = Decimal(str(value))
+        price = (price / min_price_increment).quantize(
+            Decimal("1"), rounding=ROUND_DOWN
+        ) * min_price_increment
+        return float(price), decimal_to_quotation(price)
+
+    increment = Decimal("0.01")
+    tick = tick_scale_from_decimal(increment)
+    number = 100_000
+    old = timeit.timeit(lambda: reference_round(311.257, increment), number=number)
+    new = timeit.timeit(
+        lambda: nano_to_quotation(round_price(311.257, tick)[1]), number=number
+    )
+    print(f"Decimal: {old / number * 1e6:.2f} мкс, ticks: {new / number * 1e6:.2f} мкс")
+    print(f"Ускорение: x{old / new:.1f}")
@@ -0,0 +1,511 @@
+import argparse
+import csv
+import json
+import os
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from utils import POSITIONS_FILE, load_positions_from_json, log_trade_to_csv
+
+HISTORY_DB_FILE = os.environ.get(
+    "HISTORY_DB_FILE", os.path.join(os.path.dirname(__file__), "history.db")
+)
+TRADES_CSV_FILE = "trades.csv"
+
+# Размер пачки и максимальная задержка записи, секунды
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 0.5
+
+TRADE_FIELDS = [
+    "ticker",
+    "figi",
+    "exitComment",
+    "instrument_uid",
+    "open_datetime",
+    "close_datetime",
+    "quantity",
+    "entry_signal_price",
+    "exit_signal_price",
+    "entry_broker_fee",
+    "exit_broker_fee",
+    "broker_fee",
+    "profit_gross",
+    "profit_net",
+    "entry_client_order_id",
+    "entry_exchange_order_id",
+    "exit_client_order_id",
+    "exit_exchange_order_id",
+]
+ORDER_FIELDS = [
+    "exchange_order_id",
+    "client_order_id",
+    "ticker",
+    "figi",
+    "instrument_uid",
+    "direction",
+    "quantity",
+    "order_type",
+    "signal_price",
+    "exitComment",
+    "created_datetime",
+]
+FILL_FIELDS = ["exchange_order_id", "ticker", "figi", "lots", "price", "fill_datetime"]
+POSITION_FIELDS = [
+    "ticker",
+    "figi",
+    "instrument_uid",
+    "direction",
+    "quantity",
+    "signal_price",
+    "stop_loss_price",
+    "stop_order_id",
+    "open_datetime",
+    "entry_client_order_id",
+    "entry_exchange_order_id",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    exchange_order_id TEXT PRIMARY KEY,
+    client_order_id TEXT,
+    ticker TEXT,
+    figi TEXT,
+    instrument_uid TEXT,
+    direction TEXT,
+    quantity INTEGER,
+    order_type TEXT,
+    signal_price REAL,
+    exitComment TEXT,
+    created_datetime TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_client_order_id ON orders (client_order_id);
+CREATE INDEX IF NOT EXISTS orders_ticker_time ON orders (ticker, created_datetime);
+CREATE INDEX IF NOT EXISTS orders_figi_time ON orders (figi, created_datetime);
+
+CREATE TABLE IF NOT EXISTS fills (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exchange_order_id TEXT,
+    ticker TEXT,
+    figi TEXT,
+    lots INTEGER,
+    price REAL,
+    fill_datetime TEXT
+);
+CREATE INDEX IF NOT EXISTS fills_order_id ON fills (exchange_order_id);
+CREATE INDEX IF NOT EXISTS fills_ticker_time ON fills (ticker, fill_datetime);
+
+CREATE TABLE IF NOT EXISTS positions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticker TEXT,
+    figi TEXT,
+    instrument_uid TEXT,
+    direction TEXT,
+    quantity INTEGER,
+    signal_price REAL,
+    stop_loss_price REAL,
+    stop_order_id TEXT,
+    open_datetime TEXT,
+    close_datetime TEXT,
+    exitComment TEXT,
+    status TEXT NOT NULL DEFAULT 'open',
+    entry_client_order_id TEXT UNIQUE,
+    entry_exchange_order_id TEXT
+);
+CREATE INDEX IF NOT EXISTS positions_ticker_time ON positions (ticker, open_datetime);
+CREATE INDEX IF NOT EXISTS positions_figi_time ON positions (figi, open_datetime);
+CREATE INDEX IF NOT EXISTS positions_status ON positions (status);
+
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticker TEXT,
+    figi TEXT,
+    exitComment TEXT,
+    instrument_uid TEXT,
+    open_datetime TEXT,
+    close_datetime TEXT,
+    quantity INTEGER,
+    entry_signal_price REAL,
+    exit_signal_price REAL,
+    entry_broker_fee REAL,
+    exit_broker_fee REAL,
+    broker_fee REAL,
+    profit_gross REAL,
+    profit_net REAL,
+    entry_client_order_id TEXT,
+    entry_exchange_order_id TEXT,
+    exit_client_order_id TEXT,
+    exit_exchange_order_id TEXT,
+    UNIQUE (entry_client_order_id, exit_client_order_id)
+);
+CREATE INDEX IF NOT EXISTS trades_ticker_time ON trades (ticker, close_datetime);
+CREATE INDEX IF NOT EXISTS trades_figi_time ON trades (figi, close_datetime);
+CREATE INDEX IF NOT EXISTS trades_exit_comment_time ON trades (exitComment, close_datetime);
+CREATE INDEX IF NOT EXISTS trades_close_time ON trades (close_datetime);
+CREATE INDEX IF NOT EXISTS trades_entry_order_id ON trades (entry_exchange_order_id);
+CREATE INDEX IF NOT EXISTS trades_exit_order_id ON trades (exit_exchange_order_id);
+"""
+
+
+def _insert_sql(table, fields, conflict="IGNORE"):
+    columns = ", ".join(fields)
+    placeholders = ", ".join("?" for _ in fields)
+    return f"INSERT OR {conflict} INTO {table} ({columns}) VALUES ({placeholders})"
+
+
+_STATEMENTS = {
+    "order": _insert_sql("orders", ORDER_FIELDS, "REPLACE"),
+    "fill": _insert_sql("fills", FILL_FIELDS),
+    "position_open": _insert_sql("positions", POSITION_FIELDS),
+    "position_close": (
+        "UPDATE positions SET status = 'closed', close_datetime = ?, exitComment = ? "
+        "WHERE entry_client_order_id = ?"
+    ),
+    "trade": _insert_sql("trades", TRADE_FIELDS),
+}
+
+
+def _connect(db_file):
+    conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class TradeHistory:
+    """
+    История заявок, исполнений, позиций и сделок в SQLite.
+
+    Все записи идут через очередь в единственный поток-писатель, который
+    сбрасывает их пачками в одной транзакции; чтение идёт отдельными соединениями.
+    """
+
+    def __init__(self, db_file=HISTORY_DB_FILE):
+        self.db_file = db_file
+        self._queue = queue.Queue()
+        self._writer = None
+        self._start_lock = threading.Lock()
+        conn = _connect(db_file)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._run, name="history-writer", daemon=True
+                    )
+                    self._writer.start()
+
+    def _put(self, kind, params):
+        self._ensure_writer()
+        self._queue.put((kind, params))
+
+    def _run(self):
+        conn = _connect(self.db_file)
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=FLUSH_INTERVAL))
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                continue
+            events = []
+            records = []
+            for item in batch:
+                if item[0] == "stop":
+                    stopping = True
+                    events.append(item[1])
+                elif item[0] == "flush":
+                    events.append(item[1])
+                else:
+                    records.append(item)
+            try:
+                self._write(conn, records)
+            finally:
+                for event in events:
+                    event.set()
+        conn.close()
+
+    def _write(self, conn, records):
+        """
+        Пишет пачку одной транзакцией; если она не прошла, повторяет записи
+        по одной, чтобы одна ошибочная строка не потеряла остальные.
+        """
+        try:
+            with conn:
+                for kind, params in records:
+                    conn.execute(_STATEMENTS[kind], params)
+            return
+        except Exception as e:
+            logging.error(
+                f"Failed to write {len(records)} history records, "
+                f"retrying one by one: {str(e)}"
+            )
+        for kind, params in records:
+            try:
+                with conn:
+                    conn.execute(_STATEMENTS[kind], params)
+            except Exception as e:
+                logging.error(f"Dropped history record {kind} {params!r}: {str(e)}")
+
+    def flush(self, timeout=5):
+        """
+        Дожидается записи всех поставленных в очередь записей.
+        """
+        self._ensure_writer()
+        event = threading.Event()
+        self._queue.put(("flush", event))
+        return event.wait(timeout)
+
+    def stop(self, timeout=5):
+        """
+        Дописывает очередь и останавливает поток-писатель.
+        """
+        if self._writer is None:
+            return True
+        event = threading.Event()
+        self._queue.put(("stop", event))
+        done = event.wait(timeout)
+        self._writer.join(timeout)
+        self._writer = None
+        return done
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def record_order(self, order):
+        order = dict(order)
+        order.setdefault("created_datetime", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self._put("order", tuple(order.get(field) for field in ORDER_FIELDS))
+
+    def record_fill(self, fill):
+        fill = dict(fill)
+        fill.setdefault("fill_datetime", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self._put("fill", tuple(fill.get(field) for field in FILL_FIELDS))
+
+    def record_position_open(self, ticker, position):
+        row = dict(position, ticker=ticker)
+        row["entry_client_order_id"] = position.get("client_order_id")
+        row["entry_exchange_order_id"] = position.get("exchange_order_id")
+        self._put("position_open", tuple(row.get(field) for field in POSITION_FIELDS))
+
+    def record_trade(self, trade_data, position_closed=True):
+        """
+        Записывает сделку; позиция в истории закрывается, только если
+        position_closed (частичное закрытие оставляет её открытой).
+        """
+        self._put("trade", tuple(trade_data.get(field) for field in TRADE_FIELDS))
+        if not position_closed:
+            return
+        self._put(
+            "position_close",
+            (
+                trade_data.get("close_datetime"),
+                trade_data.get("exitComment"),
+                trade_data.get("entry_client_order_id"),
+            ),
+        )
+
+    def _query(self, table, filters, order_by, limit):
+        clauses, params = [], []
+        for clause, value in filters:
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        sql = f"SELECT * FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        conn = _connect(self.db_file)
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def query_trades(
+        self,
+        ticker=None,
+        figi=None,
+        exit_comment=None,
+        since=None,
+        until=None,
+        limit=None,
+    ):
+        """
+        Ищет закрытые сделки.
+
+        Args:
+            ticker: Тикер.
+            figi: FIGI.
+            exit_comment: Причина закрытия (например, "ShortStop").
+            since: Начало периода по close_datetime (ISO, включительно).
+            until: Конец периода по close_datetime (ISO, не включительно).
+            limit: Максимальное число строк.
+
+        Returns:
+            list: Сделки в виде словарей, новые первыми.
+        """
+        return self._query(
+            "trades",
+            [
+                ("ticker = ?", ticker),
+                ("figi = ?", figi),
+                ("exitComment = ?", exit_comment),
+                ("close_datetime >= ?", since),
+                ("close_datetime < ?", until),
+            ],
+            "close_datetime DESC",
+            limit,
+        )
+
+    def realized_pnl(self, since):
+        """
+        Возвращает сумму profit_net сделок, закрытых начиная с since (ISO).
+        """
+        conn = _connect(self.db_file)
+        try:
+            row = conn.execute(
+                "SELECT COALESCE(SUM(profit_net), 0) FROM trades "
+                "WHERE close_datetime >= ?",
+                (since,),
+            ).fetchone()
+            return float(row[0])
+        finally:
+            conn.close()
+
+    def query_positions(
+        self, ticker=None, status=None, since=None, until=None, limit=None
+    ):
+        return self._query(
+            "positions",
+            [
+                ("ticker = ?", ticker),
+                ("status = ?", status),
+                ("open_datetime >= ?", since),
+                ("open_datetime < ?", until),
+            ],
+            "open_datetime DESC",
+            limit,
+        )
+
+    def query_orders(
+        self, order_id=None, ticker=None, since=None, until=None, limit=None
+    ):
+        return self._query(
+            "orders",
+            [
+                ("? IN (exchange_order_id, client_order_id)", order_id),
+                ("ticker = ?", ticker),
+                ("created_datetime >= ?", since),
+                ("created_datetime < ?", until),
+            ],
+            "created_datetime DESC",
+            limit,
+        )
+
+    def migrate_from_files(
+        self, csv_file=TRADES_CSV_FILE, positions_file=POSITIONS_FILE
+    ):
+        """
+        Переносит trades.csv и positions.json в базу (повторный запуск безопасен).
+
+        Returns:
+            tuple: (число сделок, число позиций).
+        """
+        trades = 0
+        if os.path.exists(csv_file):
+            with open(csv_file, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.record_trade(
+                        {k: (v if v != "" else None) for k, v in row.items()}
+                    )
+                    trades += 1
+        positions = load_positions_from_json(positions_file)
+        for ticker, position in positions.items():
+            self.record_position_open(ticker, position)
+        self.flush(timeout=60)
+        logging.info(
+            f"Migrated {trades} trades and {len(positions)} positions into {self.db_file}"
+        )
+        return trades, len(positions)
+
+
+# Общий журнал процесса
+history = TradeHistory()
+
+
+def journal_trade(trade_data, position_closed=True):
+    """
+    Записывает закрытую сделку в историю и в trades.csv.
+
+    Args:
+        trade_data: Данные сделки.
+        position_closed: False для частичного закрытия — позиция остаётся открытой.
+    """
+    history.record_trade(trade_data, position_closed)
+    log_trade_to_csv(trade_data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="История заявок, позиций и сделок")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser(
+        "migrate", help="Импорт trades.csv и positions.json"
+    )
+    migrate.add_argument("--csv", default=TRADES_CSV_FILE)
+    migrate.add_argument("--positions", default=POSITIONS_FILE)
+
+    for name in ("trades", "positions", "orders"):
+        sub = subparsers.add_parser(name, help=f"Поиск: {name}")
+        sub.add_argument("--ticker")
+        sub.add_argument("--since", help="Начало периода, например 2026-09-01")
+        sub.add_argument("--until", help="Конец периода (не включительно)")
+        sub.add_argument("--limit", type=int)
+        if name == "trades":
+            sub.add_argument("--figi")
+            sub.add_argument("--exit-comment")
+        if name == "positions":
+            sub.add_argument("--status", choices=["open", "closed"])
+        if name == "orders":
+            sub.add_argument("--order-id")
+
+    args = parser.parse_args(argv)
+    if args.command == "migrate":
+        trades, positions = history.migrate_from_files(args.csv, args.positions)
+        print(f"Импортировано сделок: {trades}, позиций: {positions}")
+        return
+    if args.command == "trades":
+        rows = history.query_trades(
+            args.ticker,
+            args.figi,
+            args.exit_comment,
+            args.since,
+            args.until,
+            args.limit,
+        )
+    elif args.command == "positions":
+        rows = history.query_positions(
+            args.ticker, args.status, args.since, args.until, args.limit
+        )
+    else:
+        rows = history.query_orders(
+            args.order_id, args.ticker, args.since, args.until, args.limit
+        )
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
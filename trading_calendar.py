@@ -0,0 +1,332 @@
+import bisect
+import json
+import os
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+CALENDAR_CONFIG_FILE = os.path.join(os.path.dirname(__file__), "calendar_config.json")
+SCHEDULE_CACHE_FILE = os.path.join(os.path.dirname(__file__), "trading_schedule.json")
+
+DEFAULT_CALENDAR_CONFIG = {
+    "enabled": True,
+    # Биржа расписания по умолчанию и переопределения по тикерам
+    "exchange": "MOEX",
+    "tickers": {},
+    # reject — отклонять сигналы вне сессии; queue — исполнить на открытии
+    "outside_session": "reject",
+    # Сигналы из очереди старше этого возраста на открытии отбрасываются, секунды
+    "max_queue_age": 3600,
+    # За сколько секунд до открытия прогревать каналы и кэши
+    "warmup_lead": 300,
+    # Инструменты для прогрева кэша: {"SBER": "BBG004730N88"}; открытые позиции добавляются сами
+    "watchlist": {},
+    # Горизонт загрузки расписания, дни, и интервал его обновления, секунды
+    "schedule_days": 7,
+    "refresh_interval": 6 * 3600,
+}
+
+
+def load_calendar_config(file_path=CALENDAR_CONFIG_FILE):
+    """
+    Загружает настройки торгового календаря из JSON-файла поверх значений по умолчанию.
+
+    Returns:
+        dict: Настройки календаря.
+    """
+    config = json.loads(json.dumps(DEFAULT_CALENDAR_CONFIG))
+    try:
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                config.update(json.load(f))
+            logging.info(f"Loaded calendar config from {file_path}: {config}")
+    except Exception as e:
+        logging.error(f"Error loading calendar config from {file_path}: {str(e)}")
+    return config
+
+
+def sessions_from_schedule(days):
+    """
+    Преобразует дни из trading_schedules в отсортированный список сессий.
+
+    Args:
+        days: TradingDay из ответа trading_schedules.
+
+    Returns:
+        list: [[start, end], ...] в секундах Unix-времени.
+    """
+    sessions = []
+    for day in days:
+        if not day.is_trading_day:
+            continue
+        for start, end in (
+            (day.start_time, day.end_time),
+            (
+                getattr(day, "evening_start_time", None),
+                getattr(day, "evening_end_time", None),
+            ),
+        ):
+            if not start or not end or end <= start:
+                continue
+            start_ts, end_ts = start.timestamp(), end.timestamp()
+            # Вечерняя сессия может входить в интервал основной
+            if sessions and start_ts <= sessions[-1][1]:
+                sessions[-1][1] = max(sessions[-1][1], end_ts)
+            else:
+                sessions.append([start_ts, end_ts])
+    sessions.sort()
+    return sessions
+
+
+class TradingScheduler:
+    """
+    Торговый календарь и прогрев перед открытием сессии.
+
+    Расписание бирж кэшируется в памяти и в trading_schedule.json, поэтому
+    проверка is_open не делает запросов к брокеру. Фоновый поток обновляет
+    расписание, за warmup_lead секунд до открытия вызывает on_warmup, а на
+    открытии передаёт накопленные сигналы в on_open.
+    """
+
+    def __init__(
+        self,
+        token,
+        client_factory,
+        config=None,
+        on_warmup=None,
+        on_open=None,
+        cache_file=SCHEDULE_CACHE_FILE,
+    ):
+        self.token = token
+        self.client_factory = client_factory
+        self.config = config if config is not None else load_calendar_config()
+        self.on_warmup = on_warmup
+        self.on_open = on_open
+        self.cache_file = cache_file
+        self._schedules = {}
+        self._queue = []
+        self._lock = threading.Lock()
+        self._warmed_for = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._load_cache()
+
+    def exchange_for(self, ticker):
+        return self.config["tickers"].get(ticker, self.config["exchange"])
+
+    def _exchanges(self):
+        return {self.config["exchange"], *self.config["tickers"].values()}
+
+    def _set_schedule(self, exchange, sessions, updated):
+        # Словарь подменяется целиком: is_open читает его без блокировки
+        schedules = dict(self._schedules)
+        schedules[exchange] = {
+            "sessions": sessions,
+            "starts": [start for start, _ in sessions],
+            "updated": updated,
+        }
+        self._schedules = schedules
+
+    def _load_cache(self):
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                for exchange, entry in cached.items():
+                    self._set_schedule(exchange, entry["sessions"], entry["updated"])
+                logging.info(f"Loaded trading schedule cache from {self.cache_file}")
+        except Exception as e:
+            logging.error(
+                f"Error loading trading schedule from {self.cache_file}: {str(e)}"
+            )
+
+    def _save_cache(self):
+        try:
+            with open(self.cache_file, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        exchange: {
+                            "sessions": schedule["sessions"],
+                            "updated": schedule["updated"],
+                        }
+                        for exchange, schedule in self._schedules.items()
+                    },
+                    f,
+                )
+        except Exception as e:
+            logging.error(
+                f"Error saving trading schedule to {self.cache_file}: {str(e)}"
+            )
+
+    def _session_at(self, exchange, now):
+        # Возвращает (открыта ли сессия, начало следующей сессии) или None без расписания
+        schedule = self._schedules.get(exchange)
+        if schedule is None:
+            return None
+        sessions = schedule["sessions"]
+        index = bisect.bisect_right(schedule["starts"], now) - 1
+        if index >= 0 and now < sessions[index][1]:
+            return True, sessions[index][0]
+        if index + 1 < len(sessions):
+            return False, sessions[index + 1][0]
+        # Расписание закончилось — считаем, что данных нет
+        return None
+
+    def is_open(self, ticker, now=None):
+        """
+        Проверяет, идёт ли торговая сессия для тикера.
+
+        Без расписания (брокер недоступен, кэша нет) возвращает True, чтобы не
+        блокировать торговлю из-за календаря.
+        """
+        if not self.config["enabled"]:
+            return True
+        session = self._session_at(
+            self.exchange_for(ticker), now if now is not None else time.time()
+        )
+        return True if session is None else session[0]
+
+    def next_open(self, ticker, now=None):
+        session = self._session_at(
+            self.exchange_for(ticker), now if now is not None else time.time()
+        )
+        if session is None or session[0]:
+            return None
+        return session[1]
+
+    def defer(self, ticker, signal):
+        """
+        Применяет политику outside_session к сигналу вне сессии.
+
+        Returns:
+            bool: True, если сигнал поставлен в очередь до открытия.
+        """
+        if self.config["outside_session"] != "queue":
+            return False
+        with self._lock:
+            self._queue.append((time.time(), ticker, signal))
+        logging.info(f"Queued signal for {ticker} until session open")
+        return True
+
+    def queued(self):
+        with self._lock:
+            return len(self._queue)
+
+    def snapshot(self):
+        now = time.time()
+        return {
+            exchange: {
+                "open": bool((self._session_at(exchange, now) or (True,))[0]),
+                "updated": schedule["updated"],
+                "sessions": len(schedule["sessions"]),
+            }
+            for exchange, schedule in self._schedules.items()
+        }
+
+    def refresh(self, client):
+        """
+        Загружает расписание всех используемых бирж на schedule_days дней вперёд.
+        """
+        now = datetime.now(timezone.utc)
+        for exchange in self._exchanges():
+            try:
+                response = client.instruments.trading_schedules(
+                    exchange=exchange,
+                    from_=now - timedelta(days=1),
+                    to=now + timedelta(days=self.config["schedule_days"]),
+                )
+            except Exception as e:
+                logging.error(f"Failed to load trading schedule {exchange}: {str(e)}")
+                continue
+            days = [day for item in response.exchanges for day in item.days]
+            self._set_schedule(exchange, sessions_from_schedule(days), time.time())
+            logging.info(f"Loaded trading schedule for {exchange}: {len(days)} days")
+        self._save_cache()
+
+    def start(self):
+        if not self.config["enabled"]:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="trading-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _next_open(self, now):
+        opens = [
+            session[1]
+            for session in (
+                self._session_at(exchange, now) for exchange in self._schedules
+            )
+            if session is not None and not session[0]
+        ]
+        return min(opens) if opens else None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            now = time.time()
+            stale = [
+                exchange
+                for exchange in self._exchanges()
+                if exchange not in self._schedules
+                or now - self._schedules[exchange]["updated"]
+                > self.config["refresh_interval"]
+            ]
+            if stale:
+                try:
+                    with self.client_factory(self.token) as client:
+                        self.refresh(client)
+                except Exception as e:
+                    logging.error(f"Failed to refresh trading schedule: {str(e)}")
+
+            next_open = self._next_open(now)
+            if next_open is not None:
+                if (
+                    next_open - now <= self.config["warmup_lead"]
+                    and self._warmed_for != next_open
+                ):
+                    self._warmed_for = next_open
+                    self._warmup()
+            if self.queued():
+                self._release()
+
+            # Просыпаемся к прогреву или к открытию, но не реже раза в минуту
+            wait = 60
+            if next_open is not None:
+                warmup_at = next_open - self.config["warmup_lead"]
+                target = warmup_at if warmup_at > now else next_open
+                wait = min(wait, max(target - now, 1))
+            self._stopping.wait(wait)
+
+    def _warmup(self):
+        if self.on_warmup is None:
+            return
+        started = time.monotonic()
+        try:
+            self.on_warmup()
+            logging.info(
+                f"Pre-market warm-up done in {time.monotonic() - started:.2f}s"
+            )
+        except Exception as e:
+            logging.error(f"Pre-market warm-up failed: {str(e)}")
+
+    def _release(self):
+        now = time.time()
+        with self._lock:
+            ready = [item for item in self._queue if self.is_open(item[1], now)]
+            self._queue = [item for item in self._queue if item not in ready]
+        for queued_at, ticker, signal in ready:
+            if now - queued_at > self.config["max_queue_age"]:
+                logging.error(f"Dropped stale queued signal for {ticker}")
+                continue
+            if self.on_open is None:
+                continue
+            try:
+                self.on_open(signal)
+            except Exception as e:
+                logging.error(f"Failed to execute queued signal for {ticker}: {str(e)}")